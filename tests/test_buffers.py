@@ -0,0 +1,98 @@
+"""Tests of the append buffers and the append-only checkpoint files."""
+
+import os
+
+import numpy as np
+import pytest
+
+from wavetracker.buffers import AppendBuffer, append_rows, read_rows
+
+
+@pytest.mark.parametrize("row_shape", [(), (3,)])
+def test_append_rows_appends_after_start(tmp_path, row_shape):
+    filename = tmp_path / "rows.bin"
+    rows = np.arange(np.prod((10, *row_shape)), dtype=float)
+    rows = rows.reshape((10, *row_shape))
+    buffer = AppendBuffer(chunk_size=2, max_memory=0, spill_dir=tmp_path)
+    buffer.extend(rows[:4])
+    append_rows(filename, buffer)
+    # rows of an interrupted write after the valid ones are replaced
+    with open(filename, "ab") as f:
+        f.write(b"garbage")
+    buffer.extend(rows[4:])
+    append_rows(filename, buffer, 4)
+    np.testing.assert_array_equal(
+        read_rows(filename, buffer.dtype, row_shape, 10), rows
+    )
+    assert filename.stat().st_size == rows.nbytes
+
+    array_file = tmp_path / "array.bin"
+    append_rows(array_file, rows[:3])
+    append_rows(array_file, rows, 3)
+    np.testing.assert_array_equal(
+        read_rows(array_file, rows.dtype, row_shape, 10), rows
+    )
+
+
+@pytest.mark.parametrize("dtype", [None, float])
+def test_append_rows_of_empty_buffer(tmp_path, dtype):
+    filename = tmp_path / "rows.bin"
+    append_rows(filename, AppendBuffer(dtype=dtype))
+    assert filename.stat().st_size == 0
+
+
+@pytest.mark.parametrize("row_shape", [(), (3,)])
+@pytest.mark.parametrize("max_memory", [None, 0])
+def test_buffer_matches_array(tmp_path, row_shape, max_memory):
+    rows = np.arange(np.prod((23, *row_shape)), dtype=np.float32)
+    rows = rows.reshape((23, *row_shape))
+    buffer = AppendBuffer(
+        chunk_size=2,
+        max_chunk_size=4,
+        max_memory=max_memory,
+        spill_dir=tmp_path,
+    )
+    for i in range(0, len(rows), 5):
+        buffer.extend(rows[i : i + 5])
+    assert len(buffer) == len(rows)
+    if max_memory == 0:
+        # rows are split between the spill file and the chunks in memory
+        assert 0 < buffer._spilled < len(rows)
+        assert buffer.nbytes < rows.nbytes
+
+    np.testing.assert_array_equal(buffer.to_array(), rows)
+    np.testing.assert_array_equal(np.asarray(buffer), rows)
+    for start in range(len(rows) + 1):
+        np.testing.assert_array_equal(
+            np.concatenate(
+                [np.empty((0, *row_shape), np.float32)]
+                + list(buffer.iter_chunks(start))
+            ),
+            rows[start:],
+        )
+        buffer.tofile(tmp_path / "rows.bin", start=start)
+        np.testing.assert_array_equal(
+            np.fromfile(tmp_path / "rows.bin", dtype=np.float32),
+            rows[start:].ravel(),
+        )
+    buffer.save(tmp_path / "rows.npy")
+    saved = np.load(tmp_path / "rows.npy")
+    assert saved.dtype == rows.dtype
+    np.testing.assert_array_equal(saved, rows)
+
+    spill_file = buffer.spill_file
+    buffer.clear()
+    assert len(buffer) == 0
+    if spill_file is not None:
+        assert not os.path.exists(spill_file)
+
+
+def test_empty_buffer(tmp_path):
+    buffer = AppendBuffer(chunk_size=2, max_memory=0, spill_dir=tmp_path)
+    assert buffer.to_array().size == 0
+    buffer.save(tmp_path / "empty.npy")
+    assert np.load(tmp_path / "empty.npy").size == 0
+
+    buffer = AppendBuffer(dtype=int, row_shape=(2,))
+    buffer.save(tmp_path / "empty.npy")
+    assert np.load(tmp_path / "empty.npy").shape == (0, 2)
@@ -0,0 +1,103 @@
+"""
+The memory-mapped reader against thunderlab's DataLoader.
+
+Small .wav files and a fishgrid .raw file are read with both readers, which
+must return the same scaled sample values, also for reads and blocks that
+span the borders between the files of a session.
+"""
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from thunderlab.dataloader import DataLoader
+
+from wavetracker.datahandler import MemmapDataLoader, open_memmap_data
+
+RATE = 20000
+FISHGRID_CFG = """\
+*FishGrid
+  Grid 1
+     Used1      : true
+     Columns1   : 2
+     Rows1      : 3
+*HardWare Settings
+  DAQ board:
+     AISampleRate: 20.000kHz
+     AIMaxVolt   : 2.5mV
+"""
+
+
+def signal(frames: int, channels: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.clip(0.2 * rng.standard_normal((frames, channels)), -1, 0.99)
+
+
+def write_wav(path, data: np.ndarray, dtype) -> None:
+    if not np.issubdtype(dtype, np.integer):
+        # the wave module thunderlab falls back to reads only PCM files
+        pytest.importorskip("soundfile")
+    else:
+        data = data * 2.0 ** (8 * np.dtype(dtype).itemsize - 1)
+    wavfile.write(path, RATE, data.astype(dtype))
+
+
+def assert_same_data(data: MemmapDataLoader, expected: DataLoader) -> None:
+    assert data.shape == expected.shape
+    assert data.rate == expected.rate
+    assert data.channels == expected.channels
+    assert data.ampl_max == expected.ampl_max
+    n = len(expected)
+    np.testing.assert_allclose(data[:], expected[:n], rtol=1e-6)
+    for start, stop in [(0, 1), (5, 700), (n - 300, n), (n // 2, n // 2 + 1)]:
+        np.testing.assert_allclose(
+            data[start:stop], expected[start:stop], rtol=1e-6
+        )
+    np.testing.assert_allclose(data[n - 1], expected[n - 1], rtol=1e-6)
+    np.testing.assert_allclose(data[10:200, 1], expected[10:200, 1], rtol=1e-6)
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.float32])
+def test_wav_matches_dataloader(tmp_path, dtype):
+    path = str(tmp_path / "recording.wav")
+    write_wav(path, signal(3000, 4), dtype)
+    data = open_memmap_data(path)
+    assert isinstance(data, MemmapDataLoader)
+    assert data.read(0, 10).dtype == np.float32
+    with DataLoader(path, buffersize=0.01) as expected:
+        assert_same_data(data, expected)
+
+
+def test_fishgrid_matches_dataloader(tmp_path):
+    (tmp_path / "fishgrid.cfg").write_text(FISHGRID_CFG)
+    signal(3000, 6).astype(np.float32).tofile(tmp_path / "traces-grid1.raw")
+    path = str(tmp_path / "traces-grid1.raw")
+    data = open_memmap_data(path)
+    assert isinstance(data, MemmapDataLoader)
+    with DataLoader(path, buffersize=0.01) as expected:
+        assert expected.format == "FISHGRID"
+        assert_same_data(data, expected)
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.float32])
+def test_session_reads_across_files(tmp_path, dtype):
+    paths = []
+    for i, frames in enumerate([1000, 1, 1300, 700]):
+        paths.append(str(tmp_path / f"recording-{i}.wav"))
+        write_wav(paths[-1], signal(frames, 3, seed=i), dtype)
+    data = open_memmap_data(paths)
+    assert isinstance(data, MemmapDataLoader)
+    with DataLoader(paths, buffersize=0.01, mode="relaxed") as expected:
+        assert len(expected) == 3001
+        assert_same_data(data, expected)
+        # around and across the file borders
+        for start, stop in [(990, 1010), (1000, 1001), (999, 2302), (0, 3001)]:
+            np.testing.assert_allclose(
+                data[start:stop], expected[start:stop], rtol=1e-6
+            )
+        blocks = list(data.blocks(256, noverlap=64))
+        assert len(blocks) > 1
+        for k, block in enumerate(blocks):
+            start = k * (256 - 64)
+            np.testing.assert_allclose(
+                block, expected[start : start + len(block)], rtol=1e-6
+            )
@@ -0,0 +1,292 @@
+"""
+Regression test of the harmonic group engines against the original detection.
+
+The reference is a direct numba port of the CUDA kernels `detect_peaks_fixed`
+and `get_group` and of the assignment loop as they were before the candidate
+fundamentals were deduplicated, the harmonics searched in the sorted peaks
+and the assignment compiled. The numba and torch engines must give the same
+`assigned_hg`. Sorts are stable, so that ties between peaks or groups of
+equal power are resolved the same way in all of them.
+"""
+
+import types
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numba import njit
+from ruamel.yaml import YAML
+
+from wavetracker import cpu_harmonic_group
+from wavetracker.gpu_harmonic_group import harmonic_group_pipeline
+
+CFG_FILE = Path(__file__).parents[1] / "wavetracker" / "cfg.yaml"
+
+
+@njit(cache=True)
+def reference_detect_peaks(
+    data,
+    peaks,
+    trough,
+    spec_freq,
+    low_threshold,
+    high_threshold,
+    min_freq,
+    max_freq,
+    mains_freq,
+    mains_freq_tol,
+    min_good_peak_power,
+):
+    direction = 0
+    min_inx = 0
+    trough_count = 0
+    last_min_idx = 0
+    max_inx = 0
+    peak_count = 0
+    last_max_idx = 0
+    min_value = data[0]
+    max_value = min_value
+    p, t = 0, 0
+
+    for i in range(len(data)):
+        if direction > 0:
+            if data[i] > max_value:
+                max_inx = i
+                max_value = data[i]
+            if data[i] <= max_value - low_threshold:
+                peaks[max_inx] = 1
+                p = 1
+                last_max_idx = max_inx
+                peak_count += 1
+                direction = -1
+                min_inx = i
+                min_value = data[i]
+
+        if direction < 0:
+            if data[i] < min_value:
+                min_inx = i
+                min_value = data[i]
+            if data[i] >= min_value + low_threshold:
+                trough[min_inx] = 1
+                t = 1
+                last_min_idx = min_inx
+                trough_count += 1
+                direction = +1
+                max_inx = i
+                max_value = data[i]
+
+        if direction == 0:
+            if data[i] <= max_value - low_threshold:
+                direction = -1
+            if data[i] >= min_value + low_threshold:
+                direction = 1
+            if data[i] > max_value:
+                max_inx = i
+                max_value = data[i]
+            if data[i] < min_value:
+                min_inx = i
+                min_value = data[i]
+
+        if p != 0 and t != 0:
+            p, t = 0, 0
+            if not data[last_max_idx] - data[last_min_idx] > high_threshold:
+                continue
+            if (
+                spec_freq[last_max_idx] < min_freq
+                or spec_freq[last_max_idx] > max_freq
+            ):
+                continue
+            if spec_freq[last_max_idx] % mains_freq < mains_freq_tol:
+                continue
+            if (
+                abs(spec_freq[last_max_idx] % mains_freq - mains_freq)
+                < mains_freq_tol
+            ):
+                continue
+            if data[last_max_idx] < min_good_peak_power:
+                continue
+            peaks[last_max_idx] = 2
+            trough[last_min_idx] = 2
+
+    if peak_count > trough_count:
+        peaks[last_max_idx] = 0
+    elif peak_count < trough_count:
+        trough[last_min_idx] = 0
+
+
+@njit(cache=True)
+def reference_get_group(
+    freq,
+    log_spec,
+    spec_freqs,
+    peaks,
+    out,
+    min_group_size,
+    max_freq_tol,
+    mains_freq,
+    mains_freq_tol,
+):
+    fzero = freq
+    fzero_h = 1
+    for h in range(1, len(out)):
+        ioi = 0
+        fe = 1e6
+        for i in range(len(peaks)):
+            if peaks[i] != 0:
+                new_fe = abs(spec_freqs[i] / h - fzero / fzero_h)
+                if new_fe < fe and new_fe < max_freq_tol:
+                    ioi = i
+                    fe = new_fe
+                if new_fe > fe:
+                    if ioi != 0:
+                        fzero = spec_freqs[ioi]
+                        fzero_h = h
+                        out[h - 1] = ioi
+
+    peak_sum = 0.0
+    n = 0
+    nn = 0
+    for i in range(min_group_size):
+        if out[i] != 0:
+            nn += 1
+            if (
+                spec_freqs[out[i]] % mains_freq < mains_freq_tol
+                or abs(spec_freqs[out[i]] % mains_freq - 50) < mains_freq_tol
+            ):
+                continue
+            n += 1
+            peak_sum += log_spec[out[i]]
+
+    peak_mean = peak_sum / n if n != 0 else -1e6
+    return peak_mean if nn >= min_group_size - 1 else -1e6
+
+
+def reference_pipeline(spec, spec_freq, cfg, thresholds):
+    """Harmonic groups of the original detection (times x frequencies)."""
+    hg = cfg.harmonic_groups
+    min_group_size = hg["min_group_size"]
+    log_spec = cpu_harmonic_group.jit_decibel(
+        np.ascontiguousarray(spec.T, dtype=np.float32)
+    )
+    if thresholds is None:
+        thresholds = cpu_harmonic_group.thresholds_from_std(
+            cpu_harmonic_group.threshold_estimate_coordinator(log_spec), cfg
+        )
+
+    peaks = np.zeros_like(log_spec)
+    troughs = np.zeros_like(log_spec)
+    for i in range(len(log_spec)):
+        reference_detect_peaks(
+            log_spec[i],
+            peaks[i],
+            troughs[i],
+            spec_freq,
+            float(thresholds[0]),
+            float(thresholds[1]),
+            float(hg["min_freq"]),
+            float(hg["max_freq"]),
+            float(hg["mains_freq"]),
+            float(hg["mains_freq_tol"]),
+            float(hg["min_good_peak_power"]),
+        )
+
+    max_group_size = cpu_harmonic_group.max_group_size(cfg)
+    n_check = hg["max_divisor"] * int(np.max(np.sum(peaks == 2, axis=1)))
+    check_freqs = np.zeros((len(peaks), n_check))
+    for i in range(len(peaks)):
+        fs = spec_freq[peaks[i] == 2]
+        fs = fs[(fs < hg["max_freq"]) & (fs > hg["min_freq"])]
+        for d in range(hg["max_divisor"]):
+            check_freqs[i, d * len(fs) : (d + 1) * len(fs)] = fs / (d + 1)
+
+    out = np.zeros((len(peaks), n_check, max_group_size), dtype=int)
+    value = np.zeros((len(peaks), n_check))
+    for i in range(len(peaks)):
+        for j in range(n_check):
+            if check_freqs[i, j] == 0:
+                continue
+            value[i, j] = reference_get_group(
+                check_freqs[i, j],
+                log_spec[i],
+                spec_freq,
+                peaks[i],
+                out[i, j],
+                min_group_size,
+                float(hg["max_freq_tol"]),
+                float(hg["mains_freq"]),
+                float(hg["mains_freq_tol"]),
+            )
+
+    harmonic_helper = np.cumsum(out > 0, axis=2)
+    assigned_hg = np.zeros_like(peaks)
+    for t in range(len(peaks)):
+        next_hg = 1
+        assigned = np.zeros_like(peaks[t])
+        peak_idxs = np.flatnonzero(peaks[t] == 2)
+        sorting = np.argsort(log_spec[t][peak_idxs], kind="stable")[::-1]
+        search_freq_count = np.count_nonzero(check_freqs[t])
+        order = np.argsort(value[t, :search_freq_count], kind="stable")[::-1]
+        order = order[
+            harmonic_helper[t, order, min_group_size - 1] == min_group_size
+        ]
+        for search_peak_idx in peak_idxs[sorting]:
+            for i in order:
+                if search_peak_idx not in out[t, i, :min_group_size]:
+                    continue
+                non_zero_h = np.flatnonzero(out[t, i]) + 1
+                non_zero_idx = out[t, i][out[t, i] != 0]
+                if (
+                    log_spec[t, non_zero_idx[0]]
+                    < hg["min_good_peak_power"]
+                ):
+                    continue
+                if non_zero_h[0] != 1:
+                    continue
+                if 2 in assigned[non_zero_idx]:
+                    continue
+                if np.sum(assigned[non_zero_idx]) == 0:
+                    assigned[non_zero_idx] += 1
+                    assigned_hg[t, non_zero_idx] = next_hg
+                    next_hg += 1
+                    break
+    return assigned_hg
+
+
+def synthetic_spectrogram(seed, quantize):
+    """Noise with harmonic stacks of random fish (frequencies x times)."""
+    rng = np.random.default_rng(seed)
+    spec_freq = np.fft.rfftfreq(8192, 1 / 20000)
+    n_times = 24
+    spec = rng.exponential(1e-9, (len(spec_freq), n_times))
+    for t in range(n_times):
+        for f0 in rng.uniform(400, 1200, 8):
+            b = np.argmin(np.abs(spec_freq - f0))
+            for h in range(1, 6):
+                if b * h < len(spec_freq) - 1:
+                    power = 10 ** rng.uniform(-5, -3) / h
+                    spec[b * h - 1 : b * h + 2, t] += power
+    if quantize:
+        # coarse power levels give peaks and groups of equal power
+        spec = np.round(spec / 3e-10) * 3e-10 + 1e-15
+    return spec.astype(np.float32), spec_freq
+
+
+@pytest.fixture(scope="module")
+def cfg():
+    with open(CFG_FILE) as f:
+        harmonic_groups = YAML(typ="safe").load(f)["harmonic_groups"]
+    return types.SimpleNamespace(harmonic_groups=harmonic_groups)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("quantize", [False, True])
+@pytest.mark.parametrize("thresholds", [None, (2.0, 4.0), (1.0, 3.0)])
+@pytest.mark.parametrize("engine", ["numba", "torch"])
+def test_engines_match_reference(cfg, seed, quantize, thresholds, engine):
+    spec, spec_freq = synthetic_spectrogram(seed, quantize)
+    expected = reference_pipeline(spec, spec_freq, cfg, thresholds)
+    assert np.count_nonzero(expected) > 0
+    assigned_hg, _, _ = harmonic_group_pipeline(
+        spec, spec_freq, cfg, engine=engine, thresholds=thresholds
+    )
+    np.testing.assert_array_equal(assigned_hg, expected)
@@ -0,0 +1,113 @@
+"""
+Interrupting an analysis and resuming it from its checkpoint.
+
+A short synthetic recording is analysed once without interruption and once
+with an error after a few snippets, followed by a run with `resume`. Both
+must store the same detections and spectrograms. The tracking is replaced
+by a stub, it only runs on the stored detections.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from ruamel.yaml import YAML
+from scipy.io import wavfile
+
+from wavetracker.finespec import open_fine_spec
+
+wt = pytest.importorskip("wavetracker.wavetracker")
+
+CFG_FILE = Path(__file__).parents[1] / "wavetracker" / "cfg.yaml"
+OUTPUTS = ["fund_v", "idx_v", "sign_v", "times", "sparse_spectra"]
+
+
+class Interrupt(Exception):
+    """Stops an analysis after a number of snippets."""
+
+
+def write_recording(root: Path) -> Path:
+    """Two fish on two channels, 12s at 20kHz."""
+    folder = root / "raw" / "session" / "recording"
+    folder.mkdir(parents=True)
+    samplerate = 20000
+    t = np.arange(12 * samplerate) / samplerate
+    data = np.zeros((len(t), 2))
+    for eodf, amplitudes in [(610.0, (0.2, 0.05)), (845.0, (0.05, 0.2))]:
+        for h in range(1, 4):
+            for c, amplitude in enumerate(amplitudes):
+                data[:, c] += amplitude / h * np.sin(2 * np.pi * h * eodf * t)
+    data += 0.001 * np.random.default_rng(0).standard_normal(data.shape)
+    wavfile.write(
+        folder / "recording.wav", samplerate, (data * 2**15).astype(np.int16)
+    )
+    return folder
+
+
+def analyse(root: Path, analysis: dict, resume: bool = False) -> Path:
+    """Run wavetracker with short snippets, return the output folder."""
+    cfg_folder = root / "cfg"
+    cfg_folder.mkdir(exist_ok=True)
+    yaml = YAML()
+    with open(CFG_FILE) as f:
+        cfg = yaml.load(f)
+    cfg["spectrogram"].update(snippet_size=2, nfft=4096)
+    cfg["analysis"].update(analysis)
+    with open(cfg_folder / "cfg.yaml", "w") as f:
+        yaml.dump(cfg, f)
+    wt.wavetracker(
+        root / "raw" / "session" / "recording",
+        config=str(cfg_folder),
+        resume=resume,
+    )
+    return root / "intermediate" / "session" / "recording"
+
+
+@pytest.fixture
+def no_tracking(monkeypatch):
+    monkeypatch.setattr(
+        wt,
+        "freq_tracking_v6",
+        lambda fund_v, *args, **kwargs: np.full(len(fund_v), np.nan),
+    )
+
+
+@pytest.mark.usefixtures("no_tracking")
+@pytest.mark.parametrize("pipeline_depth", [0, 1])
+def test_resume_matches_uninterrupted_run(
+    tmp_path, monkeypatch, pipeline_depth
+):
+    write_recording(tmp_path / "full")
+    expected = analyse(tmp_path / "full", {"pipeline_depth": pipeline_depth})
+
+    root = tmp_path / "resumed"
+    write_recording(root)
+    analysis = {"pipeline_depth": pipeline_depth, "checkpoint_interval": 2}
+    append_signals = wt.AnalysisPipeline.append_signals
+    calls = []
+
+    def interrupted(self, *args):
+        if len(calls) == 3:
+            raise Interrupt
+        calls.append(None)
+        append_signals(self, *args)
+
+    with monkeypatch.context() as m:
+        m.setattr(wt.AnalysisPipeline, "append_signals", interrupted)
+        with pytest.raises(Interrupt):
+            analyse(root, analysis)
+    output = root / "intermediate" / "session" / "recording"
+    assert (output / "checkpoint" / "state.json").exists()
+    assert not (output / "fund_v.npy").exists()
+
+    output = analyse(root, analysis, resume=True)
+    assert not (output / "checkpoint").exists()
+    for name in OUTPUTS:
+        np.testing.assert_array_equal(
+            np.load(output / f"{name}.npy"), np.load(expected / f"{name}.npy")
+        )
+    assert len(np.load(output / "fund_v.npy")) > 0
+    fine_spec = open_fine_spec(str(output))
+    expected_fine_spec = open_fine_spec(str(expected))
+    np.testing.assert_array_equal(fine_spec[:, :], expected_fine_spec[:, :])
+    np.testing.assert_array_equal(fine_spec.times, expected_fine_spec.times)
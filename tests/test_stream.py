@@ -0,0 +1,127 @@
+"""
+Stream mode against a single transform of the whole recording.
+
+The blocks passed through `StreamCarry` must yield the frames and times of
+`torch.stft` with centered windows over the whole signal, including the
+last windows that reach into the reflected end of the recording, and the
+decimator must give the same output samples with and without streaming.
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from wavetracker.spectrogram import (
+    Decimator,
+    Spectrogram,
+    StreamCarry,
+    pytorch_spec,
+)
+
+SAMPLERATE = 20000
+
+
+def signal(samples: int, channels: int = 2) -> torch.Tensor:
+    rng = np.random.default_rng(samples)
+    return torch.from_numpy(rng.standard_normal((channels, samples)))
+
+
+def split(data: torch.Tensor, block_size: int) -> list:
+    return list(torch.split(data, block_size, dim=-1))
+
+
+@pytest.mark.parametrize(
+    "samples, nfft, step, block_size",
+    [
+        (20000, 1024, 256, 3000),
+        (20000, 1024, 256, 4000),
+        (20000, 1024, 256, 20000),
+        (20001, 1024, 256, 2048),
+        (19999, 512, 128, 777),
+        (20000, 1024, 256, 19999),
+    ],
+)
+def test_stream_matches_stft_of_recording(samples, nfft, step, block_size):
+    data = signal(samples)
+    window = torch.hann_window(nfft, dtype=data.dtype)
+    expected = torch.stft(
+        data, nfft, step, window=window, center=True, return_complex=True
+    ).abs()
+
+    stream = StreamCarry(nfft, step, SAMPLERATE, length=samples)
+    spectra, times = [], []
+    offset = 0
+    for block in split(data, block_size):
+        stream_data, stream_times = stream.extend(block)
+        # times are relative to the start of the block
+        times.append(stream_times + offset / SAMPLERATE)
+        offset += block.shape[-1]
+        if len(stream_times) == 0:
+            continue
+        spectra.append(
+            torch.stft(
+                stream_data,
+                nfft,
+                step,
+                window=window,
+                center=False,
+                return_complex=True,
+            ).abs()
+        )
+        assert spectra[-1].shape[-1] == len(stream_times)
+    spectra = torch.cat(spectra, dim=-1)
+    times = np.concatenate(times)
+
+    assert spectra.shape == expected.shape
+    torch.testing.assert_close(spectra, expected)
+    np.testing.assert_allclose(
+        times, np.arange(expected.shape[-1]) * step / SAMPLERATE
+    )
+
+
+@pytest.mark.parametrize("snippet_size", [3000, 4000])
+def test_stream_snippets_match_spectrogram_of_recording(snippet_size):
+    data = signal(20000)
+    spec = Spectrogram(
+        samplerate=SAMPLERATE,
+        data_shape=(20000, 2),
+        snippet_size=snippet_size,
+        snippet_overlap=0,
+        nfft=1024,
+        overlap_frac=0.75,
+        step=256,
+        noverlap=768,
+        channels=-1,
+        folder="",
+        stream=True,
+    )
+    spectra, times = [], []
+    for k, block in enumerate(split(data, snippet_size)):
+        snippet_spec, _, _, snippet_times = spec.compute_snippet(block)
+        spectra.append(snippet_spec)
+        times.append(snippet_times + k * snippet_size / SAMPLERATE)
+    expected, _, _ = pytorch_spec(data, 0, SAMPLERATE, 1024, 256)
+    np.testing.assert_allclose(
+        np.concatenate(spectra, axis=-1), expected.numpy()
+    )
+    np.testing.assert_allclose(
+        np.concatenate(times), np.arange(expected.shape[-1]) * 256 / SAMPLERATE
+    )
+
+
+def test_stream_without_length_misses_last_windows():
+    data = signal(20000)
+    stream = StreamCarry(1024, 256, SAMPLERATE)
+    frames = sum(len(stream.extend(b)[1]) for b in split(data, 3000))
+    assert frames == 77
+
+
+@pytest.mark.parametrize("samples", [6000, 6001, 6003])
+@pytest.mark.parametrize("block_size", [1200, 1000, 6000])
+def test_stream_decimation_matches_recording(samples, block_size):
+    data = signal(samples)
+    expected = Decimator(4)(data)
+    decimator = Decimator(4, stream=True, length=samples)
+    decimated = torch.cat([decimator(b) for b in split(data, block_size)], -1)
+    assert decimated.shape == expected.shape
+    torch.testing.assert_close(decimated, expected)
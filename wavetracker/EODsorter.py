@@ -17,6 +17,9 @@ from PyQt5.QtGui import *
 # from .eventdetection import hist_threshold
 from PyQt5.QtWidgets import *
 
+from wavetracker.finespec import load_spectra
+from wavetracker.pyramid import open_pyramid
+
 
 def decibel(power, ref_power=1.0, min_power=1e-20):
     """
@@ -486,6 +489,7 @@ class MainWindow(QMainWindow):
         super(MainWindow, self).__init__(parent)
         self.folder = folder
         self.Plot = PlotWidget()
+        self._spectra_db = None
 
         self.Plot.figure.canvas.mpl_connect(
             "button_press_event", self.buttonpress
@@ -1072,7 +1076,7 @@ class MainWindow(QMainWindow):
         if self.Plot.spec_img_handle:
             self.Plot.spec_img_handle.remove()
         self.Plot.spec_img_handle = self.Plot.ax.imshow(
-            decibel(self.spectra)[::-1],
+            self.spectra_decibel()[::-1],
             extent=[
                 self.times[0],
                 self.times[-1] + (self.times[1] - self.times[0]),
@@ -1213,7 +1217,7 @@ class MainWindow(QMainWindow):
             try:
                 self.spectra = np.load(os.path.join(self.folder, "spec.npy"))
             except:
-                self.spectra = np.load(
+                self.spectra = load_spectra(
                     os.path.join(self.folder, "sparse_spectra.npy")
                 )
 
@@ -1262,43 +1266,22 @@ class MainWindow(QMainWindow):
                 shape=(self.fill_spec_shape[0], self.fill_spec_shape[1]),
                 order="F",
             )
+            self.fill_pyramid = None
             self.Act_fine_spec.setEnabled(True)
             self.Act_interactive_sel.setEnabled(True)
 
         elif os.path.exists(os.path.join(self.folder, "fine_spec.npy")):
-            self.fill_freqs = np.load(
-                os.path.join(self.folder, "fine_freqs.npy")
-            )
-            self.fill_times = np.load(
-                os.path.join(self.folder, "fine_times.npy")
-            )
-            self.fill_spec_shape = np.load(
-                os.path.join(self.folder, "fine_spec_shape.npy")
-            )
-            self.fill_spec = np.memmap(
-                os.path.join(self.folder, "fine_spec.npy"),
-                dtype="float",
-                mode="r",
-                shape=(self.fill_spec_shape[0], self.fill_spec_shape[1]),
-                order="F",
-            )
-
-            self.Plot.fill_freqs = np.load(
-                os.path.join(self.folder, "fine_freqs.npy")
-            )
-            self.Plot.fill_times = np.load(
-                os.path.join(self.folder, "fine_times.npy")
-            )
-            self.Plot.fill_spec_shape = np.load(
-                os.path.join(self.folder, "fine_spec_shape.npy")
-            )
-            self.Plot.fill_spec = np.memmap(
-                os.path.join(self.folder, "fine_spec.npy"),
-                dtype="float",
-                mode="r",
-                shape=(self.fill_spec_shape[0], self.fill_spec_shape[1]),
-                order="F",
-            )
+            self.fill_pyramid = open_pyramid(self.folder)
+            fine_spec = self.fill_pyramid.levels[0]
+            self.fill_freqs = fine_spec.freqs
+            self.fill_times = fine_spec.times
+            self.fill_spec_shape = fine_spec.shape
+            self.fill_spec = fine_spec
+
+            self.Plot.fill_freqs = fine_spec.freqs
+            self.Plot.fill_times = fine_spec.times
+            self.Plot.fill_spec_shape = fine_spec.shape
+            self.Plot.fill_spec = fine_spec
             self.Act_fine_spec.setEnabled(True)
             self.Act_interactive_sel.setEnabled(True)
 
@@ -1307,6 +1290,7 @@ class MainWindow(QMainWindow):
             self.fill_times = None
             self.fill_spec_shape = None
             self.fill_spec = None
+            self.fill_pyramid = None
 
         if self.got_multi_channel:
             if not self.got_single_channel:
@@ -1319,7 +1303,7 @@ class MainWindow(QMainWindow):
         if self.Plot.spec_img_handle:
             self.Plot.spec_img_handle.remove()
         self.Plot.spec_img_handle = self.Plot.ax.imshow(
-            decibel(self.spectra)[::-1],
+            self.spectra_decibel()[::-1],
             extent=[
                 self.times[0],
                 self.times[-1] + (self.times[1] - self.times[0]),
@@ -1405,6 +1389,9 @@ class MainWindow(QMainWindow):
         t_mask = np.arange(len(self.fill_times))[
             (self.fill_times >= xlim[0]) & (self.fill_times <= xlim[1])
         ]
+        # the stored band of the fine spectrogram may not cover the selection
+        if len(f_mask) == 0 or len(t_mask) == 0:
+            return
         ioi = np.argmax(
             self.fill_spec[
                 f_mask[0] : f_mask[-1] + 1, t_mask[0] : t_mask[-1] + 1
@@ -1743,15 +1730,36 @@ class MainWindow(QMainWindow):
         print(len(f_mask))
         print(len(t_mask))
         print(np.shape(self.spectra))
+        if len(f_mask) < 2 or len(t_mask) < 2:
+            self.Plot.spec_img_handle = None
+            return
+
+        if self.fill_pyramid is not None:
+            # read the pyramid level matching the pixels of the axes
+            bbox = self.Plot.ax.get_window_extent()
+            spec, freqs, times = self.fill_pyramid.view(
+                xlim[0],
+                xlim[1],
+                ylim[0],
+                ylim[1],
+                int(bbox.width),
+                int(bbox.height),
+                decibel=True,
+            )
+        else:
+            spec = decibel(
+                self.fill_spec[f_mask[0] : f_mask[-1], t_mask[0] : t_mask[-1]]
+            )
+            freqs = self.fill_freqs[f_mask[0] : f_mask[-1]]
+            times = self.fill_times[t_mask[0] : t_mask[-1]]
+        if len(freqs) < 2 or len(times) < 2:
+            self.Plot.spec_img_handle = None
+            return
 
         print("plotting...")
         self.Plot.spec_img_handle = self.Plot.ax.imshow(
-            decibel(
-                self.fill_spec[f_mask[0] : f_mask[-1], t_mask[0] : t_mask[-1]][
-                    ::-1
-                ]
-            ),
-            extent=[xlim[0], xlim[1], ylim[0], ylim[1]],
+            spec[::-1],
+            extent=[times[0], times[-1], freqs[0], freqs[-1]],
             aspect="auto",
             vmin=-100,
             vmax=-50,
@@ -1763,11 +1771,17 @@ class MainWindow(QMainWindow):
         self.Plot.figure.canvas.draw()
         print("yay")
 
+    def spectra_decibel(self):
+        """Decibel of the current spectra, computed once per spectra."""
+        if self._spectra_db is None or self._spectra_db[0] is not self.spectra:
+            self._spectra_db = (self.spectra, decibel(self.spectra))
+        return self._spectra_db[1]
+
     def Mnorm_spec(self):
         if self.Plot.spec_img_handle:
             self.Plot.spec_img_handle.remove()
         self.Plot.spec_img_handle = self.Plot.ax.imshow(
-            decibel(self.spectra)[::-1],
+            self.spectra_decibel()[::-1],
             extent=[
                 self.times[0],
                 self.times[-1] + (self.times[1] - self.times[0]),
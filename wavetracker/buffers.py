@@ -0,0 +1,277 @@
+"""
+Growable columnar storage for the signals extracted during the analysis.
+
+Each detection is stored once in a typed numpy chunk instead of as a Python
+object in a list. Chunks double in size up to a limit, so appending is
+amortized constant time per row and never copies earlier rows. Filled chunks
+can be spilled to a file on disk once they exceed a memory budget; the rows
+are then written out chunk by chunk, so that storing them does not load the
+spill file back into memory.
+"""
+
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+
+def _remove_file(path: str) -> None:
+    """Remove a spill file, ignoring files that are already gone."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class AppendBuffer:
+    """Growable array of rows stored in typed numpy chunks.
+
+    The dtype and the shape of the rows are taken from the first values
+    appended to the buffer unless they are given.
+
+    Parameters
+    ----------
+    dtype : numpy dtype, optional
+        Data type of the stored values.
+    row_shape : tuple, optional
+        Shape of a single row, e.g. `(channels,)` for signatures.
+    chunk_size : int, optional
+        Rows of the first chunk; each further chunk is twice as large.
+    max_chunk_size : int, optional
+        Upper bound of the rows in a single chunk.
+    max_memory : float, optional
+        Bytes of filled chunks kept in memory before they are appended to a
+        spill file in `spill_dir`, by default None (never spill).
+    spill_dir : str, optional
+        Folder of the spill file, by default the system's temporary folder.
+    """
+
+    def __init__(
+        self,
+        dtype=None,
+        row_shape: tuple | None = None,
+        chunk_size: int = 4096,
+        max_chunk_size: int = 2**20,
+        max_memory: float | None = None,
+        spill_dir: str | None = None,
+    ) -> None:
+        self._dtype = None if dtype is None else np.dtype(dtype)
+        self._row_shape = None if row_shape is None else tuple(row_shape)
+        self.chunk_size = int(chunk_size)
+        self.max_chunk_size = int(max_chunk_size)
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.spill_file = None
+        self._finalizer = None
+        self.clear()
+
+    def clear(self) -> None:
+        """Remove all rows and the spill file."""
+        self.dtype = self._dtype
+        self.row_shape = self._row_shape
+        self._chunks = []
+        self._chunk = None
+        self._fill = 0
+        self._len = 0
+        self._spilled = 0
+        if self._finalizer is not None:
+            self._finalizer()
+        self.spill_file = None
+        self._finalizer = None
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the rows held in memory."""
+        nbytes = sum(chunk.nbytes for chunk in self._chunks)
+        if self._chunk is not None:
+            nbytes += self._chunk.nbytes
+        return nbytes
+
+    def extend(self, values) -> None:
+        """Append rows to the buffer.
+
+        Parameters
+        ----------
+        values : array_like
+            Rows to append, the first dimension counts the rows.
+        """
+        values = np.asarray(values)
+        if values.size == 0 and self.dtype is None:
+            return
+        if self.dtype is None:
+            self.dtype = values.dtype
+        if self.row_shape is None:
+            self.row_shape = values.shape[1:]
+        values = values.astype(self.dtype, copy=False).reshape(
+            (-1, *self.row_shape)
+        )
+
+        while len(values) > 0:
+            if self._chunk is None or self._fill == len(self._chunk):
+                self._next_chunk()
+            n = min(len(values), len(self._chunk) - self._fill)
+            self._chunk[self._fill : self._fill + n] = values[:n]
+            self._fill += n
+            self._len += n
+            values = values[n:]
+
+    def _next_chunk(self) -> None:
+        """Retire the filled chunk and allocate one twice its size."""
+        size = self.chunk_size
+        if self._chunk is not None:
+            self._chunks.append(self._chunk)
+            size = min(2 * len(self._chunk), self.max_chunk_size)
+            if self.max_memory is not None and (
+                sum(chunk.nbytes for chunk in self._chunks) > self.max_memory
+            ):
+                self._spill()
+        self._chunk = np.empty((size, *self.row_shape), dtype=self.dtype)
+        self._fill = 0
+
+    def _spill(self) -> None:
+        """Append the filled chunks to the spill file and drop them."""
+        if self.spill_file is None:
+            fd, self.spill_file = tempfile.mkstemp(
+                prefix="wavetracker-", suffix=".spill", dir=self.spill_dir
+            )
+            os.close(fd)
+            self._finalizer = weakref.finalize(
+                self, _remove_file, self.spill_file
+            )
+        with open(self.spill_file, "ab") as f:
+            for chunk in self._chunks:
+                chunk.tofile(f)
+                self._spilled += len(chunk)
+        self._chunks = []
+
+    def iter_chunks(self, start: int = 0):
+        """Iterate over the rows from `start` on in chunks.
+
+        Spilled rows are read from the spill file in pieces of at most
+        `max_chunk_size` rows.
+
+        Parameters
+        ----------
+        start : int, optional
+            Index of the first row.
+
+        Yields
+        ------
+        rows : np.ndarray
+            Consecutive rows; the rows held in memory are views.
+        """
+        if self.dtype is None:
+            return
+        row_size = int(np.prod(self.row_shape, dtype=int))
+        if start < self._spilled:
+            with open(self.spill_file, "rb") as f:
+                f.seek(start * row_size * self.dtype.itemsize)
+                while start < self._spilled:
+                    n = min(self._spilled - start, self.max_chunk_size)
+                    rows = np.fromfile(f, dtype=self.dtype, count=n * row_size)
+                    yield rows.reshape((n, *self.row_shape))
+                    start += n
+        offset = self._spilled
+        chunks = list(self._chunks)
+        if self._chunk is not None:
+            chunks.append(self._chunk[: self._fill])
+        for chunk in chunks:
+            if start < offset + len(chunk):
+                yield chunk[max(start - offset, 0) :]
+            offset += len(chunk)
+
+    def tofile(self, fid, start: int = 0) -> None:
+        """Write the raw rows from `start` on, as `np.ndarray.tofile` does.
+
+        Parameters
+        ----------
+        fid : str or file
+            Path of the file or a file opened for binary writing.
+        start : int, optional
+            Index of the first row to write.
+        """
+        if isinstance(fid, (str, os.PathLike)):
+            with open(fid, "wb") as f:
+                self.tofile(f, start)
+            return
+        for rows in self.iter_chunks(start):
+            rows.tofile(fid)
+
+    def save(self, filename: str) -> None:
+        """Store all rows in a `.npy` file, readable with `np.load`."""
+        if self.dtype is None:
+            np.save(filename, self.to_array())
+            return
+        header = {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (len(self), *self.row_shape),
+        }
+        with open(filename, "wb") as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            self.tofile(f)
+
+    def to_array(self) -> np.ndarray:
+        """All rows as a single numpy array.
+
+        The array is a new copy, including any rows spilled to disk; use
+        `iter_chunks`, `tofile` or `save` to store the rows instead.
+        """
+        if self.dtype is None or self.row_shape is None:
+            return np.array([], dtype=self.dtype)
+        parts = list(self.iter_chunks())
+        if not parts:
+            return np.empty((0, *self.row_shape), dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype)
+
+
+def append_rows(filename: str, rows, start: int = 0) -> None:
+    """Write the rows of an array or `AppendBuffer` from `start` on to a file.
+
+    The raw rows are written at their offset in the file, which is truncated
+    there first. Rows before `start` stay untouched, data after them, e.g.
+    of an interrupted write, is replaced.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file. It has to exist if `start` is larger than zero.
+    rows : np.ndarray or AppendBuffer
+        Rows to store, the first dimension counts the rows. An empty
+        buffer without a row shape only creates the file.
+    start : int, optional
+        Index of the first row to write, i.e. rows already in the file.
+    """
+    if isinstance(rows, AppendBuffer):
+        dtype, row_shape = rows.dtype, rows.row_shape
+        if dtype is None or row_shape is None:
+            # nothing appended yet, the size of a row is unknown
+            with open(filename, "r+b" if start > 0 else "wb"):
+                pass
+            return
+    else:
+        rows = np.asarray(rows)
+        dtype, row_shape = rows.dtype, rows.shape[1:]
+    row_bytes = dtype.itemsize * int(np.prod(row_shape, dtype=int))
+    with open(filename, "r+b" if start > 0 else "wb") as f:
+        f.seek(start * row_bytes)
+        f.truncate()
+        if isinstance(rows, AppendBuffer):
+            rows.tofile(f, start)
+        else:
+            rows[start:].tofile(f)
+
+
+def read_rows(filename: str, dtype, row_shape: tuple, length: int):
+    """First `length` rows of a file written by `append_rows`."""
+    count = length * int(np.prod(row_shape, dtype=int))
+    rows = np.fromfile(filename, dtype=dtype, count=count)
+    return rows.reshape((length, *row_shape))
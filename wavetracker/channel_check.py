@@ -0,0 +1,163 @@
+"""
+Pre-scan of multi-electrode recordings for dead, flat and clipped channels.
+
+Broken electrodes in long field deployments contribute nothing but noise to
+the summed spectrogram while costing a full STFT each. The scan samples a
+few blocks spread over the recording, computes per-channel statistics with
+vectorized reductions and reports the channels that should be excluded
+from the analysis.
+"""
+
+import inspect
+import json
+import os
+
+import numpy as np
+import torch
+
+from wavetracker.datahandler import MultiChannelAudioDataset
+from wavetracker.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def scan_channels(
+    dataset: MultiChannelAudioDataset,
+    channel_list: np.ndarray,
+    blocks: int = 20,
+    ampl_max: float = 1.0,
+    clip_level: float = 0.99,
+    max_clip_ratio: float = 0.01,
+    flat_std: float = 1e-6,
+    max_flat_fraction: float = 0.5,
+    min_rms_ratio: float = 0.1,
+) -> dict:
+    """
+    Compute per-channel RMS, clipping ratio and flat-line fraction on blocks sampled evenly across the recording
+    and judge which channels are dead or saturated.
+
+    Parameters
+    ----------
+        dataset : MultiChannelAudioDataset
+            Dataset providing the blocks of the channels in channel_list.
+        channel_list : 1d-array
+            Recording channels contained in the blocks of the dataset.
+        blocks : int
+            Number of blocks sampled from the recording.
+        ampl_max : float
+            Full scale amplitude of the recording.
+        clip_level : float
+            Fraction of the full scale amplitude from which on samples count as clipped.
+        max_clip_ratio : float
+            Channels with a larger fraction of clipped samples are saturated.
+        flat_std : float
+            Blocks in which a channel's standard deviation does not exceed this value count as flat.
+        max_flat_fraction : float
+            Channels flat in a larger fraction of the sampled blocks are dead.
+        min_rms_ratio : float
+            Channels with an RMS below this fraction of the median RMS across channels are dead.
+
+    Returns
+    -------
+        report : dict
+            Statistics and status ("ok", "dead" or "saturated") of every channel, and the list of channels
+            that shall be excluded.
+    """
+    n_blocks = max(1, min(blocks, dataset.nblocks))
+    block_indices = np.unique(
+        np.linspace(0, max(dataset.nblocks - 1, 0), n_blocks).astype(int)
+    )
+
+    rms, clipped, flat = [], [], []
+    for index in block_indices:
+        block = dataset.block(int(index)).to(torch.float64)
+        rms.append(torch.sqrt(torch.mean(block**2, dim=0)))
+        clipped.append(
+            torch.mean((block.abs() >= clip_level * ampl_max).double(), dim=0)
+        )
+        flat.append(torch.std(block, dim=0) <= flat_std)
+    rms = torch.stack(rms).mean(dim=0).cpu().numpy()
+    clip_ratio = torch.stack(clipped).mean(dim=0).cpu().numpy()
+    flat_fraction = torch.stack(flat).double().mean(dim=0).cpu().numpy()
+
+    dead = (flat_fraction > max_flat_fraction) | (
+        rms < min_rms_ratio * np.median(rms)
+    )
+    saturated = ~dead & (clip_ratio > max_clip_ratio)
+    status = np.where(dead, "dead", np.where(saturated, "saturated", "ok"))
+
+    return {
+        "blocks": [int(i) for i in block_indices],
+        "block_size": int(dataset.block_size),
+        "channels": [
+            {
+                "channel": int(channel),
+                "rms": float(rms[i]),
+                "clip_ratio": float(clip_ratio[i]),
+                "flat_fraction": float(flat_fraction[i]),
+                "status": str(status[i]),
+            }
+            for i, channel in enumerate(channel_list)
+        ],
+        "excluded": [int(c) for c in np.asarray(channel_list)[dead | saturated]],
+    }
+
+
+def check_channels(
+    data,
+    samplerate: float,
+    channel_list: np.ndarray,
+    save_path: str,
+    block_size: float = 1.0,
+    **kwargs: dict,
+) -> np.ndarray:
+    """
+    Pre-scan the recording, write the channel report to "channel_report.json" in save_path and return the channels
+    that remain for the analysis.
+
+    Parameters
+    ----------
+        data : DataLoader or MemmapDataLoader
+            The opened recording.
+        samplerate : float
+            Samplerate of the recording.
+        channel_list : 1d-array
+            Channels selected for the analysis.
+        save_path : str
+            Folder where the report is stored.
+        block_size : float
+            Duration of the sampled blocks in seconds.
+        kwargs : dict
+            Parameters passed on to scan_channels, e.g. the "channel_check" section of the configuration. Unknown
+            parameters are ignored with a warning.
+
+    Returns
+    -------
+        channel_list : 1d-array
+            Selected channels without the dead and saturated ones.
+    """
+    dataset = MultiChannelAudioDataset(
+        data_loader=data,
+        block_size=int(block_size * samplerate),
+        channels=channel_list,
+    )
+    # the keyword parameters of scan_channels after dataset and channel_list
+    known = list(inspect.signature(scan_channels).parameters)[2:]
+    unknown = [key for key in kwargs if key not in known]
+    if unknown:
+        log.warning(f"Ignoring unknown channel check parameters: {unknown}")
+    kwargs = {key: kwargs[key] for key in kwargs if key in known}
+    kwargs.setdefault("ampl_max", getattr(data, "ampl_max", None) or 1.0)
+    report = scan_channels(dataset, channel_list, **kwargs)
+
+    with open(os.path.join(save_path, "channel_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    excluded = report["excluded"]
+    if excluded:
+        log.warning(f"Excluding dead or saturated channels: {excluded}")
+    remaining = np.setdiff1d(channel_list, excluded)
+    if len(remaining) == 0:
+        log.warning("All channels failed the channel check, keeping them.")
+        return channel_list
+    return remaining
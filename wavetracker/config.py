@@ -41,6 +41,7 @@ class Configuration:
         self.basic = {}
         self.spectrogram = {}
         self.raw = {}
+        self.analysis = {}
         self.harmonic_groups = {}
         self.tracking = {}
 
@@ -0,0 +1,703 @@
+"""
+CPU backend of the harmonic group detection in `gpu_harmonic_group`.
+
+The CUDA kernels are ported to numba functions compiled for the CPU. The
+kernels that run one CUDA thread per spectrum are parallelized over the
+spectra with `prange`, so the detection uses all cores without starting
+worker processes or pickling spectra. Collecting the candidate
+fundamentals and assigning the harmonic groups are shared with the CUDA
+backend and give the same `assigned_hg` output; the greedy assignment is
+compiled as well and runs in parallel over the spectra.
+"""
+
+import math
+import time
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, cache=True)
+def jit_decibel(power):
+    """Transform power to decibel relative to a reference power of 1.
+
+    Power values smaller than 1e-20 are set to `-np.inf`.
+
+    Parameters
+    ----------
+    power: 2d-array
+        Power values, for example from a spectrogram.
+
+    Returns
+    -------
+    db_power: 2d-array
+        Power values in decibel.
+    """
+    ref_power = 1.0
+    min_power = 1e-20
+
+    db_power = np.empty_like(power)
+    for i in prange(power.shape[0]):
+        for j in range(power.shape[1]):
+            if power[i, j] <= min_power:
+                db_power[i, j] = -math.inf
+            else:
+                db_power[i, j] = 10.0 * math.log10(power[i, j] / ref_power)
+    return db_power
+
+
+@njit(cache=True)
+def threshold_estimate(log_spec, log_spec_detrend, hist, bins):
+    n = len(log_spec)
+    i0, i1 = n // 2, n * 3 // 4
+    abs_sum_val = 0.0
+    for i in range(int(i1 - i0)):
+        abs_sum_val += log_spec[i0 + i]
+    abs_mean_val = abs_sum_val / (i1 - i0)
+
+    di = 128
+    itters = int(len(log_spec_detrend) / di)
+    for i in range(itters):
+        sum_val = 0.0
+        for j in range(di):
+            sum_val += log_spec[int(i0 + i * di + j)]
+        mean_val = sum_val / di
+        for j in range(di):
+            log_spec_detrend[int(i * di + j)] = (
+                log_spec[int(i0 + i * di + j)] - mean_val + abs_mean_val
+            )
+
+    maxd = -1e6
+    mind = 1e6
+    for i in range(len(log_spec_detrend)):
+        maxd = max(log_spec_detrend[i], maxd)
+        mind = min(log_spec_detrend[i], mind)
+
+    r = maxd - mind
+    for i in range(100):
+        v0 = mind + r / 100 * i
+        v1 = mind + r / 100 * (i + 1)
+        bins[i] = v0
+        for j in range(len(log_spec_detrend)):
+            if log_spec_detrend[j] >= v0 and log_spec_detrend[j] < v1:
+                hist[i] += 1
+    bins[100] = mind + r
+    max_hist = 0.0
+    for i in range(len(hist)):
+        max_hist = max(hist[i], max_hist)
+    hist_th = max_hist * 1.0 / math.sqrt(math.e)
+    return hist_th
+
+
+@njit(parallel=True, cache=True)
+def threshold_estimate_coordinator(log_spec):
+    """Standard deviation of the detrended log-spectra, one per spectrum."""
+    n = log_spec.shape[1]
+    i0, i1 = n // 2, n * 3 // 4
+    std = np.zeros(log_spec.shape[0])
+    for i in prange(log_spec.shape[0]):
+        log_spec_detrend = np.zeros(i1 - i0)
+        hist = np.zeros(100)
+        bins = np.zeros(101)
+        hist_th = threshold_estimate(log_spec[i], log_spec_detrend, hist, bins)
+
+        lower = 0.0
+        upper = 0.0
+        for j in range(len(hist)):
+            if hist[j] > hist_th:
+                upper = bins[j + 1]
+                if lower == 0:
+                    lower = bins[j]
+        std[i] = 0.5 * (upper - lower)
+    return std
+
+
+@njit(cache=True)
+def detect_peaks_fixed(
+    data,
+    peaks,
+    trough,
+    spec_freq,
+    low_threshold,
+    high_threshold,
+    min_freq,
+    max_freq,
+    mains_freq,
+    mains_freq_tol,
+    min_good_peak_power,
+):
+    # initialize:
+    direction = 0
+
+    min_inx = 0
+    trough_count = 0
+    last_min_idx = 0
+
+    max_inx = 0
+    peak_count = 0
+    last_max_idx = 0
+
+    min_value = data[0]
+    max_value = min_value
+
+    p, t = 0, 0
+
+    # loop through the data:
+    for i in range(len(data)):
+        # rising?
+        if direction > 0:
+            if data[i] > max_value:
+                # update maximum element:
+                max_inx = i
+                max_value = data[i]
+            # otherwise, if the new value is falling below
+            # the maximum value minus the threshold:
+            # the maximum is a peak!
+            if data[i] <= max_value - low_threshold:
+                peaks[max_inx] = 1
+                p = 1
+                last_max_idx = max_inx
+                peak_count += 1
+                # change direction:
+                direction = -1
+                # store minimum element:
+                min_inx = i
+                min_value = data[i]
+
+        # falling?
+        if direction < 0:
+            if data[i] < min_value:
+                # update minimum element:
+                min_inx = i
+                min_value = data[i]
+            # otherwise, if the new value is rising above
+            # the minimum value plus the threshold:
+            # the minimum is a trough!
+            if data[i] >= min_value + low_threshold:
+                trough[min_inx] = 1
+                t = 1
+                last_min_idx = min_inx
+                trough_count += 1
+                # change direction:
+                direction = +1
+                # store maximum element:
+                max_inx = i
+                max_value = data[i]
+
+        # don't know direction yet:
+        if direction == 0:
+            if data[i] <= max_value - low_threshold:
+                direction = -1  # falling
+            if data[i] >= min_value + low_threshold:
+                direction = 1  # rising
+
+            if data[i] > max_value:
+                # update maximum element:
+                max_inx = i
+                max_value = data[i]
+            if data[i] < min_value:
+                # update minimum element:
+                min_inx = i
+                min_value = data[i]
+
+        # check if this is a good peak
+        if p != 0 and t != 0:
+            p, t = 0, 0
+            # ddB > high_th
+            if not data[last_max_idx] - data[last_min_idx] > high_threshold:
+                continue
+            # in freq boundaries
+            if (
+                spec_freq[last_max_idx] < min_freq
+                or spec_freq[last_max_idx] > max_freq
+            ):
+                continue
+            # not a main freq 1/2
+            if spec_freq[last_max_idx] % mains_freq < mains_freq_tol:
+                continue
+            # not a main freq 2/2
+            if (
+                abs(spec_freq[last_max_idx] % mains_freq - mains_freq)
+                < mains_freq_tol
+            ):
+                continue
+            if data[last_max_idx] < min_good_peak_power:
+                continue
+            peaks[last_max_idx] = 2
+            trough[last_min_idx] = 2
+
+    if peak_count > trough_count:
+        peaks[last_max_idx] = 0
+    elif peak_count < trough_count:
+        trough[last_min_idx] = 0
+
+
+@njit(parallel=True, cache=True)
+def peak_detect_coordinater(
+    spec,
+    spec_freq,
+    low_threshold,
+    high_threshold,
+    min_freq,
+    max_freq,
+    mains_freq,
+    mains_freq_tol,
+    min_good_peak_power,
+):
+    """Peaks and troughs of every spectrum (rows of `spec`)."""
+    peaks = np.zeros_like(spec)
+    troughs = np.zeros_like(spec)
+    for i in prange(spec.shape[0]):
+        detect_peaks_fixed(
+            spec[i],
+            peaks[i],
+            troughs[i],
+            spec_freq,
+            low_threshold,
+            high_threshold,
+            min_freq,
+            max_freq,
+            mains_freq,
+            mains_freq_tol,
+            min_good_peak_power,
+        )
+    return peaks, troughs
+
+
+@njit(parallel=True, cache=True)
+def sorted_peaks(peaks):
+    """Indices of the peaks of every spectrum in ascending order.
+
+    Returns the zero padded indices and the number of peaks per spectrum.
+    """
+    n_peaks = np.zeros(peaks.shape[0], dtype=np.int64)
+    for t in prange(peaks.shape[0]):
+        for i in range(peaks.shape[1]):
+            if peaks[t, i] != 0:
+                n_peaks[t] += 1
+    width = 1
+    for t in range(peaks.shape[0]):
+        width = max(width, n_peaks[t])
+    peak_idx = np.zeros((peaks.shape[0], width), dtype=np.int64)
+    for t in prange(peaks.shape[0]):
+        k = 0
+        for i in range(peaks.shape[1]):
+            if peaks[t, i] != 0:
+                peak_idx[t, k] = i
+                k += 1
+    return peak_idx, n_peaks
+
+
+@njit(cache=True)
+def get_group(
+    freq,
+    log_spec,
+    spec_freqs,
+    peak_idx,
+    n_peaks,
+    out,
+    min_group_size,
+    max_freq_tol,
+    mains_freq,
+    mains_freq_tol,
+):
+    fzero = freq
+    fzero_h = 1
+    for h in range(1, len(out)):
+        ioi = 0
+        fe = 1e6
+        pending = False
+        # peaks more than the tolerance below the expected harmonic cannot
+        # match, the one before them is checked as well to be safe from
+        # rounding
+        lowest = fzero / fzero_h - max_freq_tol
+        lo = 0
+        hi = n_peaks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if spec_freqs[peak_idx[mid]] / h <= lowest:
+                lo = mid + 1
+            else:
+                hi = mid
+        for k in range(max(lo - 1, 0), n_peaks):
+            i = peak_idx[k]
+            delta = spec_freqs[i] / h - fzero / fzero_h
+            # no further peak can change the group
+            if ioi == 0 and delta >= max_freq_tol:
+                break
+            if ioi != 0 and not pending and delta >= fe:
+                break
+            new_fe = abs(delta)
+            if new_fe < fe and new_fe < max_freq_tol:
+                ioi = i
+                fe = new_fe
+                pending = True
+            if new_fe > fe:
+                if ioi != 0:
+                    fzero = spec_freqs[ioi]
+                    fzero_h = h
+                    out[h - 1] = ioi
+                    pending = False
+
+    peak_sum = 0.0
+    n = 0
+    nn = 0
+    for i in range(min_group_size):
+        if out[i] != 0:
+            nn += 1
+            if (
+                spec_freqs[out[i]] % mains_freq < mains_freq_tol
+                or abs(spec_freqs[out[i]] % mains_freq - 50) < mains_freq_tol
+            ):
+                continue
+            n += 1
+            peak_sum += log_spec[out[i]]
+
+    if n != 0:
+        peak_mean = peak_sum / n
+    else:
+        peak_mean = -1e6
+
+    value = peak_mean if nn >= min_group_size - 1 else -1e6
+    return value
+
+
+@njit(parallel=True, cache=True)
+def get_harmonic_groups_coordinator(
+    check_freqs,
+    offsets,
+    log_spec,
+    spec_freq,
+    peaks,
+    max_group_size,
+    min_group_size,
+    max_freq_tol,
+    mains_freq,
+    mains_freq_tol,
+):
+    """Harmonic groups and their mean power for all candidate fundamentals.
+
+    The candidates of spectrum i are check_freqs[offsets[i]:offsets[i + 1]].
+    The harmonics are looked up by binary search in the sorted peaks of
+    each spectrum instead of scanning all frequencies.
+    """
+    peak_idx, n_peaks = sorted_peaks(peaks)
+    rows = np.empty(len(check_freqs), dtype=np.int64)
+    for i in prange(len(offsets) - 1):
+        rows[offsets[i] : offsets[i + 1]] = i
+    out = np.zeros((len(check_freqs), max_group_size), dtype=np.int64)
+    value = np.zeros(len(check_freqs))
+    for k in prange(len(check_freqs)):
+        i = rows[k]
+        value[k] = get_group(
+            check_freqs[k],
+            log_spec[i],
+            spec_freq,
+            peak_idx[i],
+            n_peaks[i],
+            out[k, :],
+            min_group_size,
+            max_freq_tol,
+            mains_freq,
+            mains_freq_tol,
+        )
+    return out, value
+
+
+@njit(parallel=True, cache=True)
+def assign_harmonic_groups_coordinator(
+    out,
+    value,
+    peaks,
+    log_spec,
+    offsets,
+    min_group_size,
+    min_good_peak_power,
+    assigned_hg,
+):
+    """Greedy assignment of the good peaks of every spectrum to groups."""
+    for t in prange(len(offsets) - 1):
+        next_hg = 1
+        assigned = np.zeros(peaks.shape[1], dtype=np.int64)
+
+        peak_idxs = np.nonzero(peaks[t] == 2)[0]
+        sorting_mask = np.argsort(log_spec[t][peak_idxs], kind="mergesort")
+        best_peak_idxs = peak_idxs[sorting_mask[::-1]]
+        start = offsets[t]
+        order = np.argsort(value[start : offsets[t + 1]], kind="mergesort")
+        order = order[::-1] + start
+
+        for search_peak_idx in best_peak_idxs:
+            for i in order:
+                group = out[i]
+                # ToDo: Tolerance for missing harmonics ?! NO!!!
+                complete = True
+                member = False
+                for h in range(min_group_size):
+                    complete = complete and group[h] != 0
+                    member = member or group[h] == search_peak_idx
+                if not complete or not member:
+                    continue
+
+                first = -1
+                double_use = False
+                assigned_sum = 0
+                for h in range(len(group)):
+                    if group[h] == 0:
+                        continue
+                    if first < 0:
+                        first = h
+                    # ToDo: papameter: max_double_use
+                    double_use = double_use or assigned[group[h]] == 2
+                    assigned_sum += assigned[group[h]]
+                if log_spec[t, group[first]] < min_good_peak_power:
+                    continue
+                if first != 0:
+                    continue
+                if double_use:
+                    continue
+
+                # ToDo: parameter: max_double_uses_in_group
+                if assigned_sum == 0:
+                    for h in range(len(group)):
+                        if group[h] != 0:
+                            assigned[group[h]] = 1
+                            assigned_hg[t, group[h]] = next_hg
+                    next_hg += 1
+                    break
+    return assigned_hg
+
+
+###############################################################################
+
+
+def max_group_size(cfg):
+    """Maximum number of harmonics of a harmonic group."""
+    return int(
+        cfg.harmonic_groups["max_freq"]
+        * cfg.harmonic_groups["min_group_size"]
+        // cfg.harmonic_groups["min_freq"]
+    )
+
+
+def fixed_thresholds(cfg):
+    """Peak detection thresholds of the config, None if zero."""
+    low = cfg.harmonic_groups["low_threshold"]
+    high = cfg.harmonic_groups["high_threshold"]
+    if low == 0 or high == 0:
+        return None
+    return float(low), float(high)
+
+
+def thresholds_from_std(std, cfg):
+    """Peak detection thresholds derived from the spectra's std."""
+    return (
+        float(np.mean(std) * cfg.harmonic_groups["low_thresh_factor"]),
+        float(np.mean(std) * cfg.harmonic_groups["high_thresh_factor"]),
+    )
+
+
+def get_check_freqs(peaks, spec_freq, cfg):
+    """Candidate fundamentals: good peaks and their integer fractions.
+
+    Candidates at the same position on the frequency grid, e.g. a peak in
+    bin k divided by one and a peak in bin 2k divided by two, yield the same
+    harmonic group and are only kept once. They are identified by the
+    reduced fraction of bin index and divisor. Of these, the last one in the
+    order of divisors and frequencies is kept, which is the one the
+    assignment visits first among candidates of equal power.
+
+    Parameters
+    ----------
+    peaks : 2d-array
+        Peak labels (times x frequencies), 2 marks good peaks.
+    spec_freq : 1d-array
+        Frequencies of the spectra.
+    cfg : object
+        Configuration with the harmonic group parameters.
+
+    Returns
+    -------
+    check_freqs : 1d-array
+        Candidate frequencies of all times, one time after the other.
+    offsets : 1d-array
+        The candidates of time i are check_freqs[offsets[i]:offsets[i + 1]].
+    """
+    hg_cfg = cfg.harmonic_groups
+    good = (
+        (peaks == 2)
+        & (spec_freq < hg_cfg["max_freq"])
+        & (spec_freq > hg_cfg["min_freq"])
+    )
+    times, bins = np.nonzero(good)
+    n_divisors = hg_cfg["max_divisor"]
+    divisor = np.repeat(np.arange(1, n_divisors + 1), len(times))
+    times = np.tile(times, n_divisors)
+    bins = np.tile(bins, n_divisors)
+    # candidates of a time in the order of divisors and frequencies
+    order = np.argsort(times, kind="stable")
+    times, bins, divisor = times[order], bins[order], divisor[order]
+
+    gcd = np.gcd(bins, divisor)
+    key = (times * peaks.shape[1] + bins // gcd) * (n_divisors + 1) + (
+        divisor // gcd
+    )
+    _, last = np.unique(key[::-1], return_index=True)
+    keep = np.sort(len(times) - 1 - last)
+
+    check_freqs = spec_freq[bins[keep]] / divisor[keep]
+    offsets = np.zeros(len(peaks) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(times[keep], minlength=len(peaks)))
+    return check_freqs, offsets
+
+
+def assign_harmonic_groups(out, value, peaks, log_spec, offsets, cfg):
+    """Assign peaks to harmonic groups, strongest peaks first.
+
+    The good peaks of a spectrum are visited in order of their power, each
+    one is assigned with the strongest complete harmonic group that contains
+    it among the first `min_group_size` harmonics and shares no peak with an
+    already assigned group. Ties in power keep the later peak or candidate
+    first.
+
+    Parameters
+    ----------
+    out : 2d-array
+        Peak indices of the harmonics of every candidate fundamental.
+    value : 1d-array
+        Mean power of the harmonic group of every candidate fundamental.
+    peaks : 2d-array
+        Peak labels (times x frequencies), 2 marks good peaks.
+    log_spec : 2d-array
+        Spectra in decibel (times x frequencies).
+    offsets : 1d-array
+        Offsets of the candidates of every time, see `get_check_freqs`.
+    cfg : object
+        Configuration with the harmonic group parameters.
+
+    Returns
+    -------
+    assigned_hg : 2d-array
+        Harmonic group labels of the peaks (times x frequencies), 0 for
+        unassigned frequencies.
+    """
+    return assign_harmonic_groups_coordinator(
+        np.ascontiguousarray(out, dtype=np.int64),
+        np.ascontiguousarray(value, dtype=np.float64),
+        np.ascontiguousarray(peaks),
+        np.ascontiguousarray(log_spec),
+        np.asarray(offsets, dtype=np.int64),
+        int(cfg.harmonic_groups["min_group_size"]),
+        float(cfg.harmonic_groups["min_good_peak_power"]),
+        np.zeros_like(peaks),
+    )
+
+
+def harmonic_group_pipeline(
+    spec_arr, spec_freq_arr, cfg, verbose=0, thresholds=None
+):
+    """Detect harmonic groups in a spectrogram on the CPU.
+
+    Parameters
+    ----------
+    spec_arr : 2d-array
+        Power spectrogram (frequencies x times).
+    spec_freq_arr : 1d-array
+        Frequencies of the spectrogram.
+    cfg : object
+        Configuration with the harmonic group parameters.
+    verbose : int, optional
+        Verbosity level, timings are printed from level 4 on.
+    thresholds : tuple, optional
+        Low and high peak detection thresholds in decibel, e.g. of a
+        `ThresholdEstimator`. By default the thresholds of the config, or an
+        estimate from this spectrogram if they are zero.
+
+    Returns
+    -------
+    assigned_hg : 2d-array
+        Harmonic group labels (times x frequencies).
+    peaks : 2d-array
+        Peak labels (times x frequencies).
+    log_spec : 2d-array
+        Spectrogram in decibel (times x frequencies).
+    """
+    hg_cfg = cfg.harmonic_groups
+    spec = np.ascontiguousarray(spec_arr.transpose(), dtype=np.float32)
+    spec_freq = np.asarray(spec_freq_arr, dtype=np.float64)
+    log_spec = jit_decibel(spec)
+
+    ### threshold estimate for peak detection ###
+    if thresholds is None:
+        thresholds = fixed_thresholds(cfg)
+    if thresholds is None:
+        if verbose >= 4:
+            t0 = time.time()
+        thresholds = thresholds_from_std(
+            threshold_estimate_coordinator(log_spec), cfg
+        )
+        if verbose >= 4:
+            print(f"threshold estimate transform: {time.time() - t0:.4f}s")
+    low_threshold, high_threshold = thresholds
+
+    ### peak detection ###
+    if verbose >= 4:
+        t0 = time.time()
+    peaks, troughs = peak_detect_coordinater(
+        log_spec,
+        spec_freq,
+        float(low_threshold),
+        float(high_threshold),
+        float(hg_cfg["min_freq"]),
+        float(hg_cfg["max_freq"]),
+        float(hg_cfg["mains_freq"]),
+        float(hg_cfg["mains_freq_tol"]),
+        float(hg_cfg["min_good_peak_power"]),
+    )
+    if verbose >= 4:
+        print(f"peak_detect: {time.time() - t0:.4f}s")
+
+    ### harmonic groups ###
+    if verbose >= 4:
+        t0 = time.time()
+    check_freqs, offsets = get_check_freqs(peaks, spec_freq, cfg)
+    out, value = get_harmonic_groups_coordinator(
+        check_freqs,
+        offsets,
+        log_spec,
+        spec_freq,
+        peaks,
+        max_group_size(cfg),
+        int(hg_cfg["min_group_size"]),
+        float(hg_cfg["max_freq_tol"]),
+        float(hg_cfg["mains_freq"]),
+        float(hg_cfg["mains_freq_tol"]),
+    )
+    if verbose >= 4:
+        print(f"get harmonic groups: {time.time() - t0:.4f}s")
+
+    ### assign harmonic groups ###
+    if verbose >= 4:
+        t0 = time.time()
+    assigned_hg = assign_harmonic_groups(
+        out, value, peaks, log_spec, offsets, cfg
+    )
+    if verbose >= 4:
+        print(f"Harmonic group assignment: {time.time() - t0:.4f}s")
+    return assigned_hg, peaks, log_spec
+
+
+def warm_up(cfg):
+    """Run the detection once on a small random spectrogram.
+
+    Compiles the kernels and starts the threads of numba's threading layer
+    on the calling thread. With the TBB layer, a first parallel kernel
+    launched from a worker thread, e.g. of a `StagedPipeline` stage, keeps
+    the process from exiting, so the main thread should call this before
+    starting such threads.
+    """
+    max_freq = cfg.harmonic_groups["max_freq"]
+    spec_freq = np.linspace(0, 2 * max_freq, 512)
+    rng = np.random.default_rng(0)
+    spec = rng.exponential(size=(len(spec_freq), 4)).astype(np.float32)
+    harmonic_group_pipeline(spec, spec_freq, cfg)
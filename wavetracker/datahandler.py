@@ -1,5 +1,9 @@
 import argparse
+import json
 import os
+import queue
+import struct
+import threading
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,6 +13,7 @@ from PyQt5.QtGui import *
 
 # from .spectrogram import *
 from PyQt5.QtWidgets import *
+from audioio import blocks
 from thunderlab.dataloader import DataLoader
 
 from wavetracker.device_check import get_device
@@ -65,11 +70,108 @@ available_GPU = False if device.type == "cpu" else True
 #                 break
 
 
+def parse_channels(selection, n_channels: int) -> np.ndarray:
+    """Translate a channel selection from the configuration to indices.
+
+    Parameters
+    ----------
+    selection : int, str, list or None
+        -1, "all" or None for all channels, a single channel index, a list
+        of channel indices, or a string of comma separated indices and
+        inclusive ranges, e.g. "0-15" or "0-3, 8, 10-12".
+    n_channels : int
+        Channel count of the recording.
+
+    Returns
+    -------
+    channels : ndarray of int
+        Sorted unique channel indices.
+
+    Raises
+    ------
+    ValueError
+        If the selection contains channels not present in the recording.
+    """
+    if selection is None or (
+        isinstance(selection, str) and selection.strip().lower() == "all"
+    ):
+        return np.arange(n_channels)
+    if isinstance(selection, str):
+        channels = []
+        for part in selection.split(","):
+            first, _, last = part.strip().partition("-")
+            channels.extend(range(int(first), int(last or first) + 1))
+    elif np.ndim(selection) == 0:
+        if int(selection) < 0:
+            return np.arange(n_channels)
+        channels = [int(selection)]
+    else:
+        channels = [int(c) for c in selection]
+    channels = np.unique(np.asarray(channels, dtype=int))
+    if len(channels) and (channels[0] < 0 or channels[-1] >= n_channels):
+        msg = f"Channel selection {selection} exceeds {n_channels} channels."
+        raise ValueError(msg)
+    return channels
+
+
+def select_channels(
+    n_channels: int, channels=None, exclude_channels=None
+) -> np.ndarray:
+    """Channels to analyse after applying the exclude list.
+
+    Parameters
+    ----------
+    n_channels : int
+        Channel count of the recording.
+    channels : int, str, list or None
+        Channels to analyse, see `parse_channels`.
+    exclude_channels : int, str, list or None
+        Channels to drop from the selection, see `parse_channels`. None or
+        an empty list excludes nothing.
+
+    Returns
+    -------
+    channels : ndarray of int
+        Sorted indices of the channels to analyse.
+    """
+    selected = parse_channels(channels, n_channels)
+    if exclude_channels is None or (
+        np.ndim(exclude_channels) > 0 and len(exclude_channels) == 0
+    ):
+        return selected
+    excluded = parse_channels(exclude_channels, n_channels)
+    selected = np.setdiff1d(selected, excluded)
+    if len(selected) == 0:
+        msg = "No channels left to analyse after excluding channels."
+        raise ValueError(msg)
+    return selected
+
+
+def channel_index(channels: np.ndarray, n_channels: int):
+    """Cheapest numpy index selecting `channels` from `n_channels` columns.
+
+    Returns None if all channels are selected, a slice (a view instead of
+    a copy) for contiguous selections, and the index array otherwise.
+    """
+    channels = np.asarray(channels)
+    if len(channels) == n_channels:
+        return None
+    if np.all(np.diff(channels) == 1):
+        return slice(int(channels[0]), int(channels[-1]) + 1)
+    return channels
+
+
 class MultiChannelAudioDataset(torch.utils.data.IterableDataset):
     """Iterator for loading data from a multi-channel audio file."""
 
     def __init__(
-        self, data_loader: DataLoader, block_size: int, noverlap: int = 0
+        self,
+        data_loader: DataLoader,
+        block_size: int,
+        noverlap: int = 0,
+        prefetch: int = 0,
+        max_prefetch_memory: float | None = None,
+        channels: np.ndarray | None = None,
     ) -> None:
         """Initialize the iterator for loading data from a multi-channel audio.
 
@@ -81,25 +183,672 @@ class MultiChannelAudioDataset(torch.utils.data.IterableDataset):
             The size of each data block to be loaded.
         noverlap : int, optional
             Number of overlapping samples between blocks, by default 0.
+        prefetch : int, optional
+            Number of blocks a background reader thread loads ahead of the
+            consumer, by default 0 (blocks are read on the calling thread).
+        max_prefetch_memory : float, optional
+            Upper bound in bytes for the blocks held in the prefetch queue.
+            Limits the prefetch depth for large blocks, by default None.
+        channels : ndarray of int, optional
+            Sorted indices of the channels to load, by default all channels.
+            Readers supporting channel selection never read the others,
+            otherwise they are dropped before the blocks become tensors.
         """
         self.data_loader = data_loader
         self.block_size = block_size
         self.noverlap = noverlap
+        self.prefetch = prefetch
+        self.max_prefetch_memory = max_prefetch_memory
         self.nblocks = len(self.data_loader) // (block_size - noverlap)
+        self.start_block = 0
+
+        self.channel_index = None
+        if channels is not None:
+            if hasattr(self.data_loader, "select_channels"):
+                self.data_loader.select_channels(channels)
+            else:
+                self.channel_index = channel_index(
+                    channels, self.data_loader.shape[1]
+                )
+
+    @property
+    def prefetch_depth(self) -> int:
+        """Number of blocks the background reader may hold at once."""
+        if self.prefetch <= 0:
+            return 0
+        if not self.max_prefetch_memory:
+            return int(self.prefetch)
+        # thunderlab's DataLoader hands out float64 blocks
+        itemsize = np.dtype(
+            getattr(self.data_loader, "block_dtype", np.float64)
+        ).itemsize
+        block_bytes = self.block_size * self.shape[1] * itemsize
+        return int(
+            max(1, min(self.prefetch, self.max_prefetch_memory // block_bytes))
+        )
 
     def __iter__(self):
+        depth = self.prefetch_depth
+        if depth > 0:
+            yield from self._prefetched_blocks(depth)
+            return
         with self.data_loader as data:
-            for block in data.blocks(self.block_size, self.noverlap):
+            for block in self._blocks(data):
                 yield torch.from_numpy(block).to(device)
 
+    def block(self, index: int) -> torch.Tensor:
+        """Load a single block of the iteration by its index.
+
+        Parameters
+        ----------
+        index : int
+            Index of the block as counted while iterating the dataset.
+
+        Returns
+        -------
+        block : torch.Tensor
+            Samples x selected channels of the block.
+        """
+        start = index * (self.block_size - self.noverlap)
+        return self.samples(start, start + self.block_size)
+
+    def samples(self, start: int, stop: int) -> torch.Tensor:
+        """Load the selected channels of a range of samples.
+
+        Parameters
+        ----------
+        start, stop : int
+            First and one past the last sample to load.
+
+        Returns
+        -------
+        samples : torch.Tensor
+            Samples x selected channels.
+        """
+        block = self.data_loader[start:stop]
+        if self.channel_index is not None:
+            block = block[:, self.channel_index]
+        return torch.from_numpy(np.array(block)).to(device)
+
+    def _blocks(self, data):
+        """Yield the selected channels of successive data blocks.
+
+        Iteration starts at block `start_block`, e.g. when an interrupted
+        analysis is resumed.
+        """
+        start = self.start_block * (self.block_size - self.noverlap)
+        for block in data.blocks(self.block_size, self.noverlap, start):
+            if self.channel_index is not None:
+                block = block[:, self.channel_index]
+            yield block
+
+    def _prefetched_blocks(self, depth: int):
+        """Yield blocks that a background thread reads into a bounded queue.
+
+        The reader runs ahead of the consumer by at most `depth` blocks, so
+        disk reads overlap with the spectrogram and harmonic group stages.
+        Exceptions raised while reading are re-raised in the consumer.
+        """
+        ready = queue.Queue(maxsize=depth)
+        stop = threading.Event()
+        end = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                except queue.Full:
+                    continue
+                return True
+            return False
+
+        def reader() -> None:
+            try:
+                with self.data_loader as data:
+                    buffer = getattr(data, "buffer", None)
+                    for block in self._blocks(data):
+                        # the loader reuses its buffer for the next read
+                        if buffer is not None and np.may_share_memory(
+                            block, buffer
+                        ):
+                            block = np.array(block)
+                        tensor = torch.from_numpy(block)
+                        if device.type == "cuda":
+                            tensor = tensor.pin_memory()
+                        if not put(tensor):
+                            return
+            except Exception as e:
+                put(e)
+                return
+            put(end)
+
+        thread = threading.Thread(
+            target=reader, name="wavetracker-reader", daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item.to(device, non_blocking=True)
+        finally:
+            stop.set()
+            thread.join()
+
     def __len__(self):
         return len(self.data_loader)
 
     @property
     def shape(self):
+        if isinstance(self.channel_index, slice):
+            index = self.channel_index
+            return (len(self), index.stop - index.start)
+        if self.channel_index is not None:
+            return (len(self), len(self.channel_index))
         return self.data_loader.shape
 
 
+def wav_layout(filepath: str) -> dict | None:
+    """Locate the sample data of an uncompressed .wav file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the .wav file.
+
+    Returns
+    -------
+    layout : dict or None
+        Byte offset, frame count, channel count, sample dtype, scaling
+        factor to floats in [-1, 1), sampling rate and full scale amplitude
+        of the data chunk.
+        None if the file is not a plain PCM (16 or 32 bit) or 32 bit float
+        .wav file that can be memory-mapped.
+    """
+    with open(filepath, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                offset = f.tell()
+                break
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                f.seek(size % 2, os.SEEK_CUR)
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+        filesize = os.fstat(f.fileno()).st_size
+    if fmt is None or len(fmt) < 16:
+        return None
+
+    tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if tag == 0xFFFE and len(fmt) >= 26:  # WAVE_FORMAT_EXTENSIBLE
+        tag = struct.unpack("<H", fmt[24:26])[0]
+    encodings = {
+        (1, 16): ("<i2", 2.0**-15),
+        (1, 32): ("<i4", 2.0**-31),
+        (3, 32): ("<f4", 1.0),
+    }
+    if (tag, bits) not in encodings or channels == 0:
+        return None
+    dtype, scale = encodings[(tag, bits)]
+    size = min(size, filesize - offset)
+    return {
+        "offset": offset,
+        "frames": size // (channels * bits // 8),
+        "channels": channels,
+        "dtype": dtype,
+        "scale": scale,
+        "rate": float(rate),
+        "amax": 1.0,
+    }
+
+
+def fishgrid_layout(filepath: str) -> dict | None:
+    """Locate the sample data of a single-grid fishgrid .raw file.
+
+    Sampling rate and channel count are taken from the fishgrid metadata
+    via thunderlab; the samples are interleaved float32 values.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the traces-grid1.raw file.
+
+    Returns
+    -------
+    layout : dict or None
+        Same keys as returned by `wav_layout`. None if the recording is not
+        a fishgrid recording with exactly one grid.
+    """
+    try:
+        loader = DataLoader(filepath, buffersize=0.0)
+    except (OSError, ValueError):
+        return None
+    layout = None
+    if loader.format == "FISHGRID" and len(loader.trace_filepaths) == 1:
+        channels = loader.channels
+        layout = {
+            "offset": 0,
+            "frames": os.path.getsize(loader.trace_filepaths[0])
+            // (4 * channels),
+            "channels": channels,
+            "dtype": "<f4",
+            "scale": 1.0,
+            "rate": float(loader.rate),
+            "amax": float(loader.ampl_max) if loader.ampl_max else 1.0,
+        }
+    loader.close()
+    return layout
+
+
+class MemmapDataLoader:
+    """Zero-copy reader for uncompressed .raw and PCM .wav recordings.
+
+    The recording files are memory-mapped and blocks are handed out as
+    strided views into the maps. Integer samples are converted to float32
+    in a single batch per block. Multiple files are concatenated along
+    the time axis; only blocks crossing a file border are assembled in a
+    new array.
+
+    The class provides the parts of the thunderlab DataLoader interface
+    used by the wavetracker pipeline (`len`, `shape`, `rate`, `channels`,
+    slicing, `blocks` and the context manager protocol).
+    """
+
+    block_dtype = np.float32
+
+    def __init__(self, filepaths: list, layouts: list) -> None:
+        """Memory-map the sample data of the given recording files.
+
+        Parameters
+        ----------
+        filepaths : list of str
+            Recording files in temporal order.
+        layouts : list of dict
+            Data layouts of the files as returned by `wav_layout` or
+            `fishgrid_layout`. All files need the same sampling rate and
+            channel count.
+        """
+        self.filepath = filepaths
+        self.rate = layouts[0]["rate"]
+        self.channels = layouts[0]["channels"]
+        self.format = "MEMMAP"
+        self.ampl_max = layouts[0].get("amax", 1.0)
+        self.channel_index = slice(None)
+
+        self.maps = []
+        self.scales = []
+        frames = []
+        for path, layout in zip(filepaths, layouts, strict=True):
+            if layout["frames"] == 0:
+                continue
+            # copy-on-write keeps the views writable for torch.from_numpy
+            # without ever touching the file
+            self.maps.append(
+                np.memmap(
+                    path,
+                    dtype=layout["dtype"],
+                    mode="c",
+                    offset=layout["offset"],
+                    shape=(layout["frames"], self.channels),
+                )
+            )
+            self.scales.append(layout["scale"])
+            frames.append(layout["frames"])
+        self.file_offsets = np.cumsum([0, *frames])
+        self.frames = int(self.file_offsets[-1])
+        self.shape = (self.frames, self.channels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, ex_value, tb):
+        return False
+
+    def select_channels(self, channels: np.ndarray) -> None:
+        """Restrict all reads to the given channels.
+
+        Unselected channels are never converted or copied; contiguous
+        selections stay views into the memory maps.
+
+        Parameters
+        ----------
+        channels : ndarray of int
+            Sorted indices of the channels of the recording files to read.
+        """
+        index = channel_index(channels, self.maps[0].shape[1])
+        self.channel_index = slice(None) if index is None else index
+        self.channels = len(channels)
+        self.shape = (self.frames, self.channels)
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, key):
+        index, channels = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.frames)
+            return self.read(start, max(start, stop))[::step, channels]
+        index = int(index) + (self.frames if index < 0 else 0)
+        return self.read(index, index + 1)[0, channels]
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """Read frames `start` to `stop` as float32 array.
+
+        The returned array is a view into the memory map whenever the
+        requested frames lie within a single float32 file.
+        """
+        k = np.searchsorted(self.file_offsets, start, side="right") - 1
+        if k < len(self.maps) and stop <= self.file_offsets[k + 1]:
+            i0 = start - self.file_offsets[k]
+            return self._convert(k, i0, i0 + stop - start)
+
+        out = np.empty((stop - start, self.channels), dtype=self.block_dtype)
+        pos = start
+        while pos < stop:
+            k = np.searchsorted(self.file_offsets, pos, side="right") - 1
+            end = min(stop, self.file_offsets[k + 1])
+            i0 = pos - self.file_offsets[k]
+            self._convert(
+                k, i0, i0 + end - pos, out=out[pos - start : end - start]
+            )
+            pos = end
+        return out
+
+    def _convert(self, k: int, i0: int, i1: int, out=None) -> np.ndarray:
+        view = self.maps[k][i0:i1, self.channel_index]
+        if view.dtype == self.block_dtype and self.scales[k] == 1.0:
+            if out is None:
+                return view
+            out[:] = view
+            return out
+        scale = self.block_dtype(self.scales[k])
+        return np.multiply(view, scale, out=out, dtype=self.block_dtype)
+
+    def blocks(self, block_size: int, noverlap: int = 0, start=0, stop=None):
+        """Generator for blockwise processing of the data.
+
+        See `audioio.blocks` for details.
+        """
+        return blocks(self, block_size, noverlap, start, stop)
+
+    def close(self) -> None:
+        """Release the memory maps."""
+        self.maps = []
+
+
+def open_memmap_data(
+    filename: str | list, layouts: list | None = None
+) -> MemmapDataLoader | None:
+    """Open recordings with the memory-mapped reader if their format allows.
+
+    Parameters
+    ----------
+    filename : str or list of str
+        A single .wav or fishgrid .raw file, or a list of .wav files.
+    layouts : list of dict, optional
+        Known data layouts of the files, e.g. from a `SessionIndex`.
+        Read from the file headers if not given.
+
+    Returns
+    -------
+    data : MemmapDataLoader or None
+        The reader, or None if any of the files can not be memory-mapped.
+    """
+    filepaths = [filename] if isinstance(filename, str) else list(filename)
+    if layouts is None:
+        if all(f.lower().endswith(".wav") for f in filepaths):
+            layouts = [wav_layout(f) for f in filepaths]
+        elif len(filepaths) == 1 and filepaths[0].lower().endswith(".raw"):
+            layouts = [fishgrid_layout(filepaths[0])]
+        else:
+            return None
+    if any(layout is None for layout in layouts):
+        return None
+    if len({(la["rate"], la["channels"]) for la in layouts}) != 1:
+        return None
+    if sum(layout["frames"] for layout in layouts) == 0:
+        return None
+    return MemmapDataLoader(filepaths, layouts)
+
+
+class SessionIndex:
+    """Persistent sample-offset index of a multi-file recording session.
+
+    Opening a session of many .wav files with thunderlab's DataLoader
+    requires to open every single file to learn its length. The index
+    stores per-file sample offsets, sampling rates, channel counts, data
+    layouts and file sizes/modification times in a JSON sidecar file.
+    On later starts the index is revalidated by a stat of each file only,
+    and the recording is opened without touching the files.
+    """
+
+    version = 1
+
+    def __init__(
+        self, folder: str, sources: list, entries: list, info: dict
+    ) -> None:
+        """
+        Parameters
+        ----------
+        folder : str
+            Directory containing the recording files.
+        sources : list of str
+            Names of all files the index was built from.
+        entries : list of dict
+            Per-file entries with keys "name", "size", "mtime_ns",
+            "frames", "rate", "channels" and "layout".
+        info : dict
+            Session wide "rate", "channels", "unit" and "amax".
+        """
+        self.folder = folder
+        self.sources = sources
+        self.entries = entries
+        self.info = info
+        frames = [entry["frames"] for entry in entries]
+        self.end_indices = np.cumsum(frames, dtype=np.int64)
+        self.start_indices = self.end_indices - frames
+
+    @property
+    def filepaths(self) -> list:
+        """Absolute paths of the indexed files in temporal order."""
+        return [
+            os.path.join(self.folder, entry["name"]) for entry in self.entries
+        ]
+
+    @property
+    def frames(self) -> int:
+        """Total number of frames of the session."""
+        return int(self.end_indices[-1]) if len(self.entries) else 0
+
+    @property
+    def layouts(self) -> list | None:
+        """Memory-map layouts of all files, None if any file lacks one."""
+        layouts = [entry["layout"] for entry in self.entries]
+        return None if any(la is None for la in layouts) else layouts
+
+    def locate(self, time: float) -> tuple[int, int]:
+        """Find the file and frame within that file for a given time.
+
+        Parameters
+        ----------
+        time : float
+            Time in seconds relative to the start of the session.
+
+        Returns
+        -------
+        file_index : int
+            Index of the file containing `time`.
+        frame : int
+            Frame within this file.
+        """
+        index = int(np.clip(time * self.info["rate"], 0, self.frames - 1))
+        k = int(np.searchsorted(self.end_indices, index, side="right"))
+        return k, index - int(self.start_indices[k])
+
+    def is_valid(self, filepaths: list) -> bool:
+        """Check the index against the files currently in the session.
+
+        Only the file names, sizes and modification times are compared.
+        """
+        if [os.path.basename(f) for f in filepaths] != self.sources:
+            return False
+        filepaths = self.filepaths
+        for filepath, entry in zip(filepaths, self.entries, strict=True):
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                return False
+            if (stat.st_size, stat.st_mtime_ns) != (
+                entry["size"],
+                entry["mtime_ns"],
+            ):
+                return False
+        return True
+
+    @classmethod
+    def build(cls, filepaths: list) -> "SessionIndex":
+        """Index the session by opening it with thunderlab's DataLoader.
+
+        Only the files thunderlab concatenates into one continuous
+        recording are indexed.
+        """
+        loader = DataLoader(filepaths, buffersize=0.0)
+        if hasattr(loader, "end_indices"):
+            paths = [str(path) for path in loader.file_paths]
+            ends = np.asarray(loader.end_indices, dtype=np.int64)
+        else:  # a single file
+            paths = [str(loader.filepath)]
+            ends = np.array([loader.frames], dtype=np.int64)
+        info = {
+            "rate": float(loader.rate),
+            "channels": int(loader.channels),
+            "unit": loader.unit,
+            "amax": float(loader.ampl_max) if loader.ampl_max else 1.0,
+        }
+        loader.close()
+
+        entries = []
+        for path, frames in zip(paths, np.diff(ends, prepend=0), strict=True):
+            stat = os.stat(path)
+            layout = (
+                wav_layout(path) if path.lower().endswith(".wav") else None
+            )
+            if layout is not None and layout["frames"] != frames:
+                layout = None
+            entries.append(
+                {
+                    "name": os.path.basename(path),
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "frames": int(frames),
+                    "rate": info["rate"],
+                    "channels": info["channels"],
+                    "layout": layout,
+                }
+            )
+        sources = [os.path.basename(f) for f in filepaths]
+        return cls(os.path.dirname(paths[0]), sources, entries, info)
+
+    @classmethod
+    def load(cls, index_file: str) -> "SessionIndex | None":
+        """Load an index from its sidecar file, None if unreadable."""
+        try:
+            with open(index_file) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if content.get("version") != cls.version:
+            return None
+        return cls(
+            content["folder"],
+            content["sources"],
+            content["files"],
+            content["info"],
+        )
+
+    def save(self, index_file: str) -> None:
+        """Write the index to its sidecar file."""
+        content = {
+            "version": self.version,
+            "folder": self.folder,
+            "sources": self.sources,
+            "info": self.info,
+            "files": self.entries,
+        }
+        with open(index_file, "w") as f:
+            json.dump(content, f)
+
+    @classmethod
+    def open(cls, filepaths: list, index_file: str, logger=None):
+        """Load a valid index from `index_file` or (re)build and store it.
+
+        Parameters
+        ----------
+        filepaths : list of str
+            Recording files of the session in temporal order.
+        index_file : str
+            Path of the sidecar file.
+        logger : object, optional
+            Logger for feedback on rebuilt indices.
+
+        Returns
+        -------
+        index : SessionIndex
+        """
+        index = cls.load(index_file)
+        if index is not None and index.is_valid(filepaths):
+            return index
+        if logger is not None:
+            logger.info(f"Indexing {len(filepaths)} recording files.")
+        index = cls.build(filepaths)
+        index.save(index_file)
+        return index
+
+    def open_data(self, reader: str, buffersize: float, backsize: float):
+        """Open the indexed session without opening every single file.
+
+        Parameters
+        ----------
+        reader : str
+            "memmap", "auto" or "thunderlab", see `open_raw_data`.
+        buffersize : float
+            Size of the DataLoader's internal buffer in seconds.
+        backsize : float
+            Part of the buffer loaded before the requested index in seconds.
+
+        Returns
+        -------
+        data : MemmapDataLoader or DataLoader
+        """
+        if reader in ("memmap", "auto") and self.layouts is not None:
+            return MemmapDataLoader(self.filepaths, self.layouts)
+        if len(self.entries) == 1:
+            return DataLoader(
+                self.filepaths[0], buffersize=buffersize, backsize=backsize
+            )
+        return DataLoader(
+            self.filepaths,
+            buffersize=buffersize,
+            backsize=backsize,
+            rate=self.info["rate"],
+            channels=self.info["channels"],
+            unit=self.info["unit"],
+            amax=self.info["amax"],
+            end_indices=[int(i) for i in self.end_indices],
+        )
+
+
 def open_raw_data(
     filename: str | list,
     buffersize: float = 60.0,
@@ -108,6 +857,8 @@ def open_raw_data(
     snippet_size: int = 2**21,
     verbose: int = 0,
     logger=None,
+    reader: str = "thunderlab",
+    session_index: SessionIndex | None = None,
     **kwargs: dict,
 ):
     """
@@ -131,6 +882,13 @@ def open_raw_data(
             Verbosity level regulating shell/logging feedback during analysis. Suggested for debugging in development.
         logger : object
             If not None, logger object that stores feedback about processing status
+        reader : str
+            Reader backend: "thunderlab" for the buffered thunderlab DataLoader, "memmap" for the zero-copy
+            memory-mapped reader of uncompressed .raw and .wav files, or "auto" to use the memory-mapped reader
+            whenever the file format allows it. Falls back to "thunderlab" for unsupported formats.
+        session_index : SessionIndex, optional
+            Index of a multi-file session. If given, the files are opened from the index without reading every
+            file header.
         kwargs : dict
              Excess parameters from the configuration dictionary passed to the function.
 
@@ -152,20 +910,33 @@ def open_raw_data(
     else:
         folder = os.path.split(filename[0])[0]
 
+    data = None
+    if session_index is not None:
+        data = session_index.open_data(reader, buffersize, backsize)
+    elif reader in ("memmap", "auto"):
+        data = open_memmap_data(filename)
+        if data is None and reader == "memmap" and logger is not None:
+            logger.warning(
+                "Recording can not be memory-mapped, "
+                "falling back to the thunderlab DataLoader."
+            )
+
     # filename = os.path.join(folder, 'traces-grid1.raw')
     # print(filename)
-    data = DataLoader(
-        filename,
-        buffersize=buffersize,
-        backsize=backsize,
-        # channel=channel,
-    )
+    if data is None:
+        data = DataLoader(
+            filename,
+            buffersize=buffersize,
+            backsize=backsize,
+            # channel=channel,
+        )
     samplerate = data.rate
     channels = data.channels
     shape = data.shape
 
     if verbose >= 1:
         logger.info(f"Loading data from: {os.path.abspath(folder)}")
+        logger.info(f"Reader backend: {data.format}")
 
     return data, samplerate, channels, shape
 
@@ -0,0 +1,422 @@
+"""
+Storage of the full resolution (fine) spectrogram of a recording.
+
+`fine_spec.npy` holds the raw frequencies x times array in column-major
+order without a numpy header, so that each spectrum is contiguous on disk.
+Only a band of the frequencies may be stored, `fine_freqs.npy` holds the
+frequencies of the stored rows and the index of the first one within the
+full spectrum is the `freq_offset` of the layout in `fine_spec_meta.json`.
+Files written before the metadata existed are float64 with their shape in
+`fine_spec_shape.npy`.
+
+The writer preallocates the file for the whole recording and stores the
+spectra of each snippet from a background thread, so that disk writes stay
+off the critical path of the analysis.
+
+Spectrograms are stored either as float power or, with an unsigned integer
+dtype, as decibel codes: `db = offset + code * db_scale` over a fixed
+decibel range. The codes are 2-8x smaller than floats and viewers read
+decibel without computing a logarithm.
+"""
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+META_FILE = "fine_spec_meta.json"
+DEFAULT_DB_RANGE = (-150.0, -10.0)
+
+
+def is_db_code(dtype) -> bool:
+    """Whether spectrograms of `dtype` are stored as decibel codes."""
+    return np.issubdtype(np.dtype(dtype), np.unsignedinteger)
+
+
+def db_encoding(dtype, db_range=None) -> dict:
+    """Offset and step of the decibel codes of `dtype` over `db_range`."""
+    low, high = db_range or DEFAULT_DB_RANGE
+    return {
+        "encoding": "db",
+        "offset": float(low),
+        "db_scale": (high - low) / np.iinfo(np.dtype(dtype)).max,
+    }
+
+
+def quantize_decibel(power, dtype, offset: float, db_scale: float):
+    """Decibel codes of power, clipped to the range of the codes.
+
+    Parameters
+    ----------
+    power : array
+        Power values, e.g. a spectrogram.
+    dtype : str
+        Unsigned integer type of the codes.
+    offset : float
+        Decibel of code 0, lower powers, including 0, are set to it.
+    db_scale : float
+        Decibel per code.
+
+    Returns
+    -------
+    codes : array
+        Codes of the power in decibel.
+    """
+    dtype = np.dtype(dtype)
+    with np.errstate(divide="ignore"):
+        db = 10.0 * np.log10(np.asarray(power, dtype=np.float32))
+    codes = np.rint((db - offset) / db_scale)
+    return np.clip(codes, 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def dequantize_decibel(codes, offset: float, db_scale: float):
+    """Decibel of codes written by `quantize_decibel`, as float32."""
+    return np.float32(offset) + codes.astype(np.float32) * np.float32(
+        db_scale
+    )
+
+
+def to_decibel(power, min_power: float = 1e-20):
+    """Decibel of power relative to 1, -inf below `min_power`."""
+    power = np.asarray(power)
+    db = np.full(power.shape, -np.inf, dtype=np.float32)
+    valid = power > min_power
+    db[valid] = 10.0 * np.log10(power[valid])
+    return db
+
+
+class FineSpecWriter:
+    """Preallocated, memory-mapped fine spectrogram written asynchronously.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the fine spectrogram file.
+    n_freqs : int
+        Number of frequencies of each spectrum.
+    capacity : int
+        Number of spectra to preallocate. The file is enlarged if more
+        spectra are written and truncated to the written ones on `close`.
+    dtype : str, optional
+        Data type of the stored power, "float32" (default) or "float16",
+        or of decibel codes, "uint8" or "uint16".
+    scale : float, optional
+        Factor applied to the power before storing, e.g. to move the power
+        into the range of float16. Readers divide by it.
+    start : int, optional
+        Number of spectra already in the file, e.g. when an interrupted
+        analysis is resumed. New spectra are written after them.
+    queue_size : int, optional
+        Maximum number of snippets waiting to be written, by default 4.
+    freq_offset : int, optional
+        Index of the first stored frequency within the full spectrum when
+        only a frequency band is stored, by default 0.
+    db_range : tuple, optional
+        Lower and upper decibel of the codes of an unsigned integer dtype,
+        by default `DEFAULT_DB_RANGE`.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        n_freqs: int,
+        capacity: int,
+        dtype: str = "float32",
+        scale: float = 1.0,
+        start: int = 0,
+        queue_size: int = 4,
+        freq_offset: int = 0,
+        db_range: tuple | None = None,
+    ) -> None:
+        self.filename = filename
+        self.n_freqs = int(n_freqs)
+        self.dtype = np.dtype(dtype)
+        self.scale = float(scale)
+        self.freq_offset = int(freq_offset)
+        self.encoding = None
+        if is_db_code(self.dtype):
+            self.encoding = db_encoding(self.dtype, db_range)
+        self.n_columns = int(start)
+        self.capacity = max(int(capacity), self.n_columns, 1)
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._open(
+            "r+" if start > 0 and os.path.exists(filename) else "w+"
+        )
+
+    def _open(self, mode: str) -> None:
+        """Map the file and start the thread writing to it."""
+        self._map = np.memmap(
+            self.filename,
+            dtype=self.dtype,
+            mode=mode,
+            shape=(self.n_freqs, self.capacity),
+            order="F",
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="wavetracker-fine-spec", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def shape(self) -> tuple:
+        """Frequencies x spectra written so far."""
+        return (self.n_freqs, self.n_columns)
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def write(self, spectra: np.ndarray) -> None:
+        """Queue the spectra (frequencies x times) of a snippet for writing.
+
+        The array must not be modified afterwards. Writing after `close`
+        continues the closed file.
+        """
+        self._raise()
+        if self._thread is None:
+            self._open("r+")
+        self._queue.put((self.n_columns, spectra))
+        self.n_columns += spectra.shape[1]
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._store(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _store(self, i0: int, spectra: np.ndarray) -> None:
+        i1 = i0 + spectra.shape[1]
+        if i1 > self.capacity:
+            self._map.flush()
+            self.capacity = max(i1, self.capacity + self.capacity // 4)
+            self._map = np.memmap(
+                self.filename,
+                dtype=self.dtype,
+                mode="r+",
+                shape=(self.n_freqs, self.capacity),
+                order="F",
+            )
+        if self.scale != 1.0:
+            spectra = spectra * self.scale
+        if self.encoding is not None:
+            spectra = quantize_decibel(
+                spectra,
+                self.dtype,
+                self.encoding["offset"],
+                self.encoding["db_scale"],
+            )
+        self._map[:, i0:i1] = spectra
+
+    def flush(self) -> None:
+        """Wait until all queued spectra are written to the file."""
+        self._queue.join()
+        self._raise()
+        self._map.flush()
+
+    def close(self) -> None:
+        """Write the queued spectra and truncate the file to them."""
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        del self._map
+        with open(self.filename, "r+b") as f:
+            f.truncate(self.n_freqs * self.n_columns * self.dtype.itemsize)
+
+    def meta(self) -> dict:
+        """Layout of the written file for `fine_spec_meta.json`."""
+        meta = {
+            "shape": [self.n_freqs, self.n_columns],
+            "dtype": self.dtype.name,
+            "order": "F",
+            "scale": self.scale,
+            "freq_offset": self.freq_offset,
+        }
+        if self.encoding is not None:
+            meta.update(self.encoding)
+        return meta
+
+
+def save_fine_spec_meta(folder: str, meta: dict) -> None:
+    """Store the layout of the fine spectrogram in `folder`."""
+    with open(os.path.join(folder, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+class FineSpec:
+    """Read access to a stored fine spectrogram.
+
+    Indexing returns the power as float32 (float64 for legacy files)
+    regardless of the way it is stored, `decibel` returns it in decibel.
+
+    Attributes
+    ----------
+    data : np.memmap
+        The stored array (frequencies x times).
+    freqs : 1d-array
+        Frequencies of the stored rows.
+    times : 1d-array
+        Times of the columns.
+    meta : dict
+        Layout of the file.
+    freq_offset : int
+        Index of the first stored row within the full spectrum.
+    """
+
+    def __init__(self, data, freqs, times, meta) -> None:
+        self.data = data
+        self.freqs = freqs
+        self.times = times
+        self.meta = meta
+        self.scale = float(meta.get("scale", 1.0))
+        self.freq_offset = int(meta.get("freq_offset", 0))
+
+    @property
+    def shape(self) -> tuple:
+        return self.data.shape
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __getitem__(self, key):
+        if self.meta.get("encoding") == "db":
+            return np.power(np.float32(10.0), self.decibel(key) / 10)
+        power = np.asarray(self.data[key])
+        if power.dtype == np.float16:
+            power = power.astype(np.float32)
+        if self.scale != 1.0:
+            power = power / power.dtype.type(self.scale)
+        return power
+
+    def decibel(self, key):
+        """Power in decibel, read without a logarithm from decibel codes."""
+        if self.meta.get("encoding") != "db":
+            return to_decibel(self[key])
+        db = dequantize_decibel(
+            np.asarray(self.data[key]),
+            self.meta["offset"],
+            self.meta["db_scale"],
+        )
+        if self.scale != 1.0:
+            db -= np.float32(10.0 * np.log10(self.scale))
+        return db
+
+
+def load_fine_spec_meta(folder: str) -> dict:
+    """Layout of the fine spectrogram in `folder`.
+
+    Falls back to the float64 layout of files written without metadata.
+    """
+    meta_file = os.path.join(folder, META_FILE)
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            return json.load(f)
+    shape = np.load(os.path.join(folder, "fine_spec_shape.npy"))
+    return {
+        "shape": [int(n) for n in shape],
+        "dtype": "float64",
+        "order": "F",
+        "scale": 1.0,
+        "freq_offset": 0,
+    }
+
+
+def map_fine_spec(filename: str, meta: dict) -> np.memmap:
+    """Memory-map a spectrogram file read-only with the layout in `meta`."""
+    return np.memmap(
+        filename,
+        dtype=meta["dtype"],
+        mode="r",
+        shape=tuple(meta["shape"]),
+        order=meta.get("order", "F"),
+    )
+
+
+def open_fine_spec(folder: str, filename: str = None) -> FineSpec:
+    """Open the fine spectrogram stored in `folder` for reading.
+
+    Parameters
+    ----------
+    folder : str
+        Folder with `fine_spec.npy`, its metadata, `fine_freqs.npy` and
+        `fine_times.npy`.
+    filename : str, optional
+        Path of the spectrogram file if it is not in `folder`.
+
+    Returns
+    -------
+    fine_spec : FineSpec
+        Memory-mapped spectrogram with its frequencies and times.
+    """
+    meta = load_fine_spec_meta(folder)
+    data = map_fine_spec(
+        filename or os.path.join(folder, "fine_spec.npy"), meta
+    )
+    freqs = np.load(os.path.join(folder, "fine_freqs.npy"))
+    times = np.load(os.path.join(folder, "fine_times.npy"))
+    return FineSpec(data, freqs, times, meta)
+
+
+def save_spectra(
+    filename: str, power: np.ndarray, dtype=None, db_range=None
+) -> None:
+    """Store a spectrogram held in memory, e.g. the sparse spectrogram.
+
+    With an unsigned integer `dtype` the power is stored as decibel codes
+    and the encoding in a json file next to `filename`.
+    """
+    meta_file = os.path.splitext(filename)[0] + "_meta.json"
+    if dtype is None or not is_db_code(dtype):
+        if dtype is not None:
+            power = power.astype(dtype)
+        np.save(filename, power)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        return
+    encoding = db_encoding(dtype, db_range)
+    codes = quantize_decibel(
+        power, dtype, encoding["offset"], encoding["db_scale"]
+    )
+    np.save(filename, codes)
+    with open(meta_file, "w") as f:
+        json.dump(encoding, f, indent=2)
+
+
+def load_spectra(filename: str, decibel: bool = False) -> np.ndarray:
+    """Load a spectrogram stored by `save_spectra`.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the `.npy` file.
+    decibel : bool, optional
+        Return the spectrogram in decibel instead of power.
+
+    Returns
+    -------
+    spectra : 2d-array
+        Power, or decibel, of the spectrogram.
+    """
+    spectra = np.load(filename)
+    meta_file = os.path.splitext(filename)[0] + "_meta.json"
+    if not os.path.exists(meta_file):
+        return to_decibel(spectra) if decibel else spectra
+    with open(meta_file) as f:
+        encoding = json.load(f)
+    db = dequantize_decibel(
+        spectra, encoding["offset"], encoding["db_scale"]
+    )
+    return db if decibel else np.power(np.float32(10.0), db / 10)
@@ -7,6 +7,20 @@ from IPython import embed
 from numba import cuda, float64, int64
 
 from .config import Configuration
+from .cpu_harmonic_group import (
+    assign_harmonic_groups,
+    fixed_thresholds,
+    get_check_freqs,
+    max_group_size,
+    sorted_peaks,
+    thresholds_from_std,
+)
+from .cpu_harmonic_group import (
+    harmonic_group_pipeline as cpu_harmonic_group_pipeline,
+)
+from .torch_harmonic_group import (
+    harmonic_group_pipeline as torch_harmonic_group_pipeline,
+)
 
 # try:
 #     from numba import cuda, jit
@@ -345,7 +359,8 @@ def get_group(
     freq,
     log_spec,
     spec_freqs,
-    peaks,
+    peak_idx,
+    n_peaks,
     out,
     min_group_size,
     max_freq_tol,
@@ -357,17 +372,35 @@ def get_group(
     for h in range(1, len(out)):
         ioi = 0
         fe = 1e6
-        for i in range(len(peaks)):
-            if peaks[i] != 0:
-                new_fe = abs(spec_freqs[i] / h - fzero / fzero_h)
-                if new_fe < fe and new_fe < max_freq_tol:
-                    ioi = i
-                    fe = new_fe
-                if new_fe > fe:
-                    if ioi != 0:
-                        fzero = spec_freqs[ioi]
-                        fzero_h = h
-                        out[h - 1] = ioi
+        pending = False
+        # binary search in the sorted peaks, see `cpu_harmonic_group`
+        lowest = fzero / fzero_h - max_freq_tol
+        lo = 0
+        hi = n_peaks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if spec_freqs[peak_idx[mid]] / h <= lowest:
+                lo = mid + 1
+            else:
+                hi = mid
+        for k in range(max(lo - 1, 0), n_peaks):
+            i = peak_idx[k]
+            delta = spec_freqs[i] / h - fzero / fzero_h
+            if ioi == 0 and delta >= max_freq_tol:
+                break
+            if ioi != 0 and not pending and delta >= fe:
+                break
+            new_fe = abs(delta)
+            if new_fe < fe and new_fe < max_freq_tol:
+                ioi = i
+                fe = new_fe
+                pending = True
+            if new_fe > fe:
+                if ioi != 0:
+                    fzero = spec_freqs[ioi]
+                    fzero_h = h
+                    out[h - 1] = ioi
+                    pending = False
 
     # min_group_size = 3
     peak_sum = 0
@@ -393,15 +426,14 @@ def get_group(
     return value
 
 
-# @cuda.jit(
-#     "void(f8[:,:], f4[:,:], f8[:], f4[:, :], i8[:,:,:], f8[:, :], i8, f8, f8, f8)"
-# )
 @cuda.jit
 def get_harmonic_groups_coordinator(
     g_check_freqs,
+    rows,
     g_log_spec,
     spec_freq,
-    peaks,
+    peak_idx,
+    n_peaks,
     out,
     value,
     min_group_size,
@@ -409,24 +441,23 @@ def get_harmonic_groups_coordinator(
     mains_freq,
     mains_freq_tol,
 ):
-    i, j = cuda.grid(2)
-    # if i < 1 and j < 1:
-    if i >= g_check_freqs.shape[0] or j >= g_check_freqs.shape[1]:
-        return
-    if g_check_freqs[i, j] == 0:
+    # one thread per candidate, rows holds the time of each candidate
+    k = cuda.grid(1)
+    if k >= g_check_freqs.shape[0]:
         return
-    value[i, j] = get_group(
-        g_check_freqs[i, j],
+    i = rows[k]
+    value[k] = get_group(
+        g_check_freqs[k],
         g_log_spec[i],
         spec_freq,
-        peaks[i],
-        out[i, j, :],
+        peak_idx[i],
+        n_peaks[i],
+        out[k, :],
         min_group_size,
         max_freq_tol,
         mains_freq,
         mains_freq_tol,
     )
-    cuda.syncthreads()
 
 
 ###############################################################################
@@ -443,8 +474,68 @@ def get_fundamentals(assigned_hg, spec_freq):
     return f_list
 
 
+def resolve_engine(engine):
+    """Engine used for `engine`, i.e. "auto" replaced by "cuda" or "numba"."""
+    if engine == "auto":
+        return "cuda" if cuda.is_available() else "numba"
+    return engine
+
+
 # def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose = 0):
-def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
+def harmonic_group_pipeline(
+    spec_arr, spec_freq_arr, cfg, verbose=0, engine="auto", thresholds=None
+):
+    """Detect harmonic groups in a spectrogram.
+
+    Parameters
+    ----------
+    spec_arr : 2d-array
+        Power spectrogram (frequencies x times).
+    spec_freq_arr : 1d-array
+        Frequencies of the spectrogram.
+    cfg : object
+        Configuration with the harmonic group parameters.
+    verbose : int, optional
+        Verbosity level, timings are printed from level 4 on.
+    engine : str, optional
+        "cuda" for the CUDA kernels, "numba" for their CPU versions in
+        `cpu_harmonic_group`, "torch" for the tensor version in
+        `torch_harmonic_group`, or "auto" (default) for CUDA if available.
+    thresholds : tuple, optional
+        Low and high peak detection thresholds in decibel, e.g. of a
+        `ThresholdEstimator`. By default the thresholds of the config, or an
+        estimate from this spectrogram if they are zero.
+
+    Returns
+    -------
+    assigned_hg : 2d-array
+        Harmonic group labels (times x frequencies).
+    peaks : 2d-array
+        Peak labels (times x frequencies).
+    log_spec : 2d-array
+        Spectrogram in decibel (times x frequencies).
+    """
+    engine = resolve_engine(engine)
+    if engine == "numba":
+        return cpu_harmonic_group_pipeline(
+            spec_arr,
+            spec_freq_arr,
+            cfg,
+            verbose=verbose,
+            thresholds=thresholds,
+        )
+    if engine == "torch":
+        return torch_harmonic_group_pipeline(
+            spec_arr,
+            spec_freq_arr,
+            cfg,
+            verbose=verbose,
+            thresholds=thresholds,
+        )
+    if engine != "cuda":
+        msg = f"Unknown harmonic group engine: {engine}"
+        raise ValueError(msg)
+
     ### logaritmic spec ###
 
     # CPU arrays (pinned)
@@ -476,10 +567,9 @@ def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
     ### threshold estimate for peak detection ###
     # low_th = cuda.pinned_array((log_spec.shape[0],))
     # high_th = cuda.pinned_array((log_spec.shape[0],))
-    if (
-        cfg.harmonic_groups["low_threshold"] == 0
-        or cfg.harmonic_groups["high_threshold"] == 0
-    ):
+    if thresholds is None:
+        thresholds = fixed_thresholds(cfg)
+    if thresholds is None:
         if verbose >= 4:
             t0 = time.time()
         # helper variables
@@ -524,12 +614,7 @@ def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
         # low_th[:] = (std * cfg.harmonic_groups['low_thresh_factor'])[:]
         # high_th[:] = (std * cfg.harmonic_groups['high_thresh_factor'])[:]
 
-        cfg.harmonic_groups["low_threshold"] = (
-            np.mean(std) * cfg.harmonic_groups["low_thresh_factor"]
-        )
-        cfg.harmonic_groups["high_threshold"] = (
-            np.mean(std) * cfg.harmonic_groups["high_thresh_factor"]
-        )
+        thresholds = thresholds_from_std(std, cfg)
         if verbose >= 4:
             print(f"threshold estimate transform: {time.time() - t0:.4f}s")
     # else:
@@ -567,8 +652,8 @@ def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
         g_peaks,
         g_troughs,
         g_spec_freq,
-        float64(cfg.harmonic_groups["low_threshold"]),
-        float64(cfg.harmonic_groups["high_threshold"]),
+        float64(thresholds[0]),
+        float64(thresholds[1]),
         float64(cfg.harmonic_groups["min_freq"]),
         float64(cfg.harmonic_groups["max_freq"]),
         float64(cfg.harmonic_groups["mains_freq"]),
@@ -593,64 +678,36 @@ def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
     if verbose >= 4:
         t0 = time.time()
     # helper variables
-    max_group_size = int(
-        cfg.harmonic_groups["max_freq"]
-        * cfg.harmonic_groups["min_group_size"]
-        // cfg.harmonic_groups["min_freq"]
-    )
+    group_size = max_group_size(cfg)
+    check_freqs, offsets = get_check_freqs(peaks, spec_freq, cfg)
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
 
-    # CPU arrays (pinned)
-    check_freqs = cuda.pinned_array(
-        shape=(
-            peaks.shape[0],
-            cfg.harmonic_groups["max_divisor"]
-            * int(np.max(np.sum(peaks == 2, axis=1))),
-        )
-    )
-    check_freqs[:, :] = np.zeros_like(check_freqs)
-    # embed()
-    for i in range(len(peaks)):
-        fs = spec_freq[peaks[i] == 2]
-        fs = fs[
-            (fs < cfg.harmonic_groups["max_freq"])
-            & (fs > cfg.harmonic_groups["min_freq"])
-        ]
-        for d in range(cfg.harmonic_groups["max_divisor"]):
-            check_freqs[i, d * len(fs) : (d + 1) * len(fs)] = fs / (d + 1)
-
-    out = cuda.pinned_array(
-        shape=(check_freqs.shape[0], check_freqs.shape[1], max_group_size),
-        dtype=int,
-    )
-    out[:, :, :] = np.zeros_like(out)
-    value = cuda.pinned_array(
-        shape=(check_freqs.shape[0], check_freqs.shape[1]), dtype=float
-    )
-    value[:, :] = np.zeros_like(value)
+    out = cuda.pinned_array(shape=(len(check_freqs), group_size), dtype=int)
+    out[:, :] = np.zeros_like(out)
+    value = cuda.pinned_array(shape=len(check_freqs), dtype=float)
+    value[:] = np.zeros_like(value)
+
+    peak_idx, n_peaks = sorted_peaks(peaks)
 
     # GPU arrays
     g_check_freqs = cuda.to_device(check_freqs)
-    g_out = cuda.device_array(
-        shape=(check_freqs.shape[0], check_freqs.shape[1], max_group_size),
-        dtype=int,
-    )
-    g_value = cuda.device_array(
-        shape=(check_freqs.shape[0], check_freqs.shape[1]), dtype=float
-    )
-    #
+    g_rows = cuda.to_device(rows)
+    g_peak_idx = cuda.to_device(peak_idx)
+    g_n_peaks = cuda.to_device(n_peaks)
+    g_out = cuda.to_device(out)
+    g_value = cuda.device_array(shape=len(check_freqs), dtype=float)
+
     # kernel setup & execution
-    tpb = (1, 1)
-    bpg = (
-        g_check_freqs.shape[0] // tpb[0] + 1,
-        g_check_freqs.shape[1] // tpb[1] + 1,
-    )
+    tpb = 64
+    bpg = len(check_freqs) // tpb + 1
 
-    # print(g_check_freqs.shape)
     get_harmonic_groups_coordinator[bpg, tpb](
         g_check_freqs,
+        g_rows,
         log_spec,
         spec_freq,
-        peaks,
+        g_peak_idx,
+        g_n_peaks,
         g_out,
         g_value,
         int64(cfg.harmonic_groups["min_group_size"]),
@@ -663,6 +720,9 @@ def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
     g_out.copy_to_host(out)
     g_value.copy_to_host(value)
     del g_check_freqs
+    del g_rows
+    del g_peak_idx
+    del g_n_peaks
     del g_out
     del g_value
 
@@ -673,54 +733,9 @@ def harmonic_group_pipeline(spec_arr, spec_freq_arr, cfg, verbose=0):
     ### assign harmonic groups ###
     if verbose >= 4:
         tn_0 = time.time()
-    harmonic_helper = np.cumsum(out > 0, axis=2)
-    assigned_hg = cuda.pinned_array_like(peaks)
-    assigned_hg[:, :] = np.zeros_like(assigned_hg)
-
-    for t in range(out.shape[0]):
-        next_hg = 1
-        assigned = np.zeros_like(peaks[t])
-
-        peak_idxs = np.arange(len(peaks[t]))[peaks[t] == 2]
-        sorting_mask = np.argsort(log_spec[t][peak_idxs])[::-1]
-        best_peak_idxs = peak_idxs[sorting_mask]
-
-        search_freq_count = len(check_freqs[t][check_freqs[t] != 0])
-        power_array = value[t, :search_freq_count]
-        order = np.argsort(power_array)[::-1]
-        # ToDo: Tolerance for missing harmonics ?! NO!!!
-        order = order[
-            harmonic_helper[
-                t, order, cfg.harmonic_groups["min_group_size"] - 1
-            ]
-            == cfg.harmonic_groups["min_group_size"]
-        ]
-
-        for search_peak_idx in best_peak_idxs:
-            for i in order:
-                if (
-                    search_peak_idx
-                    in out[t, i, : cfg.harmonic_groups["min_group_size"]]
-                ):
-                    non_zero_h = np.arange(out.shape[2])[out[t, i] != 0] + 1
-                    non_zero_idx = out[t, i][out[t, i] != 0]
-                    if (
-                        log_spec[t, non_zero_idx[0]]
-                        < cfg.harmonic_groups["min_good_peak_power"]
-                    ):
-                        continue
-                    if non_zero_h[0] != 1:
-                        continue
-                    # ToDo: papameter: max_double_use
-                    if 2 in assigned[non_zero_idx]:  # double use
-                        continue
-
-                    # ToDo: parameter: max_double_uses_in_group
-                    if np.sum(assigned[non_zero_idx]) == 0:
-                        assigned[non_zero_idx] += 1
-                        assigned_hg[t, non_zero_idx] = next_hg
-                        next_hg += 1
-                        break
+    assigned_hg = assign_harmonic_groups(
+        out, value, peaks, log_spec, offsets, cfg
+    )
     if verbose >= 4:
         print(f"Harmonic group assignment: {time.time() - tn_0:.4f}s")
     cuda.current_context().deallocations.clear()
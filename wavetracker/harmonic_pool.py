@@ -0,0 +1,167 @@
+"""
+Long-lived worker pool for thunderfish's `harmonic_groups`.
+
+Starting a `multiprocessing.Pool` per snippet and pickling every power
+spectrum to the workers dominates the run time for short snippets. The pool
+here is started once per run. The spectra of a snippet are copied into a
+shared memory block that the workers attach to, so a task only carries the
+name of the block and a range of spectra to analyse.
+
+The workers are started by a fork server where available, so that a pool
+created while other threads are running does not fork their state.
+"""
+
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from thunderfish.harmonics import harmonic_groups
+
+# shared memory block the current worker process is attached to
+_segment = {}
+
+
+def _attach(name: str, shape: tuple, dtype: str):
+    """Frequencies and spectra in the shared memory block `name`."""
+    if _segment.get("name") != name:
+        _detach()
+        _segment.update(name=name, shm=shared_memory.SharedMemory(name=name))
+    return _views(_segment["shm"], shape, dtype)
+
+
+def _views(shm, shape: tuple, dtype: str):
+    """Float64 frequencies followed by the spectra in a memory block."""
+    freqs = np.ndarray((shape[1],), dtype=np.float64, buffer=shm.buf)
+    spectra = np.ndarray(
+        shape, dtype=dtype, buffer=shm.buf, offset=freqs.nbytes
+    )
+    return freqs, spectra
+
+
+def _detach() -> None:
+    """Release the shared memory block of this worker process."""
+    if "shm" in _segment:
+        _segment.pop("shm").close()
+    _segment.clear()
+
+
+def _harmonic_groups_rows(task):
+    """Harmonic groups of a range of spectra in shared memory."""
+    name, shape, dtype, start, stop, kwargs = task
+    freqs, spectra = _attach(name, shape, dtype)
+    results = [
+        harmonic_groups(freqs, spectra[i], **kwargs)
+        for i in range(start, stop)
+    ]
+    # views on the block must be gone before it can be closed
+    del freqs, spectra
+    return results
+
+
+def _context():
+    """Start method of the workers, safe in multithreaded processes."""
+    methods = multiprocessing.get_all_start_methods()
+    if "forkserver" in methods:
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class HarmonicGroupPool:
+    """Persistent process pool detecting harmonic groups in shared spectra.
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of worker processes, by default one less than the CPU count.
+    chunks_per_process : int, optional
+        Ranges of spectra handed to each worker per call, by default 4.
+        More ranges balance the load, fewer ranges reduce the overhead.
+    """
+
+    def __init__(
+        self, processes: int | None = None, chunks_per_process: int = 4
+    ) -> None:
+        if processes is None:
+            processes = max(1, multiprocessing.cpu_count() - 1)
+        self.processes = processes
+        self.chunks_per_process = chunks_per_process
+        # workers have to share the tracker of the blocks created here,
+        # otherwise their own trackers remove the blocks when they exit
+        resource_tracker.ensure_running()
+        self._pool = _context().Pool(processes)
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _share(self, freqs: np.ndarray, spectra: np.ndarray) -> tuple:
+        """Copy frequencies and spectra into the shared memory block.
+
+        The block is reused by later calls and only replaced by a larger
+        one when the spectra do not fit.
+        """
+        shape = spectra.shape
+        nbytes = shape[1] * np.dtype(np.float64).itemsize + spectra.nbytes
+        if self._shm is None or self._shm.size < nbytes:
+            self._release()
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        shared_freqs, shared_spectra = _views(
+            self._shm, shape, spectra.dtype.str
+        )
+        shared_freqs[:] = freqs
+        shared_spectra[:] = spectra
+        del shared_freqs, shared_spectra
+        return self._shm.name, shape, spectra.dtype.str
+
+    def harmonic_groups(self, freqs, spectra, **kwargs) -> list:
+        """Run thunderfish's `harmonic_groups` on every power spectrum.
+
+        Parameters
+        ----------
+        freqs : 1d-array
+            Frequencies of the power spectra.
+        spectra : 2d-array
+            Power spectra, one per row.
+        kwargs : dict
+            Parameters passed on to `harmonic_groups`.
+
+        Returns
+        -------
+        results : list
+            Return values of `harmonic_groups` for each spectrum, the same
+            as `pool.map(partial(harmonic_groups, freqs, **kwargs), spectra)`.
+        """
+        spectra = np.asarray(spectra)
+        if len(spectra) == 0:
+            return []
+        name, shape, dtype = self._share(freqs, spectra)
+        kwargs = dict(kwargs)
+        n_chunks = min(len(spectra), self.processes * self.chunks_per_process)
+        bounds = np.linspace(0, len(spectra), n_chunks + 1).astype(int)
+        tasks = [
+            (name, shape, dtype, int(start), int(stop), kwargs)
+            for start, stop in zip(bounds[:-1], bounds[1:], strict=True)
+        ]
+        results = []
+        for rows in self._pool.map(_harmonic_groups_rows, tasks):
+            results.extend(rows)
+        return results
+
+    def _release(self) -> None:
+        """Remove the shared memory block."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self) -> None:
+        """Stop the worker processes and remove the shared memory block."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._release()
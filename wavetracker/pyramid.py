@@ -0,0 +1,301 @@
+"""
+Multi-resolution pyramid of the fine spectrogram for interactive viewers.
+
+Level 0 is the fine spectrogram itself. Every further level max-pools the
+level below by 2 in frequency and in time, so level k holds about 4**-k of
+the fine spectrogram. The levels are written while the recording is
+analysed, alongside the fine spectrogram and with the same layout, i.e.
+column-major files in which every spectrum, and hence every time range, is
+contiguous. A viewer asks for a viewport and a pixel budget and gets the
+coarsest level that still resolves it, so that zooming and panning reads a
+number of values proportional to the pixels instead of the recording.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from wavetracker.finespec import (
+    FineSpec,
+    FineSpecWriter,
+    map_fine_spec,
+    open_fine_spec,
+)
+
+META_FILE = "spec_pyramid.json"
+
+
+def level_file(folder: str, level: int, name: str = "spec") -> str:
+    """Path of a file of a pyramid level, e.g. its spectra or times."""
+    return os.path.join(folder, f"pyramid_{level}_{name}.npy")
+
+
+def pool_spectra(spectra: np.ndarray) -> np.ndarray:
+    """Max-pool pairs of frequencies and times of a spectrogram.
+
+    An odd last frequency is kept as it is, the number of times has to be
+    even.
+    """
+    if spectra.shape[0] % 2:
+        spectra = np.vstack([spectra, spectra[-1:]])
+    spectra = np.maximum(spectra[0::2], spectra[1::2])
+    return np.maximum(spectra[:, 0::2], spectra[:, 1::2])
+
+
+def pool_axis(values: np.ndarray, pad: bool = False) -> np.ndarray:
+    """Centers of pairs of frequencies or times.
+
+    With `pad` an odd last value is kept, as `pool_spectra` does for the
+    frequencies, otherwise it is dropped.
+    """
+    if len(values) % 2:
+        values = np.append(values, values[-1]) if pad else values[:-1]
+    return (values[0::2] + values[1::2]) / 2
+
+
+def _resolution(values: np.ndarray) -> float:
+    """Mean spacing of evenly spaced frequencies or times."""
+    if len(values) < 2:
+        return 1.0
+    return (values[-1] - values[0]) / (len(values) - 1)
+
+
+class PyramidWriter:
+    """Writes the pooled levels of a fine spectrogram.
+
+    Parameters
+    ----------
+    folder : str
+        Folder of the pyramid files.
+    n_freqs : int
+        Number of frequencies of the fine spectrogram.
+    capacity : int
+        Number of spectra of the fine spectrogram to preallocate for.
+    levels : int
+        Number of pooled levels above the fine spectrogram.
+    dtype : str, optional
+        Data type of the stored power, as for `FineSpecWriter`.
+    scale : float, optional
+        Factor applied to the stored power, as for `FineSpecWriter`.
+    db_range : tuple, optional
+        Decibel range of integer codes, as for `FineSpecWriter`.
+    state : dict, optional
+        Progress of an interrupted analysis from `state`.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        n_freqs: int,
+        capacity: int,
+        levels: int,
+        dtype: str = "float32",
+        scale: float = 1.0,
+        db_range: tuple | None = None,
+        state: dict | None = None,
+    ) -> None:
+        self.folder = folder
+        columns = [0] * levels
+        self._carry = [None] * levels
+        if state is not None:
+            columns = state["pyramid_columns"]
+            self._carry = [
+                None if carry is None else np.asarray(carry)[:, None]
+                for carry in state["pyramid_carry"]
+            ]
+        self.writers = []
+        for level in range(1, levels + 1):
+            n_freqs = (n_freqs + 1) // 2
+            capacity = capacity // 2 + 1
+            self.writers.append(
+                FineSpecWriter(
+                    level_file(folder, level),
+                    n_freqs,
+                    capacity,
+                    dtype=dtype,
+                    scale=scale,
+                    start=columns[level - 1],
+                    db_range=db_range,
+                )
+            )
+
+    def write(self, spectra: np.ndarray) -> None:
+        """Pool the spectra (frequencies x times) of a snippet into all levels.
+
+        A single spectrum left over by a level is pooled with the first
+        spectrum of the next snippet.
+        """
+        for level, writer in enumerate(self.writers):
+            if self._carry[level] is not None:
+                spectra = np.hstack([self._carry[level], spectra])
+            n = spectra.shape[1] // 2 * 2
+            self._carry[level] = None
+            if n < spectra.shape[1]:
+                self._carry[level] = spectra[:, n:]
+            if n == 0:
+                return
+            spectra = pool_spectra(spectra[:, :n])
+            writer.write(spectra)
+
+    def state(self) -> dict:
+        """Progress of the pyramid for a checkpoint, after flushing it."""
+        for writer in self.writers:
+            writer.flush()
+        return {
+            "pyramid_columns": [writer.n_columns for writer in self.writers],
+            "pyramid_carry": [
+                None if carry is None else carry[:, 0].tolist()
+                for carry in self._carry
+            ],
+        }
+
+    def close(
+        self, freqs: np.ndarray | None = None, times: np.ndarray | None = None
+    ) -> None:
+        """Finish the files and store frequencies, times and the layout.
+
+        Without frequencies and times, e.g. when the analysis is aborted,
+        only the files are finished.
+
+        Parameters
+        ----------
+        freqs : 1d-array, optional
+            Frequencies of the fine spectrogram.
+        times : 1d-array, optional
+            Times of the fine spectrogram.
+        """
+        if freqs is None or times is None:
+            for writer in self.writers:
+                writer.close()
+            return
+        metas = []
+        for level, writer in enumerate(self.writers, start=1):
+            writer.close()
+            freqs = pool_axis(freqs, pad=True)
+            times = pool_axis(times)
+            np.save(level_file(self.folder, level, "freqs"), freqs)
+            np.save(
+                level_file(self.folder, level, "times"),
+                times[: writer.n_columns],
+            )
+            metas.append(writer.meta())
+        with open(os.path.join(self.folder, META_FILE), "w") as f:
+            json.dump({"levels": metas}, f, indent=2)
+
+
+class SpecPyramid:
+    """Read access to the levels of a spectrogram pyramid.
+
+    Attributes
+    ----------
+    levels : list of FineSpec
+        The fine spectrogram followed by the pooled levels.
+    """
+
+    def __init__(self, levels: list) -> None:
+        self.levels = levels
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def level_for(
+        self, duration: float, bandwidth: float, width: int, height: int
+    ) -> int:
+        """Coarsest level that resolves a viewport with the pixel budget.
+
+        Parameters
+        ----------
+        duration : float
+            Time range of the viewport in seconds.
+        bandwidth : float
+            Frequency range of the viewport in Hz.
+        width, height : int
+            Pixels available in time and frequency.
+
+        Returns
+        -------
+        level : int
+            Index of the level with at most about one spectrum per pixel,
+            or the coarsest level.
+        """
+        base = self.levels[0]
+        dt = _resolution(base.times)
+        df = _resolution(base.freqs)
+        excess = max(
+            duration / dt / max(width, 1), bandwidth / df / max(height, 1)
+        )
+        if excess <= 1:
+            return 0
+        return int(min(np.ceil(np.log2(excess)), len(self.levels) - 1))
+
+    def view(
+        self,
+        t0: float,
+        t1: float,
+        f0: float,
+        f1: float,
+        width: int,
+        height: int,
+        decibel: bool = False,
+    ) -> tuple:
+        """Spectrogram of a viewport at the resolution of the pixel budget.
+
+        Parameters
+        ----------
+        t0, t1 : float
+            Time range of the viewport in seconds.
+        f0, f1 : float
+            Frequency range of the viewport in Hz.
+        width, height : int
+            Pixels available in time and frequency.
+        decibel : bool, optional
+            Return the spectrogram in decibel instead of power.
+
+        Returns
+        -------
+        spec : 2d-array
+            Power or decibel (frequencies x times) within the viewport.
+        freqs : 1d-array
+            Frequencies of the rows.
+        times : 1d-array
+            Times of the columns.
+        """
+        level = self.levels[self.level_for(t1 - t0, f1 - f0, width, height)]
+        f_idx = slice(
+            np.searchsorted(level.freqs, f0),
+            np.searchsorted(level.freqs, f1, side="right"),
+        )
+        t_idx = slice(
+            np.searchsorted(level.times, t0),
+            np.searchsorted(level.times, t1, side="right"),
+        )
+        if decibel:
+            spec = level.decibel((f_idx, t_idx))
+        else:
+            spec = level[f_idx, t_idx]
+        return spec, level.freqs[f_idx], level.times[t_idx]
+
+
+def open_pyramid(folder: str) -> SpecPyramid:
+    """Open the fine spectrogram in `folder` with its pyramid levels.
+
+    Folders without a pyramid yield the fine spectrogram as only level.
+    """
+    levels = [open_fine_spec(folder)]
+    meta_file = os.path.join(folder, META_FILE)
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            metas = json.load(f)["levels"]
+        for level, meta in enumerate(metas, start=1):
+            if meta["shape"][1] == 0:
+                break
+            levels.append(
+                FineSpec(
+                    map_fine_spec(level_file(folder, level), meta),
+                    np.load(level_file(folder, level, "freqs")),
+                    np.load(level_file(folder, level, "times")),
+                    meta,
+                )
+            )
+    return SpecPyramid(levels)
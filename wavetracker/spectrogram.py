@@ -1,12 +1,12 @@
 import argparse
 import multiprocessing
 import os
-from functools import partial
 
 import gc
 import numpy as np
 import torch
 from matplotlib.mlab import specgram as mspecgram
+from scipy.signal import firwin
 from scipy.signal.windows import hann
 from thunderlab.powerspectrum import get_window
 
@@ -15,6 +15,15 @@ from wavetracker.logger import get_logger, get_progress
 
 from .config import Configuration
 from .datahandler import open_raw_data
+from .finespec import (
+    FineSpecWriter,
+    load_spectra,
+    open_fine_spec,
+    save_fine_spec_meta,
+    save_spectra,
+)
+from .pyramid import PyramidWriter
+from .stft import select_backend, stft_magnitude
 
 device = get_device()
 available_GPU = False if device.type == "cpu" else True
@@ -63,6 +72,36 @@ def get_step_and_overlap(overlap_frac, nfft, **kwargs):
     return step, noverlap
 
 
+def decimation_factor(samplerate, max_freq, nfft, step, passband=0.8):
+    """
+    Largest factor by which the data can be decimated while keeping frequencies up to "max_freq" within the passband
+    of the anti-aliasing filter. The factor divides nfft and step, so that both can be rescaled without changing the
+    frequency and time resolution of the spectrogram.
+
+    Parameters
+    ----------
+        samplerate : float
+            Samplerate of the data.
+        max_freq : float
+            Highest frequency that has to be preserved, e.g. the highest harmonic of the highest fundamental analysed.
+        nfft : int
+            Samples in one fft-window.
+        step : int
+            Samples by which consecutive nfft windows are shifted by.
+        passband : float, optional
+            Fraction of the decimated Nyquist frequency not affected by the filter (default is 0.8).
+
+    Returns
+    -------
+        factor : int
+            Decimation factor, 1 if the data cannot be decimated.
+    """
+    factor = int(samplerate * passband / (2 * max_freq))
+    while factor > 1 and (nfft % factor or step % factor):
+        factor -= 1
+    return max(factor, 1)
+
+
 # def tensorflow_spec(data, samplerate, nfft, step, **kwargs):
 #     """
 #     Computes a soectrogram for a datasnippet with n samples recorded on m channels. The function is based on the
@@ -142,7 +181,17 @@ def get_step_and_overlap(overlap_frac, nfft, **kwargs):
 #     return ret_spectra, freqs, times
 
 
-def pytorch_spec(data, data_overlap, samplerate, nfft, step, **kwargs):
+def pytorch_spec(
+    data,
+    data_overlap,
+    samplerate,
+    nfft,
+    step,
+    center=True,
+    backend="torch",
+    workers=None,
+    **kwargs,
+):
     """
     Computes a spectrogram for a data snippet with n samples recorded on m channels, including edge tapering
     to mitigate artifacts at the start and end of each chunk. The tapering is dynamically adjusted based on
@@ -159,6 +208,13 @@ def pytorch_spec(data, data_overlap, samplerate, nfft, step, **kwargs):
             Samples in one nfft window.
         step : int
             Samples by which consecutive nfft windows are shifted by.
+        center : bool, optional
+            Pad the data by reflection, so that the first nfft window is centered on the first sample, as in
+            torch.stft (default). Without, the windows start at the first sample.
+        backend : str, optional
+            STFT backend computing the spectrogram, see "wavetracker.stft" (default is "torch").
+        workers : int, optional
+            Number of threads of STFT backends that take it, e.g. "scipy".
         kwargs : dict
             Excess parameters from the configuration dictionary passed to the function.
 
@@ -193,22 +249,17 @@ def pytorch_spec(data, data_overlap, samplerate, nfft, step, **kwargs):
         )  # Adjust based on calibration
         return scaled_spectrogram
 
-    # Create Hann window for STFT
-    stft_window = torch.tensor(hann(nfft), dtype=torch.float32, device=device)
-
-    # Compute the short-time Fourier transform (STFT)
-    stft = torch.stft(
+    # Compute magnitude of the short-time Fourier transform (STFT) with a Hann window
+    spectra = stft_magnitude(
         data,
-        n_fft=nfft,
-        hop_length=step,
-        win_length=nfft,
-        window=stft_window,
-        return_complex=True,
+        nfft,
+        step,
+        hann(nfft),
+        center=center,
+        backend=backend,
+        workers=workers,
     )
 
-    # Compute magnitude of the STFT
-    spectra = torch.abs(stft)
-
     # Truncate the spectrogram to remove overlaps
     if data_overlap > 0:
         overlap_frames = data_overlap // step  # overlap from samples to STFT
@@ -245,6 +296,77 @@ def pytorch_spec(data, data_overlap, samplerate, nfft, step, **kwargs):
     return ret_spectra, freqs, times
 
 
+def chunked_pytorch_spec(
+    data,
+    data_overlap,
+    samplerate,
+    nfft,
+    step,
+    chunk_channels,
+    rows=None,
+    **kwargs,
+):
+    """
+    Computes the spectrograms of a data snippet in chunks of channels, so that the STFT temporaries only exist for one
+    chunk at a time. The spectrogram summed up over all channels is accumulated in place and of the spectrograms of
+    the single channels only the rows in "rows" are kept.
+
+    Parameters
+    ----------
+        data : 2d-tensor
+            Contains a snippet of raw data from electrode (grid) recordings of electric fish (channels x samples).
+        data_overlap : int
+            Samples of the snippet overlapping with the neighbouring snippets.
+        samplerate : int
+            Samplerate of the data.
+        nfft : int
+            Samples in one nfft window.
+        step : int
+            Samples by which consecutive nfft windows are shifted by.
+        chunk_channels : int
+            Number of channels transformed at once.
+        rows : slice, optional
+            Frequency rows of the single channel spectrograms that are kept, by default all.
+        kwargs : dict
+            Excess parameters from the configuration dictionary passed to the function.
+
+    Returns
+    -------
+        spec : 3d-tensor
+            Spectrograms of the single channels restricted to "rows" (channels x rows x times).
+        sum_spec : 2d-tensor
+            Spectrogram summed up over all channels (frequencies x times).
+        freqs : 1d-array
+            Frequencies of the summed spectrogram.
+        times : 1d-array
+            Times of the spectrograms.
+    """
+    rows = slice(None) if rows is None else rows
+    spec, sum_spec = None, None
+    for c0 in range(0, data.shape[0], chunk_channels):
+        chunk, freqs, times = pytorch_spec(
+            data=data[c0 : c0 + chunk_channels],
+            data_overlap=data_overlap,
+            samplerate=samplerate,
+            nfft=nfft,
+            step=step,
+            **kwargs,
+        )
+        if sum_spec is None:
+            sum_spec = chunk.sum(dim=0)
+            kept = chunk[:, rows]
+            spec = torch.empty(
+                (data.shape[0], *kept.shape[1:]),
+                dtype=chunk.dtype,
+                device=chunk.device,
+            )
+        else:
+            sum_spec += chunk.sum(dim=0)
+        spec[c0 : c0 + len(chunk)] = chunk[:, rows]
+        del chunk
+    return spec, sum_spec, freqs, times
+
+
 def mlab_spec(
     data,
     samplerate,
@@ -302,6 +424,217 @@ def mlab_spec(
     return spec, freqs, times
 
 
+class StreamCarry:
+    """
+    Carries the samples of the incomplete nfft windows at the end of a data block over to the next block, so that
+    consecutive blocks without overlap yield exactly the frames of a single STFT of the whole recording, as computed
+    by torch.stft with centered windows. Every sample is thus read and transformed only once.
+
+    Parameters
+    ----------
+        nfft : int
+            Samples in one nfft window.
+        step : int
+            Samples by which consecutive nfft windows are shifted by.
+        samplerate : int
+            Samplerate of the data.
+        length : int, optional
+            Samples of the whole recording. The block reaching its end is padded with reflected samples, as
+            torch.stft pads, so that the last windows are emitted as well. By default the end is not known and the
+            windows overlapping it are never complete.
+    """
+
+    def __init__(self, nfft, step, samplerate, length=None):
+        self.nfft = nfft
+        self.step = step
+        self.samplerate = samplerate
+        self.length = length
+        self.carry = None
+        # index of the next sample and nominal start of the next block, which differ for the output of a filter
+        # lagging behind its input
+        self.start = 0
+        self.position = 0
+
+    def frames_before(self, sample):
+        """
+        Number of nfft windows that are complete before "sample".
+        """
+        return (sample - self.nfft // 2) // self.step + 1
+
+    def window_start(self, sample):
+        """
+        First sample of the first nfft window that is not complete before "sample".
+        """
+        return self.frames_before(sample) * self.step - self.nfft // 2
+
+    def prime(self, samples, start, position=None):
+        """
+        Continues the stream at sample "start", e.g. when an interrupted analysis is resumed.
+
+        Parameters
+        ----------
+            samples : 2d-tensor
+                Data from sample "window_start(start)" up to "start" (channels x samples).
+            start : int
+                Sample of the recording at which the next block starts.
+            position : int, optional
+                Nominal start of the next block the times refer to, by default "start".
+        """
+        self.carry = samples
+        self.start = start
+        self.position = start if position is None else position
+
+    def extend(self, block, length=None):
+        """
+        Prepends the carried samples to a data block and keeps the samples of its incomplete windows for the next
+        block.
+
+        Parameters
+        ----------
+            block : 2d-tensor
+                The next data block (channels x samples).
+            length : int, optional
+                Nominal length of the block, by default its number of samples.
+
+        Returns
+        -------
+            data : 2d-tensor
+                Data whose complete nfft windows, without centering, are the next frames of the STFT.
+            times : 1d-array
+                Times of the centers of these windows relative to the nominal start of the block.
+        """
+        if self.carry is None:
+            # reflection at the start of the recording, as torch.stft pads
+            pad = torch.flip(block[:, 1 : self.nfft // 2 + 1], dims=(-1,))
+            data = torch.cat((pad, block), dim=-1)
+            first = -(self.nfft // 2)
+        else:
+            data = torch.cat((self.carry, block), dim=-1)
+            first = self.start - self.carry.shape[-1]
+        if (
+            self.length is not None
+            and self.start < self.length <= self.start + block.shape[-1]
+        ):
+            # reflection at the end of the recording, as torch.stft pads
+            pad = torch.flip(data[:, -(self.nfft // 2) - 1 : -1], dims=(-1,))
+            data = torch.cat((data, pad), dim=-1)
+
+        frames = max(0, (data.shape[-1] - self.nfft) // self.step + 1)
+        self.carry = data[:, frames * self.step :].clone()
+        centers = first + self.nfft // 2 + np.arange(frames) * self.step
+        times = (centers - self.position) / self.samplerate
+        self.start += block.shape[-1]
+        self.position += block.shape[-1] if length is None else length
+        return data[:, : (frames - 1) * self.step + self.nfft], times
+
+
+class Decimator:
+    """
+    Low-pass filters and decimates data blocks on the compute device with a polyphase FIR filter, i.e. the filter is
+    only evaluated at the retained samples. The filter has the design of scipy.signal.resample_poly and its gain is
+    the decimation factor, so that the power of the spectrograms computed with a correspondingly reduced nfft matches
+    the one of the original data.
+
+    Parameters
+    ----------
+        factor : int
+            Decimation factor.
+        stream : bool, optional
+            Blocks follow each other without overlap. The samples needed by the filter for the outputs at the end of a
+            block are then carried over to the next block (see "StreamCarry"). Otherwise, each block is filtered on
+            its own with reflected edges (default is False).
+        length : int, optional
+            Samples of the whole recording, so that the stream also emits the output samples at its end (see
+            "StreamCarry").
+    """
+
+    def __init__(self, factor, stream=False, length=None):
+        self.factor = factor
+        self.half_len = 10 * factor
+        self.taps = factor * firwin(
+            2 * self.half_len + 1, 1.0 / factor, window=("kaiser", 5.0)
+        )
+        self.carry = (
+            StreamCarry(len(self.taps), factor, 1, length=length)
+            if stream
+            else None
+        )
+        self._kernel = None
+
+    def filter(self, data):
+        """
+        Output samples of the complete filter windows in "data" (channels x samples), one every "factor" samples.
+        """
+        if self._kernel is None or (
+            self._kernel.device,
+            self._kernel.dtype,
+        ) != (data.device, data.dtype):
+            self._kernel = torch.tensor(
+                self.taps[::-1].copy(), dtype=data.dtype, device=data.device
+            ).view(1, 1, -1)
+        if data.shape[-1] < len(self.taps):
+            return data[:, :0]
+        return torch.nn.functional.conv1d(
+            data[:, None], self._kernel, stride=self.factor
+        )[:, 0]
+
+    def __call__(self, block):
+        """
+        Decimates a data block (channels x samples). Output sample k corresponds to input sample k * factor of the
+        block, or of the recording in stream mode, where the outputs lag behind the block by the half filter length.
+        """
+        if self.carry is not None:
+            data, _ = self.carry.extend(block)
+            return self.filter(data)
+        data = torch.nn.functional.pad(
+            block[:, None], (self.half_len, self.half_len), mode="reflect"
+        )[:, 0]
+        # the last output sample lies within the block
+        usable = (block.shape[-1] - 1) // self.factor * self.factor + 1
+        return self.filter(data[:, : usable + 2 * self.half_len])
+
+    def emitted(self, sample):
+        """
+        Number of output samples in stream mode once the input before "sample" is passed.
+        """
+        return self.carry.frames_before(sample)
+
+    def input_range(self, start, stop):
+        """
+        Input samples needed for the output samples "start" to "stop".
+        """
+        return (
+            start * self.factor - self.half_len,
+            (stop - 1) * self.factor + self.half_len + 1,
+        )
+
+
+def gather_signatures(spec, f_idx, t_idx):
+    """
+    Gathers the power of each channel at pairs of frequency and time indices of a spectrogram. Spectrograms kept as
+    tensors are indexed on their device, so that only the signatures are transferred to the host.
+
+    Parameters
+    ----------
+        spec : 3d-array, 3d-tensor
+            Spectrograms of the single channels (channels x frequencies x times).
+        f_idx : 1d-array
+            Frequency indices of the signals.
+        t_idx : 1d-array
+            Time indices of the signals.
+
+    Returns
+    -------
+        sign_v : 2d-array
+            Power of the signals in each channel (signals x channels).
+    """
+    if isinstance(spec, torch.Tensor):
+        f_idx = torch.as_tensor(f_idx, dtype=torch.long, device=spec.device)
+        t_idx = torch.as_tensor(t_idx, dtype=torch.long, device=spec.device)
+        return spec[:, f_idx, t_idx].transpose(0, 1).cpu().numpy()
+    return spec[:, f_idx, t_idx].transpose()
+
+
 class Spectrogram:
     """
     Tools to compute and collect spectrogram data while analyzing large files of electric fish. This includes the
@@ -330,6 +663,20 @@ class Spectrogram:
         folder,
         verbose=0,
         core_count=None,
+        channel_list=None,
+        fine_spec_dtype="float32",
+        fine_spec_scale=1.0,
+        fine_spec_band=None,
+        pyramid_levels=0,
+        sparse_spec_dtype=None,
+        db_range=None,
+        device_spec=False,
+        stft_memory=None,
+        signature_band=None,
+        stream=False,
+        decimation=1,
+        stft_backend="torch",
+        recording_length=None,
         **kwargs,
     ):
         """
@@ -362,6 +709,50 @@ class Spectrogram:
             core_count : int
                 CPU core count that can be used for simultaneous spectrogram analysis of different channels in one
                 data-snippet.
+            channel_list : 1d-array, optional
+                Recording channels contained in the data snippets, i.e. the electrodes corresponding to the rows of
+                "spec" and the columns of the signatures. Defaults to all channels.
+            fine_spec_dtype : str, optional
+                Data type of the stored full spectrogram, "float32" (default) or "float16" power, or "uint8" or
+                "uint16" decibel codes over "db_range".
+            fine_spec_scale : float, optional
+                Factor applied to the power before it is stored in the full spectrogram, e.g. to move it into the
+                range of float16 (default is 1.0).
+            fine_spec_band : tuple, optional
+                Lower and upper frequency of the band stored in the full spectrogram. None, or None for either end,
+                stores the spectrogram from 0 Hz or up to the Nyquist frequency.
+            pyramid_levels : int, optional
+                Number of levels of the multi-resolution pyramid stored along with the full spectrogram for viewers,
+                each max-pooling the level below by 2 in time and frequency (default is 0, no pyramid).
+            sparse_spec_dtype : str, optional
+                Data type of the stored sparse spectrogram. As for "fine_spec_dtype", "uint8" or "uint16" store the
+                power as decibel codes (default is None, float64 power).
+            db_range : tuple, optional
+                Lower and upper decibel covered by the decibel codes (default is finespec.DEFAULT_DB_RANGE).
+            device_spec : bool, optional
+                Keep the spectrograms of the single channels as tensors on the compute device and only transfer the
+                summed spectrogram to the host. Signatures are then gathered with "gather_signatures" (default is
+                False).
+            stft_memory : float, optional
+                Bytes available for the STFT of a snippet. The channels are then transformed in chunks fitting the
+                budget instead of all at once (default is None, no limit).
+            signature_band : tuple, optional
+                Lower and upper frequency of the spectrograms of the single channels that are kept for the signatures
+                of the signals, e.g. the range of fundamental frequencies. Defaults to all frequencies.
+            stream : bool, optional
+                Compute the spectrogram of snippets without overlap as a single STFT of the whole recording, carrying
+                the samples of incomplete nfft windows from one snippet to the next (see "StreamCarry"). The
+                "snippet_overlap" has to be 0 (default is False).
+            decimation : int, optional
+                Factor by which the data snippets are low-pass filtered and decimated before the STFT (see
+                "Decimator"). Samplerate, snippet sizes, data shape, nfft and step are then given for the decimated
+                data (default is 1, no decimation).
+            stft_backend : str, optional
+                STFT backend, one of the backends registered in "wavetracker.stft" or "auto" to benchmark them once
+                on this machine and use the fastest one (default is "torch").
+            recording_length : int, optional
+                Samples of the recording before the decimation. In "stream" mode the windows at its end are
+                completed with reflected samples, as torch.stft pads (default is data_shape[0] * decimation).
             kwargs : dict
                 Excess parameters from the configuration dictionary passed to the function.
         """
@@ -369,6 +760,23 @@ class Spectrogram:
         self.verbose = verbose
         self.kwargs = kwargs
         self.gpu = True
+        self.device_spec = device_spec
+        self.stft_memory = stft_memory
+        self.signature_band = signature_band
+        if recording_length is None:
+            recording_length = data_shape[0] * decimation
+        # samples of the decimated recording
+        stream_length = (recording_length - 1) // decimation + 1
+        self.stream = (
+            StreamCarry(nfft, step, samplerate, length=stream_length)
+            if stream
+            else None
+        )
+        self.decimator = (
+            Decimator(decimation, stream=stream, length=recording_length)
+            if decimation > 1
+            else None
+        )
 
         # spectrogram parameters
         self.snippet_size = snippet_size
@@ -376,7 +784,12 @@ class Spectrogram:
         self.nfft = nfft
         self._overlap_frac = overlap_frac
         self.channels = data_shape[1] if channels == -1 else channels
-        self.channel_list = np.arange(self.channels)
+        self.channel_list = (
+            np.arange(self.channels)
+            if channel_list is None
+            else np.asarray(channel_list)
+        )
+        self.channels = len(self.channel_list)
         self.samplerate = samplerate
         self.data_shape = data_shape
         self.step = step
@@ -385,11 +798,14 @@ class Spectrogram:
         self.core_count = (
             multiprocessing.cpu_count() if not core_count else core_count
         )
-        self.partial_func = partial(
-            mlab_spec,
-            samplerate=self.samplerate,
-            nfft=self.nfft,
-            noverlap=self.noverlap,
+        self.stft_backend = select_backend(
+            stft_backend,
+            device,
+            self.nfft,
+            self.step,
+            self.channels,
+            self.snippet_size,
+            workers=self.core_count,
         )
 
         # output
@@ -405,6 +821,7 @@ class Spectrogram:
 
         self.min_freq, self.max_freq = 0, 2000
         self.monitor_res = (1920, 1080)
+        self.sparse_columns = None
 
         self._get_fine_spec = False
         self._get_sparse_spec = False
@@ -433,7 +850,7 @@ class Spectrogram:
                 self.sparse_time_borders, self.sparse_freq_borders = None, None
                 self.sparse_time, self.sparse_freq = None, None
             else:
-                self.sparse_spectra = np.load(
+                self.sparse_spectra = load_spectra(
                     os.path.join(self.save_path, "sparse_spectra.npy")
                 )
                 self.sparse_time_borders, self.sparse_freq_borders = None, None
@@ -446,7 +863,14 @@ class Spectrogram:
 
             ### fine spec
             self.fine_spec_str = os.path.join(self.save_path, "fine_spec.npy")
-            self.buffer_spectra = None
+            self.fine_spec_dtype = fine_spec_dtype
+            self.fine_spec_scale = fine_spec_scale
+            self.fine_spec_band = fine_spec_band
+            self.fine_spec_writer = None
+            self.pyramid_levels = pyramid_levels
+            self.sparse_spec_dtype = sparse_spec_dtype
+            self.db_range = db_range
+            self.pyramid_writer = None
 
             if not os.path.exists(
                 os.path.join(self.save_path, "fine_spec_shape.npy")
@@ -456,22 +880,12 @@ class Spectrogram:
                 self.fine_spec_shape = None
                 self.fine_times = np.array([])
             else:
-                self.fine_spec_shape = np.load(
-                    os.path.join(self.save_path, "fine_spec_shape.npy")
-                )
-                self.fine_spec = np.memmap(
-                    self.fine_spec_str,
-                    dtype="float",
-                    mode="r",
-                    shape=(self.fine_spec_shape[0], self.fine_spec_shape[1]),
-                    order="F",
-                )
-                self.fine_times = np.load(
-                    os.path.join(self.save_path, "fine_times.npy")
-                )
-                self.spec_freqs = np.load(
-                    os.path.join(self.save_path, "fine_freqs.npy")
+                self.fine_spec = open_fine_spec(
+                    self.save_path, self.fine_spec_str
                 )
+                self.fine_spec_shape = self.fine_spec.shape
+                self.fine_times = self.fine_spec.times
+                self.spec_freqs = self.fine_spec.freqs
         self.terminate = False
 
     @property
@@ -518,6 +932,7 @@ class Spectrogram:
         """
         if get_sparse_s:
             self.sparse_spectra = None
+            self.sparse_columns = None
             self.sparse_time_borders, self.sparse_freq_borders = None, None
             self.sparse_time, self.sparse_freq = None, None
         self._get_sparse_spec = bool(get_sparse_s)
@@ -544,6 +959,8 @@ class Spectrogram:
         if get_fine_s:
             self._get_fine_spec = True
             self.fine_spec = None
+            self.fine_spec_writer = None
+            self.pyramid_writer = None
             self.fine_spec_shape = None
             self.fine_times = np.array([])
         self._get_fine_spec = bool(get_fine_s)
@@ -562,20 +979,81 @@ class Spectrogram:
             snipptet_t0 : float
                 Timeponit of the first datapoint in the data snippet in respect to the whole recording analized.
         """
+        self.consume_snippet(
+            *self.compute_snippet(data_snippet), snipptet_t0=snipptet_t0
+        )
+
+    def compute_snippet(self, data_snippet):
+        """
+        Computes the spectrograms of a data snippet without changing the state of the class, so that the spectrogram
+        of the next snippet can be computed while the current one is still processed. Only in "stream" mode the
+        samples carried over to the next snippet are updated, so that snippets have to be passed in order.
+
+        Parameters
+        ----------
+            data_snippet : 2d-array, 2d-tensor
+                The data snippet to analyse. The 1st dimension contains the data for the different recording channels.
+
+        Returns
+        -------
+            spec : 3d-array, 3d-tensor
+                Spectrograms of the single channels (channels x frequencies x times), a tensor on the compute device
+                with "device_spec". Restricted to the "signature_band", see "signature_rows".
+            sum_spec : 2d-array, 2d-tensor
+                Spectrogram summed up over all channels, also a tensor on the compute device with "device_spec", so
+                that the harmonic groups can be detected there.
+            spec_freqs : 1d-array
+                Frequencies of the spectrograms.
+            spec_times : 1d-array
+                Times of the spectrograms relative to the start of the snippet.
+        """
         if self.gpu:
-            self.spec, self.spec_freqs, spec_times = pytorch_spec(
-                data=data_snippet,
-                data_overlap=self.snippet_overlap,
-                samplerate=self.samplerate,
-                step=self.step,
-                nfft=self.nfft,
-                **self.kwargs,
-            )
+            data, length = data_snippet, None
+            data_overlap, center = self.snippet_overlap, True
+            if self.decimator is not None:
+                data = self.decimator(data_snippet)
+                length = data_snippet.shape[-1] // self.decimator.factor
+            if self.stream is not None:
+                data, stream_times = self.stream.extend(data, length)
+                data_overlap, center = 0, False
+
+            rows = self.signature_rows()
+            chunk_channels = self.stft_chunk_channels(data.shape[-1])
+            if chunk_channels < data.shape[0]:
+                spec, sum_spec, spec_freqs, spec_times = chunked_pytorch_spec(
+                    data=data,
+                    data_overlap=data_overlap,
+                    samplerate=self.samplerate,
+                    step=self.step,
+                    nfft=self.nfft,
+                    chunk_channels=chunk_channels,
+                    rows=rows,
+                    center=center,
+                    backend=self.stft_backend,
+                    workers=self.core_count,
+                    **self.kwargs,
+                )
+            else:
+                spec, spec_freqs, spec_times = pytorch_spec(
+                    data=data,
+                    data_overlap=data_overlap,
+                    samplerate=self.samplerate,
+                    step=self.step,
+                    nfft=self.nfft,
+                    center=center,
+                    backend=self.stft_backend,
+                    workers=self.core_count,
+                    **self.kwargs,
+                )
+                sum_spec = spec.sum(dim=0)
+                if rows != slice(0, spec.shape[1]):
+                    # copy, so that the full spectrograms can be freed
+                    spec = spec[:, rows].clone()
+            if self.stream is not None:
+                spec_times = stream_times
 
-            self.sum_spec = self.spec.sum(dim=0)
-            self.sum_spec = self.sum_spec.cpu().numpy()
-            self.spec = self.spec.cpu().numpy()
-            self.itter_count += 1
+            if not self.device_spec:
+                spec, sum_spec = spec.cpu().numpy(), sum_spec.cpu().numpy()
 
         # else:
         #     self.step, self.noverlap = get_step_and_overlap(
@@ -607,6 +1085,32 @@ class Spectrogram:
         #     # )
         #     # plt.show()
 
+        return spec, sum_spec, spec_freqs, spec_times
+
+    def consume_snippet(
+        self, spec, sum_spec, spec_freqs, spec_times, snipptet_t0
+    ):
+        """
+        Makes the spectrograms computed by "compute_snippet" the current snippet spectrogram and generates the sparse-
+        and full spectrograms of the whole recording from it.
+
+        Parameters
+        ----------
+            spec : 3d-array
+                Spectrograms of the single channels (channels x frequencies x times).
+            sum_spec : 2d-array, 2d-tensor
+                Spectrogram summed up over all channels.
+            spec_freqs : 1d-array
+                Frequencies of the spectrograms.
+            spec_times : 1d-array
+                Times of the spectrograms relative to the start of the snippet.
+            snipptet_t0 : float
+                Timeponit of the first datapoint in the data snippet in respect to the whole recording analized.
+        """
+        if isinstance(sum_spec, torch.Tensor):
+            sum_spec = sum_spec.cpu().numpy()
+        self.spec, self.sum_spec, self.spec_freqs = spec, sum_spec, spec_freqs
+        self.itter_count += 1
         self.spec_times = spec_times + snipptet_t0
         self.times = np.concatenate((self.times, self.spec_times))
 
@@ -687,9 +1191,11 @@ class Spectrogram:
                 self.sparse_freq_borders = np.linspace(
                     self.min_freq,
                     self.max_freq,
-                    (self.max_freq - self.min_freq)
-                    // (self.spec_freqs[1] - self.spec_freqs[0])
-                    + 1,
+                    int(
+                        (self.max_freq - self.min_freq)
+                        // (self.spec_freqs[1] - self.spec_freqs[0])
+                        + 1
+                    ),
                 )
             if recreate_matrix:
                 self.sparse_spectra = np.zeros(
@@ -699,26 +1205,47 @@ class Spectrogram:
                     )
                 )
 
-        for i in range(len(self.sparse_freq_borders) - 1):
-            for j in range(len(self.sparse_time_borders) - 1):
-                if self.sparse_time_borders[j] > self.spec_times[-1]:
-                    break
-                if self.sparse_time_borders[j + 1] < self.spec_times[0]:
-                    continue
-                t_mask = np.arange(len(self.spec_times))[
-                    (self.spec_times >= self.sparse_time_borders[j])
-                    & (self.spec_times < self.sparse_time_borders[j + 1])
-                ]
-                f_mask = np.arange(len(plot_spectra))[
-                    (plot_freqs >= self.sparse_freq_borders[i])
-                    & (plot_freqs < self.sparse_freq_borders[i + 1])
-                ]
-                if len(t_mask) == 0 or len(f_mask) == 0:
-                    continue
-
-                self.sparse_spectra[i, j] = np.max(
-                    plot_spectra[f_mask[:, None], t_mask]
-                )
+        # bin of every frequency and time, -1 or n_bins outside the borders
+        f_bins = (
+            np.searchsorted(self.sparse_freq_borders, plot_freqs, side="right")
+            - 1
+        )
+        t_bins = (
+            np.searchsorted(
+                self.sparse_time_borders, self.spec_times, side="right"
+            )
+            - 1
+        )
+        f_valid = (f_bins >= 0) & (f_bins < len(self.sparse_freq_borders) - 1)
+        t_valid = (t_bins >= 0) & (t_bins < len(self.sparse_time_borders) - 1)
+        if not np.any(f_valid) or not np.any(t_valid):
+            return
+        # frequencies and times are sorted, so the valid ones are contiguous
+        f_idx, t_idx = np.flatnonzero(f_valid), np.flatnonzero(t_valid)
+        f_bins, t_bins = f_bins[f_idx], t_bins[t_idx]
+        spectra = plot_spectra[
+            f_idx[0] : f_idx[-1] + 1, t_idx[0] : t_idx[-1] + 1
+        ]
+
+        f_starts = np.flatnonzero(np.diff(f_bins, prepend=-1))
+        t_starts = np.flatnonzero(np.diff(t_bins, prepend=-1))
+        pooled = np.maximum.reduceat(
+            np.maximum.reduceat(spectra, f_starts, axis=0), t_starts, axis=1
+        )
+
+        # time bins at the snippet borders also hold the neighbouring snippet
+        cells = np.ix_(f_bins[f_starts], t_bins[t_starts])
+        self.sparse_spectra[cells] = np.maximum(
+            self.sparse_spectra[cells], pooled
+        )
+        # time bins updated since the last checkpoint
+        columns = [int(t_bins[0]), int(t_bins[-1]) + 1]
+        if self.sparse_columns is not None:
+            columns = [
+                min(columns[0], self.sparse_columns[0]),
+                max(columns[1], self.sparse_columns[1]),
+            ]
+        self.sparse_columns = columns
 
     def create_fine_spec(self):
         """
@@ -727,52 +1254,252 @@ class Spectrogram:
         get very large due to the lack of reduction in frequency and time resolution. Similar to the sparse spectrogram,
         this full spectrogram resembles the summed up spectrograms over all electrodes.
 
+        The file is preallocated for the whole recording and the spectra are written by a background thread.
         """
-        if not hasattr(self.fine_spec, "__len__"):
+        if self.fine_spec_writer is None:
             if not os.path.exists(self.save_path):
                 os.makedirs(self.save_path)
-            self.fine_spec = np.memmap(
+            rows = self.fine_spec_rows()
+            self.fine_spec_writer = FineSpecWriter(
                 self.fine_spec_str,
-                dtype="float",
-                mode="w+",
-                shape=(len(self.spec_freqs), len(self.spec_times)),
-                order="F",
+                rows.stop - rows.start,
+                self.fine_spec_capacity(),
+                dtype=self.fine_spec_dtype,
+                scale=self.fine_spec_scale,
+                freq_offset=rows.start,
+                db_range=self.db_range,
             )
-            self.fine_spec[:, :] = self.sum_spec
-            self.fine_spec_shape = np.shape(self.fine_spec)
-        else:
-            if not hasattr(self.buffer_spectra, "__len__"):
-                self.buffer_spectra = self.sum_spec
-            else:
-                self.buffer_spectra = np.append(
-                    self.buffer_spectra, self.sum_spec, axis=1
-                )
-            if np.shape(self.buffer_spectra)[1] >= 500 or self.terminate:
-                self.fine_spec = np.memmap(
-                    self.fine_spec_str,
-                    dtype="float",
-                    mode="r+",
-                    shape=(
-                        self.fine_spec_shape[0],
-                        self.fine_spec_shape[1]
-                        + np.shape(self.buffer_spectra)[1],
-                    ),
-                    order="F",
+            if self.pyramid_levels > 0:
+                self.pyramid_writer = PyramidWriter(
+                    self.save_path,
+                    rows.stop - rows.start,
+                    self.fine_spec_capacity(),
+                    self.pyramid_levels,
+                    dtype=self.fine_spec_dtype,
+                    scale=self.fine_spec_scale,
+                    db_range=self.db_range,
                 )
-                self.fine_spec[:, -np.shape(self.buffer_spectra)[1] :] = (
-                    self.buffer_spectra
+        spectra = self.sum_spec[self.fine_spec_rows()]
+        self.fine_spec_writer.write(spectra)
+        if self.pyramid_writer is not None:
+            self.pyramid_writer.write(spectra)
+        self.fine_spec_shape = self.fine_spec_writer.shape
+
+    def prime_stream(self, load, start):
+        """
+        Continues the "stream" mode at sample "start" of the recording, e.g. when an interrupted analysis is resumed,
+        by loading the samples carried over from the preceding snippet.
+
+        Parameters
+        ----------
+            load : callable
+                Returns the data (channels x samples) for a start and stop sample of the recording.
+            start : int
+                Sample of the recording at which the next snippet starts.
+        """
+        if self.decimator is None:
+            carry = load(self.stream.window_start(start), start)
+            self.stream.prime(carry, start)
+            return
+        decimator = self.decimator
+        carry = load(decimator.carry.window_start(start), start)
+        decimator.carry.prime(carry, start)
+        # decimated samples carried by the stream, filtered from the input
+        emitted = decimator.emitted(start)
+        first = self.stream.window_start(emitted)
+        carry = decimator.filter(load(*decimator.input_range(first, emitted)))
+        self.stream.prime(
+            carry, emitted, position=start // decimator.factor
+        )
+
+    def signature_rows(self):
+        """
+        Rows of the spectrogram within the "signature_band", i.e. the frequencies of the spectrograms of the single
+        channels.
+
+        Returns
+        -------
+            rows : slice
+                Frequency indices of the single channel spectrograms.
+        """
+        freqs = np.fft.rfftfreq(self.nfft, 1 / self.samplerate)
+        low, high = self.signature_band or (None, None)
+        start = 0 if low is None else np.searchsorted(freqs, low)
+        stop = (
+            len(freqs)
+            if high is None
+            else np.searchsorted(freqs, high, side="right")
+        )
+        return slice(int(start), int(stop))
+
+    def stft_chunk_channels(self, n_samples):
+        """
+        Number of channels whose STFT fits into the "stft_memory" budget at once.
+
+        Parameters
+        ----------
+            n_samples : int
+                Samples of a data snippet.
+
+        Returns
+        -------
+            chunk_channels : int
+                Channels transformed at once, at least one.
+        """
+        if not self.stft_memory:
+            return self.channels
+        # complex STFT, its magnitude and the two scaling temporaries
+        bytes_per_value = 8 + 4 + 4 + 4
+        frames = n_samples // self.step + 1
+        channel_bytes = (self.nfft // 2 + 1) * frames * bytes_per_value
+        return max(1, int(self.stft_memory // channel_bytes))
+
+    def signatures(self, spec, f_idx, t_idx):
+        """
+        Power of the signals in each channel from the spectrograms of the single channels of a snippet.
+
+        Parameters
+        ----------
+            spec : 3d-array, 3d-tensor
+                Spectrograms of the single channels as returned by "compute_snippet".
+            f_idx : 1d-array
+                Indices of the fundamental frequencies of the signals in the full frequency range. Indices outside the
+                "signature_band" are clipped to it.
+            t_idx : 1d-array
+                Time indices of the signals.
+
+        Returns
+        -------
+            sign_v : 2d-array
+                Power of the signals in each channel (signals x channels).
+        """
+        f_idx = np.asarray(f_idx, dtype=int) - self.signature_rows().start
+        f_idx = np.clip(f_idx, 0, spec.shape[1] - 1)
+        return gather_signatures(spec, f_idx, t_idx)
+
+    def fine_spec_rows(self):
+        """
+        Rows of the spectrogram within the frequency band that is stored in the full spectrogram.
+
+        Returns
+        -------
+            rows : slice
+                Frequency indices of the stored band.
+        """
+        low, high = self.fine_spec_band or (None, None)
+        start = 0 if low is None else np.searchsorted(self.spec_freqs, low)
+        stop = (
+            len(self.spec_freqs)
+            if high is None
+            else np.searchsorted(self.spec_freqs, high, side="right")
+        )
+        return slice(int(start), int(stop))
+
+    def fine_spec_capacity(self):
+        """
+        Upper bound of the spectra in the full spectrogram of the recording, used to preallocate its file.
+        """
+        usable_size = self.snippet_size - self.snippet_overlap
+        frames = (
+            1
+            + self.snippet_size // self.step
+            - self.snippet_overlap // self.step
+        )
+        return (self.data_shape[0] // usable_size + 1) * frames
+
+    def flush_fine_spec(self):
+        """
+        Waits until all spectra of the full spectrogram are written to the harddrive.
+        """
+        if self.fine_spec_writer is not None:
+            self.fine_spec_writer.flush()
+
+    def checkpoint_state(self):
+        """
+        Collects the state that is needed to continue the spectrogram analysis after the last processed snippet. The
+        buffered columns of the full spectrogram are flushed to the harddrive first, so that the stored shape covers
+        all processed snippets.
+
+        The arrays "times" and "fine_times" only grow between checkpoints. The range of time bins (columns) of the
+        sparse spectrogram that changed since the previous call is given by "sparse_columns", so that a checkpoint
+        only needs to store these.
+
+        Returns
+        -------
+            state : dict
+                Scalars, lists and arrays describing the progress of the spectrogram analysis.
+        """
+        state = {"itter_count": self.itter_count, "times": self.times}
+        if self._get_sparse_spec and hasattr(self.sparse_spectra, "__len__"):
+            state["sparse_spectra"] = self.sparse_spectra
+            state["sparse_time_borders"] = self.sparse_time_borders
+            state["sparse_freq_borders"] = self.sparse_freq_borders
+            state["sparse_columns"] = self.sparse_columns
+            self.sparse_columns = None
+        if self._get_fine_spec and self.fine_spec_writer is not None:
+            self.flush_fine_spec()
+            state["fine_spec_shape"] = [int(n) for n in self.fine_spec_shape]
+            state["fine_times"] = self.fine_times
+            state["spec_freqs"] = self.spec_freqs
+            if self.pyramid_writer is not None:
+                state.update(self.pyramid_writer.state())
+        return state
+
+    def restore_state(self, state):
+        """
+        Continues the spectrogram analysis from a state collected by "checkpoint_state". Columns of the memory-mapped
+        full spectrogram beyond the stored shape are overwritten by the following snippets.
+
+        Parameters
+        ----------
+            state : dict
+                Scalars and arrays describing the progress of the spectrogram analysis.
+        """
+        self.itter_count = int(state["itter_count"])
+        self.times = np.asarray(state["times"])
+        if self._get_sparse_spec and "sparse_spectra" in state:
+            self.sparse_spectra = np.asarray(state["sparse_spectra"])
+            self.sparse_time_borders = np.asarray(state["sparse_time_borders"])
+            self.sparse_freq_borders = np.asarray(state["sparse_freq_borders"])
+            self.sparse_columns = None
+        if self._get_fine_spec and "fine_spec_shape" in state:
+            self.fine_spec_shape = tuple(
+                int(n) for n in state["fine_spec_shape"]
+            )
+            self.fine_times = np.asarray(state["fine_times"])
+            self.spec_freqs = np.asarray(state["spec_freqs"])
+            self.fine_spec_writer = FineSpecWriter(
+                self.fine_spec_str,
+                self.fine_spec_shape[0],
+                self.fine_spec_capacity(),
+                dtype=self.fine_spec_dtype,
+                scale=self.fine_spec_scale,
+                start=self.fine_spec_shape[1],
+                freq_offset=self.fine_spec_rows().start,
+                db_range=self.db_range,
+            )
+            if "pyramid_columns" in state:
+                self.pyramid_writer = PyramidWriter(
+                    self.save_path,
+                    self.fine_spec_shape[0],
+                    self.fine_spec_capacity(),
+                    len(state["pyramid_columns"]),
+                    dtype=self.fine_spec_dtype,
+                    scale=self.fine_spec_scale,
+                    db_range=self.db_range,
+                    state=state,
                 )
-                self.fine_spec_shape = np.shape(self.fine_spec)
-                self.buffer_spectra = np.empty((self.fine_spec_shape[0], 0))
 
     def save(self):
         """
         Saves sparse and full spectrograms when the analysis is complete.
         """
         if self._get_sparse_spec:
-            np.save(
+            save_spectra(
                 os.path.join(self.save_path, "sparse_spectra.npy"),
                 self.sparse_spectra,
+                dtype=self.sparse_spec_dtype,
+                db_range=self.db_range,
             )
             self.sparse_time = (
                 self.sparse_time_borders[:-1]
@@ -792,19 +1519,33 @@ class Spectrogram:
             )
 
         if self._get_fine_spec:
+            if self.fine_spec_writer is not None:
+                self.fine_spec_writer.close()
+                save_fine_spec_meta(
+                    self.save_path, self.fine_spec_writer.meta()
+                )
+            if self.pyramid_writer is not None:
+                self.pyramid_writer.close(
+                    self.spec_freqs[self.fine_spec_rows()], self.times
+                )
             np.save(
                 os.path.join(self.save_path, "fine_spec_shape.npy"),
                 self.fine_spec_shape,
             )
             np.save(os.path.join(self.save_path, "fine_times.npy"), self.times)
             np.save(
-                os.path.join(self.save_path, "fine_freqs.npy"), self.spec_freqs
+                os.path.join(self.save_path, "fine_freqs.npy"),
+                self.spec_freqs[self.fine_spec_rows()],
             )
 
     def close(self):
         """
         Clears the memory-mapped spectrogram and empties cuda memory
         """
+        if getattr(self, "fine_spec_writer", None) is not None:
+            self.fine_spec_writer.close()
+        if getattr(self, "pyramid_writer", None) is not None:
+            self.pyramid_writer.close()
         del self.fine_spec
         torch.cuda.empty_cache()
         gc.collect()
@@ -0,0 +1,229 @@
+"""
+Staged producer/consumer execution of the per-snippet analysis steps.
+
+Every stage runs in its own worker thread and hands its results to the next
+stage through a bounded queue, so the STFT of the next snippet is computed
+while the harmonic groups and disk writes of the current snippet finish.
+Each stage processes its items in order, hence the results arrive in the
+order of the input. Queue depth and stall times of every stage are recorded
+to locate the bottleneck of the pipeline.
+"""
+
+import queue
+import threading
+import time
+
+from wavetracker.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class StageStats:
+    """Throughput and stall metrics of a single pipeline stage.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage.
+    items : int
+        Number of processed items.
+    busy : float
+        Seconds spent processing items.
+    starved : float
+        Seconds spent waiting for input from the previous stage.
+    blocked : float
+        Seconds spent waiting for room in the output queue.
+    max_depth : int
+        Largest number of items waiting in the output queue.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+
+    @property
+    def mean_depth(self) -> float:
+        """Average number of items waiting in the output queue."""
+        return self._depth_sum / self.items if self.items else 0.0
+
+    def record_depth(self, depth: int) -> None:
+        """Record the output queue depth after an item was queued."""
+        self._depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def as_dict(self) -> dict:
+        """Metrics as a dictionary, e.g. for logging or storing to json."""
+        return {
+            "items": self.items,
+            "busy": self.busy,
+            "starved": self.starved,
+            "blocked": self.blocked,
+            "mean_depth": self.mean_depth,
+            "max_depth": self.max_depth,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name:<16}: {self.items} items "
+            f"-- busy {self.busy:.2f}s "
+            f"-- starved {self.starved:.2f}s "
+            f"-- blocked {self.blocked:.2f}s "
+            f"-- queue {self.mean_depth:.1f} (max {self.max_depth})"
+        )
+
+
+class _Failure:
+    """Exception raised in a worker, passed on to the consumer."""
+
+    def __init__(self, exception: Exception) -> None:
+        self.exception = exception
+
+
+class StagedPipeline:
+    """Run a sequence of functions as threaded stages with bounded queues.
+
+    Parameters
+    ----------
+    stages : list of (str, callable)
+        Names and functions of the stages. Each function receives the
+        result of the previous stage, the first one the items of the source.
+    depth : int, optional
+        Maximum number of items waiting between two stages, by default 1.
+    """
+
+    _end = object()
+
+    def __init__(self, stages: list, depth: int = 1) -> None:
+        self.stages = list(stages)
+        self.depth = max(1, int(depth))
+        self.stats = [StageStats("source")]
+        self.stats.extend(StageStats(name) for name, _ in self.stages)
+        self.stats.append(StageStats("consumer"))
+
+    def _put(self, q, item, stats, stop) -> bool:
+        t0 = time.time()
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            stats.blocked += time.time() - t0
+            stats.record_depth(q.qsize())
+            return True
+        return False
+
+    def _get(self, q, stats, stop):
+        t0 = time.time()
+        while not stop.is_set():
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            stats.starved += time.time() - t0
+            return item
+        return self._end
+
+    def _feed(self, source, output, stats, stop) -> None:
+        iterator = iter(source)
+        try:
+            while True:
+                t0 = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.busy += time.time() - t0
+                stats.items += 1
+                if not self._put(output, item, stats, stop):
+                    return
+        except Exception as e:
+            self._put(output, _Failure(e), stats, stop)
+            return
+        finally:
+            # stops the background reader of a generator source
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        self._put(output, self._end, stats, stop)
+
+    def _work(self, func, source, output, stats, stop) -> None:
+        while True:
+            item = self._get(source, stats, stop)
+            if item is self._end or isinstance(item, _Failure):
+                self._put(output, item, stats, stop)
+                return
+            t0 = time.time()
+            try:
+                result = func(item)
+            except Exception as e:
+                self._put(output, _Failure(e), stats, stop)
+                return
+            stats.busy += time.time() - t0
+            stats.items += 1
+            if not self._put(output, result, stats, stop):
+                return
+
+    def run(self, source):
+        """Pass the items of `source` through all stages.
+
+        Yields the results of the last stage in the order of the source.
+        Exceptions raised by the source or a stage are re-raised here.
+        """
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.depth) for _ in self.stats[:-1]]
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(source, queues[0], self.stats[0], stop),
+                name="wavetracker-source",
+                daemon=True,
+            )
+        ]
+        for i, (name, func) in enumerate(self.stages):
+            threads.append(
+                threading.Thread(
+                    target=self._work,
+                    args=(
+                        func,
+                        queues[i],
+                        queues[i + 1],
+                        self.stats[i + 1],
+                        stop,
+                    ),
+                    name=f"wavetracker-{name}",
+                    daemon=True,
+                )
+            )
+        for thread in threads:
+            thread.start()
+
+        consumer = self.stats[-1]
+        try:
+            while True:
+                item = self._get(queues[-1], consumer, stop)
+                if item is self._end:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exception
+                t0 = time.time()
+                yield item
+                consumer.busy += time.time() - t0
+                consumer.items += 1
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def log_stats(self, logger=None) -> None:
+        """Log the metrics of all stages."""
+        logger = logger or log
+        logger.info(
+            "Pipeline stages:\n"
+            + "\n".join(f"-- {stats}" for stats in self.stats)
+            + "\n"
+        )
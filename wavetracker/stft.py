@@ -0,0 +1,321 @@
+"""
+Interchangeable STFT backends for the spectrograms of the data snippets.
+
+Every backend computes the magnitude of the short-time Fourier transform of
+a snippet (channels x samples) with the framing of `torch.stft`, i.e. nfft
+windows shifted by step that are, with `center`, centered on the samples of
+a reflection padded snippet. All backends therefore yield the same frames,
+they only differ in speed, which varies a lot between machines. `autotune`
+benchmarks the backends for the STFT parameters of an analysis once per
+machine and caches the fastest one.
+"""
+
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import scipy.fft
+import torch
+from matplotlib.mlab import specgram as mspecgram
+from scipy.signal.windows import hann
+
+from wavetracker.logger import get_logger
+
+log = get_logger(__name__)
+
+STFT_BACKENDS = {}
+
+
+def default_cache_file() -> str:
+    """Cache of `autotune` in the user's cache folder ($XDG_CACHE_HOME)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(
+        "~/.cache"
+    )
+    return os.path.join(cache_home, "wavetracker", "stft_backends.json")
+
+
+def register_backend(name: str):
+    """Register a function as STFT backend `name`.
+
+    The function receives the data (channels x samples tensor), nfft, step,
+    the window (1d-array), `center` and the number of `workers`, and
+    returns the magnitude of the STFT (channels x frequencies x times) as a
+    tensor on the device of the data.
+    """
+
+    def register(func):
+        STFT_BACKENDS[name] = func
+        return func
+
+    return register
+
+
+def _frames(data: np.ndarray, nfft: int, step: int, center: bool):
+    """Windows of nfft samples every step samples (channels x times x nfft)."""
+    if center:
+        pad = nfft // 2
+        data = np.pad(data, ((0, 0), (pad, pad)), mode="reflect")
+    windows = np.lib.stride_tricks.sliding_window_view(data, nfft, axis=-1)
+    return windows[:, ::step]
+
+
+def _as_tensor(spectra: np.ndarray, data: torch.Tensor) -> torch.Tensor:
+    """Spectra (channels x times x frequencies) as tensor like `data`."""
+    spectra = torch.from_numpy(
+        np.ascontiguousarray(spectra.transpose(0, 2, 1))
+    )
+    return spectra.to(device=data.device, dtype=data.dtype)
+
+
+@register_backend("torch")
+def torch_stft(data, nfft, step, window, center=True, workers=None):
+    """STFT of torch, on the device of the data with its CPU threads."""
+    window = torch.as_tensor(window, dtype=data.dtype, device=data.device)
+    stft = torch.stft(
+        data,
+        n_fft=nfft,
+        hop_length=step,
+        win_length=nfft,
+        window=window,
+        center=center,
+        return_complex=True,
+    )
+    return torch.abs(stft)
+
+
+@register_backend("scipy")
+def scipy_stft(data, nfft, step, window, center=True, workers=None):
+    """STFT with `scipy.fft`, parallelised over the windows by `workers`."""
+    frames = _frames(data.cpu().numpy(), nfft, step, center)
+    window = window.astype(frames.dtype)
+    spectra = scipy.fft.rfft(frames * window, axis=-1, workers=workers)
+    return _as_tensor(np.abs(spectra), data)
+
+
+@register_backend("numpy")
+def numpy_stft(data, nfft, step, window, center=True, workers=None):
+    """STFT with `numpy.fft`."""
+    frames = _frames(data.cpu().numpy(), nfft, step, center)
+    window = window.astype(frames.dtype)
+    spectra = np.fft.rfft(frames * window, axis=-1)
+    return _as_tensor(np.abs(spectra), data)
+
+
+@register_backend("mlab")
+def mlab_stft(data, nfft, step, window, center=True, workers=None):
+    """STFT with matplotlib's `specgram`, for compatibility."""
+    samples = data.cpu().numpy()
+    if center:
+        pad = nfft // 2
+        samples = np.pad(samples, ((0, 0), (pad, pad)), mode="reflect")
+    spectra = []
+    for channel in samples:
+        # magnitude mode divides by the sum of the window
+        spec, _, _ = mspecgram(
+            channel,
+            NFFT=nfft,
+            Fs=1.0,
+            noverlap=nfft - step,
+            detrend="none",
+            window=window,
+            mode="magnitude",
+        )
+        spectra.append(spec * window.sum())
+    spectra = torch.from_numpy(np.array(spectra))
+    return spectra.to(device=data.device, dtype=data.dtype)
+
+
+def stft_magnitude(
+    data: torch.Tensor,
+    nfft: int,
+    step: int,
+    window: np.ndarray,
+    center: bool = True,
+    backend: str = "torch",
+    workers: int | None = None,
+) -> torch.Tensor:
+    """Magnitude of the STFT of the data with the backend `backend`.
+
+    Parameters
+    ----------
+    data : 2d-tensor
+        Data snippet (channels x samples).
+    nfft : int
+        Samples in one nfft window.
+    step : int
+        Samples by which consecutive nfft windows are shifted.
+    window : 1d-array
+        Window function of nfft samples.
+    center : bool, optional
+        Center the windows on the samples of the reflection padded data.
+    backend : str, optional
+        Name of a registered backend, by default "torch".
+    workers : int, optional
+        Number of threads of backends that take it, e.g. "scipy".
+
+    Returns
+    -------
+    spectra : 3d-tensor
+        Magnitude of the STFT (channels x frequencies x times) on the
+        device of the data.
+    """
+    if backend not in STFT_BACKENDS:
+        msg = f"Unknown STFT backend: {backend}"
+        raise ValueError(msg)
+    return STFT_BACKENDS[backend](
+        data, nfft, step, window, center=center, workers=workers
+    )
+
+
+def _cache_key(
+    backends: list, nfft: int, step: int, channels: int, n_samples: int
+) -> str:
+    """Machine and STFT parameters a benchmark result is valid for."""
+    machine = (
+        f"{platform.node()}/{platform.machine()}/{platform.processor()}"
+        f"/{os.cpu_count()}cpu/{torch.get_num_threads()}threads"
+    )
+    return (
+        f"{machine}|{','.join(sorted(backends))}"
+        f"|nfft={nfft}|step={step}|channels={channels}|samples={n_samples}"
+    )
+
+
+def _load_cache(cache_file: str) -> dict:
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        log.warning(f"Ignoring unreadable STFT backend cache {cache_file}")
+        return {}
+
+
+def _save_cache(cache_file: str, cache: dict) -> None:
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        log.warning(f"Could not cache the STFT backend: {e}")
+
+
+def autotune(
+    nfft: int,
+    step: int,
+    channels: int,
+    n_samples: int,
+    backends: list | None = None,
+    workers: int | None = None,
+    max_frames: int = 64,
+    repeats: int = 3,
+    cache_file: str | None = "",
+) -> str:
+    """Fastest STFT backend on this machine for the given parameters.
+
+    The backends are timed on random data of the configured number of
+    channels. To bound the time spent, the benchmark transforms at most
+    `max_frames` windows per channel instead of the whole snippet, the cost
+    per window does not depend on the snippet size. The result is cached per
+    machine and parameters, so the benchmark only runs once.
+
+    Parameters
+    ----------
+    nfft : int
+        Samples in one nfft window.
+    step : int
+        Samples by which consecutive nfft windows are shifted.
+    channels : int
+        Number of channels transformed at once.
+    n_samples : int
+        Samples of a data snippet.
+    backends : list of str, optional
+        Backends to compare, by default all registered ones.
+    workers : int, optional
+        Number of threads of backends that take it.
+    max_frames : int, optional
+        Maximum number of windows per channel of the benchmark data.
+    repeats : int, optional
+        Timed runs per backend, the fastest one counts.
+    cache_file : str, optional
+        Json file of the cached results, by default `default_cache_file`.
+        None to always benchmark.
+
+    Returns
+    -------
+    backend : str
+        Name of the fastest backend.
+    """
+    backends = list(STFT_BACKENDS) if backends is None else list(backends)
+    if cache_file == "":
+        cache_file = default_cache_file()
+    key = _cache_key(backends, nfft, step, channels, n_samples)
+    cache = _load_cache(cache_file) if cache_file else {}
+    if key in cache:
+        return cache[key]["backend"]
+
+    n_samples = min(n_samples, nfft + (max_frames - 1) * step)
+    rng = np.random.default_rng(0)
+    data = torch.from_numpy(
+        rng.standard_normal((channels, n_samples), dtype=np.float32)
+    )
+    window = hann(nfft)
+    timings = {}
+    for backend in backends:
+        try:
+            # the first run includes one-time setup, e.g. fft plans
+            stft_magnitude(data, nfft, step, window, backend=backend)
+            best = np.inf
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                stft_magnitude(
+                    data, nfft, step, window, backend=backend, workers=workers
+                )
+                best = min(best, time.perf_counter() - t0)
+        except Exception as e:
+            log.warning(f"STFT backend {backend} failed: {e}")
+            continue
+        timings[backend] = best
+    if not timings:
+        msg = f"None of the STFT backends {backends} works"
+        raise RuntimeError(msg)
+
+    backend = min(timings, key=timings.get)
+    log.info(
+        "STFT backends: "
+        + ", ".join(f"{name} {t * 1e3:.1f}ms" for name, t in timings.items())
+        + f" -> {backend}"
+    )
+    if cache_file:
+        cache[key] = {"backend": backend, "timings": timings}
+        _save_cache(cache_file, cache)
+    return backend
+
+
+def select_backend(
+    backend: str,
+    device: torch.device,
+    nfft: int,
+    step: int,
+    channels: int,
+    n_samples: int,
+    workers: int | None = None,
+) -> str:
+    """Resolve the configured STFT backend.
+
+    "auto" keeps the data on a GPU with "torch" and benchmarks the backends
+    with `autotune` on the CPU, other names are returned as they are. Since
+    the backends differ in their rounding errors and the benchmark is cached
+    in the user's cache folder, "auto" has to be chosen explicitly.
+    """
+    if backend != "auto":
+        if backend not in STFT_BACKENDS:
+            msg = f"Unknown STFT backend: {backend}"
+            raise ValueError(msg)
+        return backend
+    if device.type != "cpu":
+        return "torch"
+    return autotune(nfft, step, channels, n_samples, workers=workers)
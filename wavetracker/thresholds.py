@@ -0,0 +1,148 @@
+"""
+Peak detection thresholds that follow the noise floor of a recording.
+
+The harmonic group detection needs a low and a high threshold for its peak
+detection, derived from the spread of the noise in the log-spectra. Instead
+of estimating them for every spectrum, or once for a whole recording, the
+`ThresholdEstimator` estimates them on a few spectra of a snippet and
+reuses the estimate for the following snippets. It is renewed after a
+configurable stretch of recording time, or earlier when the noise floor of
+the snippets drifts away from the one of the estimate.
+"""
+
+import numpy as np
+import torch
+
+from wavetracker.logger import get_logger
+from wavetracker.torch_harmonic_group import decibel, threshold_std
+
+log = get_logger(__name__)
+
+
+class ThresholdEstimator:
+    """Cached peak detection thresholds with periodic re-estimation.
+
+    Parameters
+    ----------
+    low_thresh_factor : float
+        Low threshold in multiples of the noise spread.
+    high_thresh_factor : float
+        High threshold in multiples of the noise spread.
+    low_threshold, high_threshold : float, optional
+        Fixed thresholds in decibel. If both are non-zero, they are used as
+        they are and nothing is estimated.
+    interval : float, optional
+        Recording time in seconds after which the thresholds are estimated
+        again, by default every 10 minutes. Zero estimates them only once.
+    n_frames : int, optional
+        Number of spectra of a snippet the estimate is based on.
+    max_drift : float, optional
+        Change of the noise floor in decibel since the last estimate that
+        triggers a new one before the interval is over. Zero disables it.
+    """
+
+    def __init__(
+        self,
+        low_thresh_factor: float,
+        high_thresh_factor: float,
+        low_threshold: float = 0.0,
+        high_threshold: float = 0.0,
+        interval: float = 600.0,
+        n_frames: int = 32,
+        max_drift: float = 3.0,
+    ) -> None:
+        self.low_thresh_factor = low_thresh_factor
+        self.high_thresh_factor = high_thresh_factor
+        self.fixed = low_threshold != 0 and high_threshold != 0
+        self.interval = interval
+        self.n_frames = n_frames
+        self.max_drift = max_drift
+
+        self.time = 0.0
+        self.estimate_time = None
+        self.floor = None
+        self.thresholds = None
+        if self.fixed:
+            self.thresholds = (float(low_threshold), float(high_threshold))
+
+    def _sample(self, spec) -> torch.Tensor:
+        """Log-spectra (times x frequencies) of evenly spaced spectra."""
+        if not isinstance(spec, torch.Tensor):
+            spec = torch.from_numpy(np.asarray(spec))
+        n = spec.shape[1]
+        frames = np.unique(
+            np.linspace(0, n - 1, min(self.n_frames, n)).round().astype(int)
+        )
+        frames = torch.as_tensor(frames, device=spec.device)
+        return decibel(spec[:, frames].transpose(0, 1).float())
+
+    @staticmethod
+    def noise_floor(log_spec: torch.Tensor) -> float:
+        """Median power in the frequency band of the spread estimate."""
+        n = log_spec.shape[1]
+        return float(log_spec[:, n // 2 : n * 3 // 4].median())
+
+    def __call__(self, spec, duration: float) -> tuple:
+        """Thresholds for the spectrogram of the next snippet.
+
+        Parameters
+        ----------
+        spec : 2d-array or 2d-tensor
+            Power spectrogram of the snippet (frequencies x times).
+        duration : float
+            Recording time covered by the snippet in seconds.
+
+        Returns
+        -------
+        low_threshold, high_threshold : float
+            Peak detection thresholds in decibel.
+        """
+        if self.fixed:
+            return self.thresholds
+        log_spec = self._sample(spec)
+        floor = self.noise_floor(log_spec)
+        if (
+            self.thresholds is None
+            or (
+                self.interval > 0
+                and self.time - self.estimate_time >= self.interval
+            )
+            or (
+                self.max_drift > 0
+                and self.floor is not None
+                and abs(floor - self.floor) > self.max_drift
+            )
+        ):
+            std = float(np.mean(threshold_std(log_spec).cpu().numpy()))
+            self.thresholds = (
+                std * self.low_thresh_factor,
+                std * self.high_thresh_factor,
+            )
+            log.debug(
+                f"Thresholds at {self.time:.1f}s: {self.thresholds[0]:.2f}dB,"
+                f" {self.thresholds[1]:.2f}dB (noise floor {floor:.1f}dB)"
+            )
+            self.estimate_time = self.time
+            self.floor = floor
+        self.time += duration
+        return self.thresholds
+
+    def state(self) -> dict:
+        """Cached estimate and recording time for a checkpoint."""
+        return {
+            "time": self.time,
+            "estimate_time": self.estimate_time,
+            "floor": self.floor,
+            "thresholds": self.thresholds,
+        }
+
+    def restore(self, state: dict) -> None:
+        """Continue with the estimate stored by `state`."""
+        if self.fixed:
+            return
+        self.time = state["time"]
+        self.estimate_time = state["estimate_time"]
+        self.floor = state["floor"]
+        self.thresholds = state["thresholds"]
+        if self.thresholds is not None:
+            self.thresholds = tuple(self.thresholds)
@@ -0,0 +1,635 @@
+"""
+Torch backend of the harmonic group detection in `gpu_harmonic_group`.
+
+All steps are written as tensor operations, so the detection runs on the
+device the spectrogram was computed on, be it a GPU or the CPU threads of
+torch, and the summed spectrogram never leaves it. The steps that the CUDA
+kernels run as sequential loops are reformulated for data parallel
+execution with the same results:
+
+- A peak of the hysteresis peak detection is a maximum that is preceded
+  and followed by a drop of at least the threshold before the data exceed
+  it. These drops are found for all frequencies at once by binary lifting
+  on tables of running maxima and minima.
+- The search for the harmonics of a candidate fundamental advances a
+  pointer per candidate through the sorted peaks, only over the few peaks
+  within the frequency tolerance.
+- The assignment of peaks to harmonic groups runs over the good peaks in
+  order of their power, but for all spectra and candidates at once.
+
+Only the detected fundamentals are copied to the host.
+"""
+
+import time
+
+import numpy as np
+import torch
+
+from wavetracker.cpu_harmonic_group import (
+    fixed_thresholds,
+    max_group_size,
+    thresholds_from_std,
+)
+from wavetracker.device_check import get_device
+
+
+def decibel(power: torch.Tensor) -> torch.Tensor:
+    """Transform power to decibel relative to a reference power of 1.
+
+    Power values smaller than 1e-20 are set to `-inf`. The logarithm is
+    taken in double precision, as in the CUDA kernel.
+    """
+    log_power = 10.0 * torch.log10(power.double())
+    log_power[power <= 1e-20] = -np.inf
+    return log_power.float()
+
+
+def threshold_std(log_spec: torch.Tensor) -> torch.Tensor:
+    """Standard deviation of the detrended log-spectra, one per spectrum.
+
+    The third quarter of every spectrum is detrended in blocks of 128
+    frequencies and the width of its histogram above 1/sqrt(e) of the
+    maximum count is taken as twice the standard deviation.
+    """
+    n = log_spec.shape[1]
+    i0, i1 = n // 2, n * 3 // 4
+    quarter = log_spec[:, i0:i1].double()
+    blocks = (i1 - i0) // 128 * 128
+    detrend = torch.zeros_like(quarter)
+    if blocks > 0:
+        segments = quarter[:, :blocks].reshape(len(quarter), -1, 128)
+        detrend[:, :blocks] = (
+            segments
+            - segments.mean(dim=2, keepdim=True)
+            + quarter.mean(dim=1)[:, None, None]
+        ).reshape(len(quarter), blocks)
+
+    maxd = detrend.amax(dim=1).clamp(min=-1e6)
+    mind = detrend.amin(dim=1).clamp(max=1e6)
+    r = maxd - mind
+    steps = torch.arange(101, dtype=torch.float64, device=log_spec.device)
+    bins = mind[:, None] + r[:, None] / 100 * steps
+    # index of the bin with bins[i] <= value < bins[i + 1]
+    index = torch.searchsorted(bins, detrend.contiguous(), right=True) - 1
+    inside = (index >= 0) & (index < 100)
+    hist = torch.zeros(
+        (len(detrend), 101), dtype=torch.float64, device=log_spec.device
+    )
+    hist.scatter_add_(1, torch.where(inside, index, 100), inside.double())
+    hist = hist[:, :100]
+
+    above = hist > hist.amax(dim=1, keepdim=True) / np.sqrt(np.e)
+    columns = torch.arange(100, device=log_spec.device)
+    last = torch.where(above, columns, -1).amax(dim=1)
+    # the last bin ends at the maximum, not at the sum of the bin widths
+    bins_end = bins.clone()
+    bins_end[:, 100] = mind + r
+    upper = torch.where(
+        last >= 0, bins_end.gather(1, (last + 1)[:, None])[:, 0], 0.0
+    )
+    # a lower bound of exactly zero is replaced by the next one
+    first = torch.where(above & (bins[:, :100] != 0), columns, 100)
+    first = first.amin(dim=1)
+    lower = torch.where(
+        first < 100, bins.gather(1, first.clamp(max=99)[:, None])[:, 0], 0.0
+    )
+    return 0.5 * (upper - lower)
+
+
+def _lifting_tables(x: torch.Tensor) -> tuple:
+    """Maxima and minima of x over windows of 2**k values from every index.
+
+    Windows reaching beyond the end are padded and must not be used.
+    """
+    maxima, minima = [x], [x]
+    s = 1
+    while 2 * s <= x.shape[1]:
+        mx, mn = maxima[-1], minima[-1]
+        maxima.append(
+            torch.cat([torch.maximum(mx[:, :-s], mx[:, s:]), mx[:, -s:]], 1)
+        )
+        minima.append(
+            torch.cat([torch.minimum(mn[:, :-s], mn[:, s:]), mn[:, -s:]], 1)
+        )
+        s *= 2
+    return maxima, minima
+
+
+def _drops(values, index, maxima, minima, threshold, backward):
+    """Whether the data drop by `threshold` next to the values at `index`
+    before exceeding them, searched backward (values equal to them stop the
+    search) or forward (only larger values stop the search).
+    """
+    n = maxima[0].shape[1]
+    pos = index if backward else index + 1
+    lowest = torch.full_like(values, np.inf)
+    for k in reversed(range(len(maxima))):
+        s = 2**k
+        start = pos - s if backward else pos
+        fits = start >= 0 if backward else pos + s <= n
+        start = start.clamp(0, n - 1)
+        window_max = maxima[k].gather(1, start)
+        if backward:
+            fits &= window_max < values
+        else:
+            fits &= window_max <= values
+        lowest = torch.where(
+            fits, torch.minimum(lowest, minima[k].gather(1, start)), lowest
+        )
+        pos = torch.where(fits, pos - s if backward else pos + s, pos)
+    return lowest.double() <= values.double() - threshold
+
+
+def _maxima(x: torch.Tensor, threshold: float) -> torch.Tensor:
+    """Maxima of the hysteresis peak detection with the given threshold.
+
+    Only local maxima can be peaks, so the drops are searched from the
+    local maxima only.
+    """
+    candidate = torch.zeros_like(x, dtype=torch.bool)
+    candidate[:, 1:-1] = (x[:, 1:-1] > x[:, :-2]) & (x[:, 1:-1] >= x[:, 2:])
+    index, counts = _compact(candidate)
+    values = x.gather(1, index)
+    maxima, minima = _lifting_tables(x)
+    is_peak = (
+        (torch.arange(index.shape[1], device=x.device) < counts[:, None])
+        & _drops(values, index, maxima, minima, threshold, backward=True)
+        & _drops(values, index, maxima, minima, threshold, backward=False)
+    )
+    # padding points to the first value, which is never a peak
+    return torch.zeros_like(candidate).scatter_(1, index, is_peak)
+
+
+def detect_peaks(
+    log_spec: torch.Tensor,
+    spec_freq: torch.Tensor,
+    low_threshold: float,
+    high_threshold: float,
+    min_freq: float,
+    max_freq: float,
+    mains_freq: float,
+    mains_freq_tol: float,
+    min_good_peak_power: float,
+    max_elements: int = 2**24,
+) -> torch.Tensor:
+    """Peaks of every spectrum, as found by the CUDA peak detection.
+
+    Peaks and troughs alternate, so instead of detecting the troughs, the
+    trough paired with a peak is the minimum between the peak and the
+    preceding or following one.
+
+    Parameters
+    ----------
+    log_spec : 2d-tensor
+        Spectra in decibel (times x frequencies).
+    spec_freq : 1d-tensor
+        Frequencies of the spectra, double precision.
+    low_threshold : float
+        Minimum drop between a peak and the neighbouring troughs.
+    high_threshold : float
+        Minimum drop of a good peak to its paired trough.
+    min_freq, max_freq : float
+        Frequency range of good peaks.
+    mains_freq, mains_freq_tol : float
+        Good peaks are no multiples of the mains frequency.
+    min_good_peak_power : float
+        Minimum power of a good peak in decibel.
+    max_elements : int, optional
+        Spectra are processed in chunks of about this many values, which
+        bounds the memory of the lifting tables.
+
+    Returns
+    -------
+    peaks : 2d-tensor
+        Peak labels (times x frequencies), 1 for peaks, 2 for good peaks.
+    """
+    n = log_spec.shape[1]
+    levels = max(1, int(np.log2(max(n, 1))) + 1)
+    chunk = max(1, max_elements // (n * levels))
+    peaks = torch.zeros_like(log_spec, dtype=torch.int8)
+    columns = torch.arange(n, device=log_spec.device)
+    f = spec_freq[None, :]
+    mains = torch.remainder(f, mains_freq)
+    in_range = (
+        (f >= min_freq)
+        & (f <= max_freq)
+        & (mains >= mains_freq_tol)
+        & ((mains - mains_freq).abs() >= mains_freq_tol)
+    )
+    for r0 in range(0, len(log_spec), chunk):
+        x = log_spec[r0 : r0 + chunk]
+        x64 = x.double()
+        is_peak = _maxima(x, low_threshold)
+
+        # the extrema start with a peak if the data rise by the threshold
+        # before they fall by it
+        rise = x64 >= x.cummin(dim=1).values.double() + low_threshold
+        fall = x64 <= x.cummax(dim=1).values.double() - low_threshold
+        peak_first = torch.where(rise, columns, n).amin(dim=1) <= torch.where(
+            fall, columns, n
+        ).amin(dim=1)
+
+        # minima of the segments starting at each peak, segment 0 precedes
+        # the first peak
+        segment = is_peak.cumsum(dim=1)
+        n_peaks = segment[:, -1]
+        minima = torch.full(
+            (len(x), int(n_peaks.max()) + 1 if len(x) else 1),
+            np.inf,
+            dtype=x.dtype,
+            device=x.device,
+        ).scatter_reduce(1, segment, x, "amin")
+        # a trough follows the last peak if the data rise by the threshold
+        # after it
+        suffix_max = x64.flip(1).cummax(dim=1).values.flip(1)
+        max_rise = (suffix_max - x64).flip(1).cummax(dim=1).values.flip(1)
+        last_peak = torch.where(is_peak, columns, -1).amax(dim=1)
+        after = (last_peak + 1).clamp(max=n - 1)[:, None]
+        last_paired = (last_peak < n - 1) & (
+            max_rise.gather(1, after)[:, 0] >= low_threshold
+        )
+
+        # peaks are paired with the following trough if the extrema start
+        # with a peak, and with the preceding one otherwise
+        paired = torch.where(peak_first[:, None], segment, segment - 1)
+        trough_power = minima.gather(1, paired.clamp(min=0))
+        has_pair = ~peak_first[:, None] | (segment < n_peaks[:, None])
+        has_pair = has_pair | last_paired[:, None]
+        good = (
+            is_peak
+            & has_pair
+            & ((x - trough_power).double() > high_threshold)
+            & in_range
+            & (x64 >= min_good_peak_power)
+        )
+        labels = is_peak.to(torch.int8) + good.to(torch.int8)
+
+        # a last peak without a following trough is dropped
+        unpaired = peak_first & ~last_paired & (n_peaks > 0)
+        rows = torch.nonzero(unpaired)[:, 0]
+        labels[rows, last_peak[rows]] = 0
+        peaks[r0 : r0 + chunk] = labels
+    return peaks
+
+
+def _compact(mask: torch.Tensor) -> tuple:
+    """Column indices of the True values of every row, left aligned.
+
+    Returns the indices (padded with 0) and their number per row.
+    """
+    counts = mask.sum(dim=1)
+    width = int(counts.max()) if mask.numel() else 0
+    order = torch.argsort((~mask).to(torch.int8), dim=1, stable=True)
+    return order[:, :width], counts
+
+
+def check_frequencies(
+    peaks: torch.Tensor, spec_freq: torch.Tensor, cfg
+) -> torch.Tensor:
+    """Candidate fundamentals: good peaks and their integer fractions.
+
+    Zero padded rows with the fractions of every divisor one after the
+    other, i.e. the candidates of `get_check_freqs` of the CPU backend
+    without its deduplication, which would only cost time on the padded
+    tensors.
+    """
+    hg = cfg.harmonic_groups
+    good = (
+        (peaks == 2)
+        & (spec_freq[None, :] < hg["max_freq"])
+        & (spec_freq[None, :] > hg["min_freq"])
+    )
+    idx, counts = _compact(good)
+    width = idx.shape[1]
+    divisors = hg["max_divisor"]
+    check_freqs = torch.zeros(
+        (len(peaks), divisors * width + 1),
+        dtype=torch.float64,
+        device=peaks.device,
+    )
+    j = torch.arange(width, device=peaks.device)[None, :]
+    valid = j < counts[:, None]
+    for d in range(divisors):
+        # invalid entries go to the extra last column
+        column = torch.where(valid, d * counts[:, None] + j, divisors * width)
+        check_freqs.scatter_(1, column, spec_freq[idx] / (d + 1))
+    return check_freqs[:, :-1]
+
+
+def harmonic_groups(
+    check_freqs: torch.Tensor,
+    log_spec: torch.Tensor,
+    spec_freq: torch.Tensor,
+    peaks: torch.Tensor,
+    group_size: int,
+    min_group_size: int,
+    max_freq_tol: float,
+    mains_freq: float,
+    mains_freq_tol: float,
+) -> tuple:
+    """Harmonic groups and their mean power for all candidate fundamentals.
+
+    Returns the same `out` and `value` as the CUDA kernel: the peak indices
+    of the harmonics of every candidate and the mean power of its first
+    `min_group_size` harmonics.
+    """
+    device = log_spec.device
+    peak_idx, peak_counts = _compact(peaks != 0)
+    n_peaks = peak_idx.shape[1]
+    peak_freq = spec_freq[peak_idx]
+    padding = torch.arange(n_peaks, device=device) >= peak_counts[:, None]
+    peak_freq[padding] = np.inf
+
+    shape = check_freqs.shape
+    out = torch.zeros((*shape, group_size), dtype=torch.long, device=device)
+    candidate = check_freqs != 0
+    fzero = check_freqs.clone()
+    fzero_h = torch.ones(shape, dtype=torch.float64, device=device)
+    for h in range(1, group_size if n_peaks else 1):
+        harmonic_freq = (peak_freq / h).contiguous()
+        # peaks below the tolerance range cannot match, the one before the
+        # range is checked as well to be safe from rounding
+        ptr = torch.searchsorted(
+            harmonic_freq,
+            (fzero / fzero_h - max_freq_tol).contiguous(),
+            right=True,
+        )
+        ptr = (ptr - 1).clamp(min=0)
+        ioi = torch.zeros(shape, dtype=torch.long, device=device)
+        fe = torch.full(shape, 1e6, dtype=torch.float64, device=device)
+        pending = torch.zeros(shape, dtype=torch.bool, device=device)
+        while True:
+            valid = candidate & (ptr < peak_counts[:, None])
+            at = ptr.clamp(max=n_peaks - 1)
+            f = harmonic_freq.gather(1, at)
+            delta = f - fzero / fzero_h
+            # no later peak can change the group any more
+            done = (
+                ~valid
+                | ((ioi == 0) & (delta >= max_freq_tol))
+                | ((ioi != 0) & ~pending & (delta >= fe))
+            )
+            if bool(done.all()):
+                break
+            active = ~done
+            fe_new = delta.abs()
+            update = active & (fe_new < fe) & (fe_new < max_freq_tol)
+            ioi = torch.where(update, peak_idx.gather(1, at), ioi)
+            fe = torch.where(update, fe_new, fe)
+            write = active & ~update & (fe_new > fe) & (ioi != 0)
+            fzero = torch.where(write, spec_freq[ioi], fzero)
+            fzero_h = torch.where(write, float(h), fzero_h)
+            out[..., h - 1] = torch.where(write, ioi, out[..., h - 1])
+            pending = (pending | update) & ~write
+            ptr = ptr + active
+
+    members = out[..., :min_group_size]
+    member_freq = spec_freq[members]
+    remainder = torch.remainder(member_freq, mains_freq)
+    mains = (remainder < mains_freq_tol) | (
+        (remainder - 50).abs() < mains_freq_tol
+    )
+    present = members != 0
+    counted = present & ~mains
+    power = log_spec.double().gather(
+        1, members.reshape(len(members), -1)
+    ).reshape(members.shape)
+    n = counted.sum(dim=-1)
+    peak_mean = torch.where(
+        n > 0,
+        torch.where(counted, power, 0.0).sum(dim=-1) / n.clamp(min=1),
+        -1e6,
+    )
+    value = torch.where(
+        present.sum(dim=-1) >= min_group_size - 1, peak_mean, -1e6
+    )
+    value = torch.where(candidate, value, 0.0)
+    return out, value
+
+
+def assign_harmonic_groups(
+    out: torch.Tensor,
+    value: torch.Tensor,
+    peaks: torch.Tensor,
+    log_spec: torch.Tensor,
+    check_freqs: torch.Tensor,
+    cfg,
+) -> tuple:
+    """Assign peaks to harmonic groups, strongest peaks first.
+
+    Same assignment as in the CPU backend, run for all spectra at once.
+
+    Returns
+    -------
+    assigned_hg : 2d-tensor
+        Harmonic group labels of the peaks (times x frequencies), 0 for
+        unassigned frequencies.
+    groups : 2d-tensor
+        Time index, label and index of the lowest frequency of every
+        assigned harmonic group, in the order of assignment.
+    """
+    hg = cfg.harmonic_groups
+    min_group_size = hg["min_group_size"]
+    device = log_spec.device
+    rows = torch.arange(len(out), device=device)
+    present = out != 0
+    complete = present[..., :min_group_size].all(dim=-1)
+    first_power = log_spec.double().gather(1, out[..., 0])
+    eligible = (
+        (check_freqs != 0)
+        & complete
+        & (first_power >= hg["min_good_peak_power"])
+    )
+    # rank of every candidate in the order of decreasing power, ties in
+    # reversed order as with numpy's argsort(...)[::-1]
+    order = torch.argsort(value, dim=1, stable=True).flip(1)
+    rank = torch.empty_like(order)
+    positions = torch.arange(order.shape[1], device=device)
+    rank.scatter_(1, order, positions.expand_as(order))
+
+    good = peaks == 2
+    by_power = torch.argsort(
+        torch.where(good, log_spec, -np.inf), dim=1, stable=True
+    ).flip(1)
+    n_good = good.sum(dim=1)
+    assigned = torch.zeros_like(peaks, dtype=torch.bool)
+    assigned_hg = torch.zeros_like(peaks, dtype=torch.long)
+    next_hg = torch.ones(len(out), dtype=torch.long, device=device)
+    groups = []
+    flat = out.reshape(len(out), -1)
+    fundamental = torch.where(present, out, log_spec.shape[1]).amin(dim=-1)
+    for r in range(int(n_good.max()) if len(out) else 0):
+        search = by_power[:, r]
+        contains = out[..., :min_group_size] == search[:, None, None]
+        contains = contains.any(dim=-1)
+        used = assigned.gather(1, flat).reshape(out.shape) & present
+        used = used.any(dim=-1)
+        fits = eligible & contains & ~used & (r < n_good)[:, None]
+        first = torch.where(fits, rank, order.shape[1]).argmin(dim=1)
+        found = fits[rows, first]
+        if not bool(found.any()):
+            continue
+        t = rows[found]
+        group = out[t, first[found]]
+        member = group != 0
+        t_members = t[:, None].expand_as(group)[member]
+        assigned[t_members, group[member]] = True
+        label = next_hg[found]
+        labels = label[:, None].expand_as(group)
+        assigned_hg[t_members, group[member]] = labels[member]
+        groups.append(
+            torch.stack([t, label, fundamental[t, first[found]]], dim=1)
+        )
+        next_hg = next_hg + found
+    if groups:
+        groups = torch.cat(groups)
+        key = groups[:, 0] * peaks.shape[1] + groups[:, 1]
+        groups = groups[torch.argsort(key)]
+    else:
+        groups = torch.zeros((0, 3), dtype=torch.long, device=device)
+    return assigned_hg, groups
+
+
+def _detect(spec, spec_freq_arr, cfg, verbose=0, thresholds=None):
+    """Run all detection steps on the device of `spec`."""
+    hg_cfg = cfg.harmonic_groups
+    if not isinstance(spec, torch.Tensor):
+        spec = torch.as_tensor(np.asarray(spec), device=get_device())
+    spec = spec.transpose(0, 1).float()
+    spec_freq = torch.as_tensor(
+        np.asarray(spec_freq_arr), dtype=torch.float64, device=spec.device
+    )
+    log_spec = decibel(spec)
+
+    ### threshold estimate for peak detection ###
+    if thresholds is None:
+        thresholds = fixed_thresholds(cfg)
+    if thresholds is None:
+        if verbose >= 4:
+            t0 = time.time()
+        thresholds = thresholds_from_std(
+            threshold_std(log_spec).cpu().numpy(), cfg
+        )
+        if verbose >= 4:
+            print(f"threshold estimate transform: {time.time() - t0:.4f}s")
+
+    ### peak detection ###
+    if verbose >= 4:
+        t0 = time.time()
+    peaks = detect_peaks(
+        log_spec,
+        spec_freq,
+        float(thresholds[0]),
+        float(thresholds[1]),
+        float(hg_cfg["min_freq"]),
+        float(hg_cfg["max_freq"]),
+        float(hg_cfg["mains_freq"]),
+        float(hg_cfg["mains_freq_tol"]),
+        float(hg_cfg["min_good_peak_power"]),
+    )
+    if verbose >= 4:
+        print(f"peak_detect: {time.time() - t0:.4f}s")
+
+    ### harmonic groups ###
+    if verbose >= 4:
+        t0 = time.time()
+    check_freqs = check_frequencies(peaks, spec_freq, cfg)
+    out, value = harmonic_groups(
+        check_freqs,
+        log_spec,
+        spec_freq,
+        peaks,
+        max_group_size(cfg),
+        int(hg_cfg["min_group_size"]),
+        float(hg_cfg["max_freq_tol"]),
+        float(hg_cfg["mains_freq"]),
+        float(hg_cfg["mains_freq_tol"]),
+    )
+    if verbose >= 4:
+        print(f"get harmonic groups: {time.time() - t0:.4f}s")
+
+    ### assign harmonic groups ###
+    if verbose >= 4:
+        t0 = time.time()
+    assigned_hg, groups = assign_harmonic_groups(
+        out, value, peaks, log_spec, check_freqs, cfg
+    )
+    if verbose >= 4:
+        print(f"Harmonic group assignment: {time.time() - t0:.4f}s")
+    return assigned_hg, groups, peaks, log_spec
+
+
+def harmonic_group_pipeline(
+    spec_arr, spec_freq_arr, cfg, verbose=0, thresholds=None
+):
+    """Detect harmonic groups in a spectrogram with torch.
+
+    Parameters
+    ----------
+    spec_arr : 2d-array or 2d-tensor
+        Power spectrogram (frequencies x times). Tensors are processed on
+        their device, arrays on the default device.
+    spec_freq_arr : 1d-array
+        Frequencies of the spectrogram.
+    cfg : object
+        Configuration with the harmonic group parameters.
+    verbose : int, optional
+        Verbosity level, timings are printed from level 4 on.
+    thresholds : tuple, optional
+        Low and high peak detection thresholds in decibel, e.g. of a
+        `ThresholdEstimator`. By default the thresholds of the config, or an
+        estimate from this spectrogram if they are zero.
+
+    Returns
+    -------
+    assigned_hg : 2d-array
+        Harmonic group labels (times x frequencies).
+    peaks : 2d-array
+        Peak labels (times x frequencies).
+    log_spec : 2d-array
+        Spectrogram in decibel (times x frequencies).
+    """
+    assigned_hg, _, peaks, log_spec = _detect(
+        spec_arr, spec_freq_arr, cfg, verbose=verbose, thresholds=thresholds
+    )
+    return (
+        assigned_hg.cpu().numpy(),
+        peaks.cpu().numpy().astype(np.float32),
+        log_spec.cpu().numpy(),
+    )
+
+
+def fundamentals(spec, spec_freq_arr, cfg, verbose=0, thresholds=None):
+    """Fundamental frequencies of the harmonic groups in a spectrogram.
+
+    Fused version of `harmonic_group_pipeline` and `get_fundamentals`: all
+    steps run on the device of the spectrogram and only the fundamentals
+    are copied to the host.
+
+    Parameters
+    ----------
+    spec : 2d-tensor or 2d-array
+        Power spectrogram (frequencies x times).
+    spec_freq_arr : 1d-array
+        Frequencies of the spectrogram.
+    cfg : object
+        Configuration with the harmonic group parameters.
+    verbose : int, optional
+        Verbosity level, timings are printed from level 4 on.
+    thresholds : tuple, optional
+        Peak detection thresholds, see `harmonic_group_pipeline`.
+
+    Returns
+    -------
+    fund_v : 1d-array
+        Fundamental frequencies of the harmonic groups.
+    idx_v : 1d-array
+        Time indices of the harmonic groups.
+    f_idx : 1d-array
+        Frequency indices of the fundamentals.
+    """
+    _, groups, _, _ = _detect(
+        spec, spec_freq_arr, cfg, verbose=verbose, thresholds=thresholds
+    )
+    idx_v, f_idx = groups[:, [0, 2]].cpu().numpy().T
+    return np.asarray(spec_freq_arr)[f_idx], idx_v, f_idx
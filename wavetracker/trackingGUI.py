@@ -13,11 +13,13 @@ from matplotlib.backends.backend_qt5agg import (
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from signal_tracker import freq_tracking_v5
-from thunderfish.harmonics import fundamental_freqs, harmonic_groups
+from thunderfish.harmonics import fundamental_freqs
 from thunderlab.dataloader import DataLoader as open_data
 from thunderlab.dataloader import fishgrid_grids, fishgrid_spacings
 from thunderlab.powerspectrum import decibel, next_power_of_two, spectrogram
 
+from wavetracker.harmonic_pool import HarmonicGroupPool
+
 
 class SettingsHarmonicGroup(QMainWindow):
     def __init__(self):
@@ -407,13 +409,21 @@ class EOD_extraxt(QThread):
         self.all_idx_v = []
         self.all_original_sign_v = []
 
+        self.hg_pool = None
+
     def run(self):
         self.SpecSettings.apply_settings()
         self.HGSettings.apply_settings()
-        if self.current_tast == "fill_spec":
-            self.fill_spec()
-        else:
-            self.snippet_spectrogram()
+        try:
+            if self.current_tast == "fill_spec":
+                self.fill_spec()
+            else:
+                self.snippet_spectrogram()
+        finally:
+            # also stops the workers of an aborted extraction
+            if self.hg_pool is not None:
+                self.hg_pool.close()
+                self.hg_pool = None
 
     def fill_spec(self):
         start_idx = int(self.SpecSettings.start_time * self.samplerate)
@@ -888,32 +898,30 @@ class EOD_extraxt(QThread):
                 break
 
     def extract_fundamentals_and_signatures(self, channel=None):
-        core_count = multiprocessing.cpu_count()
-        pool = multiprocessing.Pool(core_count - 1)
+        if self.hg_pool is None:
+            self.hg_pool = HarmonicGroupPool()
 
         if channel == None:
-            func = partial(
-                harmonic_groups,
+            a = self.hg_pool.harmonic_groups(
                 self.spec_freqs,
+                self.power,
                 low_threshold=self.HGSettings.low_threshold_G,
                 high_threshold=self.HGSettings.high_threshold_G,
                 min_freq=400,
                 max_freq=2000,
                 **self.HGSettings.cfg,
             )
-            a = pool.map(func, self.power)
 
         else:
-            func = partial(
-                harmonic_groups,
+            a = self.hg_pool.harmonic_groups(
                 self.spec_freqs,
+                self.power,
                 low_threshold=self.HGSettings.low_threshold,
                 high_threshold=self.HGSettings.high_threshold,
                 min_freq=400,
                 max_freq=2000,
                 **self.HGSettings.cfg,
             )
-            a = pool.map(func, self.power)
 
         # print(a[0][5], a[0][6])
         if channel == None:
@@ -965,8 +973,6 @@ class EOD_extraxt(QThread):
         if self.life_plotting:
             self.return_EODf.emit()
 
-        pool.terminate()
-
 
 class MainWindow(QMainWindow):
     def __init__(self, parent=None):
@@ -1,29 +1,44 @@
 import argparse
+import json
 import multiprocessing
 import os
+import shutil
 import time
-from functools import partial
 from pathlib import Path
 import gc
 import torch
 
 import numpy as np
 from rich.progress import Progress
-from thunderfish.harmonics import fundamental_freqs, harmonic_groups
+from thunderfish.harmonics import fundamental_freqs
 
+from wavetracker.buffers import AppendBuffer, append_rows, read_rows
+from wavetracker.channel_check import check_channels
 from wavetracker.config import Configuration
-from wavetracker.datahandler import MultiChannelAudioDataset, open_raw_data
+from wavetracker.datahandler import (
+    MultiChannelAudioDataset,
+    SessionIndex,
+    open_raw_data,
+    select_channels,
+)
 from wavetracker.device_check import get_device
+from wavetracker.cpu_harmonic_group import warm_up
 from wavetracker.gpu_harmonic_group import (
     get_fundamentals,
     harmonic_group_pipeline,
+    resolve_engine,
 )
+from wavetracker.harmonic_pool import HarmonicGroupPool
 from wavetracker.logger import get_logger, get_progress, configure_logging
 from wavetracker.spectrogram import (
     Spectrogram,
     compute_aligned_snippet_length,
+    decimation_factor,
     get_step_and_overlap,
 )
+from wavetracker.stages import StagedPipeline
+from wavetracker.thresholds import ThresholdEstimator
+from wavetracker.torch_harmonic_group import fundamentals
 from wavetracker.tracking import freq_tracking_v6
 import typer
 
@@ -40,6 +55,9 @@ class AnalysisPipeline:
 
     """
 
+    # arrays that only grow, checkpoints append their new rows to raw files
+    appended_arrays = ("fund_v", "idx_v", "sign_v", "times", "fine_times")
+
     def __init__(
         self,
         data,
@@ -54,6 +72,8 @@ class AnalysisPipeline:
         spec,
         logger=None,
         gpu_use=False,
+        checkpoint_interval=0,
+        resume=False,
     ):
         """
         Constructs all the necessary attributes for the main analysis pipeline of the wavetracker-package to analyse
@@ -84,6 +104,12 @@ class AnalysisPipeline:
                 Logger object used to store analysis feedback (default in None).
             gpu_use : bool, optional
                 If True uses the way faster GPU analysis pipeline (default in False).
+            checkpoint_interval : int, optional
+                Number of snippets after which the analysis state is stored in a checkpoint, so that an interrupted
+                analysis can be resumed (default is 0, i.e. no checkpoints).
+            resume : bool, optional
+                If True continues the analysis after the last snippet stored in an existing checkpoint (default is
+                False).
         """
         self.save_path = save_path
 
@@ -99,6 +125,24 @@ class AnalysisPipeline:
         self.logger = logger
         self.gpu_use = gpu_use
         self.core_count = multiprocessing.cpu_count()
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_path = os.path.join(self.save_path, "checkpoint")
+        # rows of the appended arrays already stored in the checkpoint
+        self._checkpoint_rows = {}
+        self.stage_stats = {}
+        self.hg_engine = cfg.analysis.get("harmonic_groups_engine", "auto")
+        self._hg_pool = None
+        self.thresholds = ThresholdEstimator(
+            cfg.harmonic_groups["low_thresh_factor"],
+            cfg.harmonic_groups["high_thresh_factor"],
+            low_threshold=cfg.harmonic_groups["low_threshold"],
+            high_threshold=cfg.harmonic_groups["high_threshold"],
+            interval=cfg.analysis.get("threshold_interval", 600.0),
+            n_frames=cfg.analysis.get("threshold_frames", 32),
+            max_drift=cfg.analysis.get("threshold_drift", 3.0),
+        )
+        # estimate of the last consumed snippet, for checkpoints
+        self._threshold_state = self.thresholds.state()
 
         self.Spec = spec
         # self.Spec = Spectrogram(
@@ -114,19 +158,31 @@ class AnalysisPipeline:
         self._get_signals = True
         self.do_tracking = True
 
+        spill = cfg.analysis.get("detection_memory", 0)
+        self._fund_v, self._idx_v, self._sign_v = (
+            AppendBuffer(
+                dtype=dtype,
+                max_memory=spill * 1024**3 if spill else None,
+                spill_dir=self.save_path,
+            )
+            for dtype in (float, int, None)
+        )
+
         # load
         if os.path.exists(os.path.join(self.save_path, "fund_v.npy")):
             msg = "Loading pre-analyzed data."
             log.info(msg)
-            self._fund_v = np.load(
-                os.path.join(self.save_path, "fund_v.npy"), allow_pickle=True
-            )
-            self._idx_v = np.load(
-                os.path.join(self.save_path, "idx_v.npy"), allow_pickle=True
-            )
-            self._sign_v = np.load(
-                os.path.join(self.save_path, "sign_v.npy"), allow_pickle=True
-            )
+            for buffer, name in (
+                (self._fund_v, "fund_v"),
+                (self._idx_v, "idx_v"),
+                (self._sign_v, "sign_v"),
+            ):
+                buffer.extend(
+                    np.load(
+                        os.path.join(self.save_path, f"{name}.npy"),
+                        allow_pickle=True,
+                    )
+                )
             self.ident_v = np.load(
                 os.path.join(self.save_path, "ident_v.npy"), allow_pickle=True
             )
@@ -139,12 +195,17 @@ class AnalysisPipeline:
         else:
             msg = "No pre-analyzed data found."
             log.info(msg)
-            self._fund_v = []
-            self._idx_v = []
-            self._sign_v = []
             self.ident_v = []
             self.times = []
 
+            if resume:
+                self.load_checkpoint()
+            elif os.path.exists(self.checkpoint_path):
+                log.info(
+                    "Found a checkpoint of an interrupted analysis; "
+                    "use --resume to continue it."
+                )
+
         msg = "Analysis pipeline initialized."
         log.info(msg)
 
@@ -163,9 +224,9 @@ class AnalysisPipeline:
         setting.
         """
         if get_sigs:
-            self._fund_v = []
-            self._idx_v = []
-            self._sign_v = []
+            self._fund_v.clear()
+            self._idx_v.clear()
+            self._sign_v.clear()
             self.ident_v = []
             self.times = []
         self._get_signals = bool(get_sigs)
@@ -175,21 +236,21 @@ class AnalysisPipeline:
         """
         Assures this vector to be extracted from the class as numpy.array.
         """
-        return np.array(self._fund_v)
+        return self._fund_v.to_array()
 
     @property
     def idx_v(self):
         """
         Assures this vector to be extracted from the class as numpy.array.
         """
-        return np.array(self._idx_v)
+        return self._idx_v.to_array()
 
     @property
     def sign_v(self):
         """
         Assures this vector to be extracted from the class as numpy.array.
         """
-        return np.array(self._sign_v)
+        return self._sign_v.to_array()
 
     def run(self):
         """
@@ -213,7 +274,8 @@ class AnalysisPipeline:
             f"-- fine spec: {self.Spec.get_fine_spec}\n"
             f"-- plotable spec: {self.Spec.get_sparse_spec}\n"
             f"-- signal extract: {self._get_signals}\n"
-            f"-- snippet size: {self.Spec.snippet_size / self.samplerate:.2f}s\n"
+            f"-- snippet size: "
+            f"{self.Spec.snippet_size / self.Spec.samplerate:.2f}s\n"
         )
 
         self.logger.info(f"GPU use : {self.gpu_use}\n")
@@ -228,8 +290,14 @@ class AnalysisPipeline:
             # else:
             #     self.pipeline_CPU()
             self.times = self.Spec.times
+            if self._get_signals:
+                self.ident_v = np.full(len(self._idx_v), np.nan)
             self.save()
+            self.clear_checkpoint()
             self.Spec.close()
+            if self._hg_pool is not None:
+                self._hg_pool.close()
+                self._hg_pool = None
 
         if self.verbose >= 1:
             self.logger.info(
@@ -255,50 +323,125 @@ class AnalysisPipeline:
     def pipeline_GPU(self):
         """
         Executes the analysis pipeline comprising spectrogram analysis and signal extracting using GPU.
+
+        With a "pipeline_depth" larger than zero in the analysis config, the spectrogram and harmonic group steps run
+        as threaded stages connected by bounded queues, so that the spectrogram of the next snippet is computed while
+        the signals and spectrograms of the current snippet are stored. The snippets are still consumed in order.
         """
-        iterations = self.dataset.nblocks
-        with get_progress() as pbar:
-            desc = "Spectrogram + Harmonic Group"
-            task = pbar.add_task(desc, total=iterations + 1, transient=True)
-            for enu, snippet_data in enumerate(self.dataset):
-                t0_snip = time.time()
-                snippet_t0 = (
-                    self.Spec.itter_count
-                    * self.Spec.snippet_size
-                    / self.samplerate
-                ) + (self.Spec.snippet_overlap // 2) / self.samplerate
-
-                self.logger.debug(f"Snippet {enu} t0: {snippet_t0:.2f}s")
-
-                if (
-                    self.data.shape[0] // self.Spec.snippet_size
-                    == self.Spec.itter_count
-                ):
-                    self.Spec.terminate = True
-
-                t0_spec = time.time()
-                self.Spec.snippet_spectrogram(
-                    snippet_data.T, snipptet_t0=snippet_t0
-                )
-                t1_spec = time.time()
-
-                t0_hg = time.time()
-                if self._get_signals:
-                    self.extract_snippet_signals()
-                t1_hg = time.time()
-
-                t1_snip = time.time()
-                if self.verbose == 3:
-                    self.logger.info(
-                        f"Progress {enu / iterations:3.1%}\n"
-                        f"-- Spectrogram: {t1_spec - t0_spec:.2f}s\n"
-                        f"-- Harmonic group: {t1_hg - t0_hg:.2f}s\n"
-                        f"--> {t1_snip - t0_snip:.2f}s\n",
-                    )
-                pbar.update(task, advance=1)
 
-            # if enu == iterations - 1:
-            #     break
+        def spectrogram_stage(snippet_data):
+            t0_spec = time.time()
+            spectra = self.Spec.compute_snippet(snippet_data.T)
+            return spectra, time.time() - t0_spec
+
+        def signal_stage(item):
+            spectra, t_spec = item
+            t0_hg = time.time()
+            signals = None
+            if self._get_signals:
+                spec, sum_spec, spec_freqs, _ = spectra
+                signals = self.snippet_signals(sum_spec, spec, spec_freqs)
+            # the stage may run ahead of the consumed snippets
+            threshold_state = self.thresholds.state()
+            t_hg = time.time() - t0_hg
+            return spectra, signals, threshold_state, t_spec, t_hg
+
+        stages = [
+            ("spectrogram", spectrogram_stage),
+            ("harmonic groups", signal_stage),
+        ]
+        if self._get_signals and resolve_engine(self.hg_engine) == "numba":
+            # numba's threading layer has to start on the main thread, the
+            # process does not exit after a first launch in a stage thread
+            warm_up(self.cfg)
+        if (
+            self._get_signals
+            and self.hg_engine == "thunderfish"
+            and self._hg_pool is None
+        ):
+            # started before the stage threads, not from one of them
+            self._hg_pool = HarmonicGroupPool()
+        pipeline = None
+        depth = self.cfg.analysis.get("pipeline_depth", 0)
+        if depth > 0:
+            pipeline = StagedPipeline(stages, depth=depth)
+            results = pipeline.run(self.dataset)
+        else:
+            results = (
+                signal_stage(spectrogram_stage(snippet_data))
+                for snippet_data in self.dataset
+            )
+
+        try:
+            iterations = self.dataset.nblocks
+            with get_progress() as pbar:
+                desc = "Spectrogram + Harmonic Group"
+                task = pbar.add_task(
+                    desc,
+                    total=iterations + 1,
+                    completed=self.dataset.start_block,
+                    transient=True,
+                )
+                t0_snip = time.time()
+                for enu, (
+                    spectra,
+                    signals,
+                    threshold_state,
+                    t_spec,
+                    t_hg,
+                ) in enumerate(results, start=self.dataset.start_block):
+                    snippet_t0 = (
+                        self.Spec.itter_count
+                        * self.Spec.snippet_size
+                        / self.Spec.samplerate
+                    ) + (self.Spec.snippet_overlap // 2) / self.Spec.samplerate
+
+                    self.logger.debug(f"Snippet {enu} t0: {snippet_t0:.2f}s")
+
+                    if (
+                        self.Spec.data_shape[0] // self.Spec.snippet_size
+                        == self.Spec.itter_count
+                    ):
+                        self.Spec.terminate = True
+
+                    t0_store = time.time()
+                    self.Spec.consume_snippet(*spectra, snipptet_t0=snippet_t0)
+                    if signals is not None:
+                        self.append_signals(*signals)
+                    self._threshold_state = threshold_state
+                    t1_store = time.time()
+
+                    t1_snip = time.time()
+                    if self.verbose == 3:
+                        self.logger.info(
+                            f"Progress {enu / iterations:3.1%}\n"
+                            f"-- Spectrogram: {t_spec:.2f}s\n"
+                            f"-- Harmonic group: {t_hg:.2f}s\n"
+                            f"-- Storage: {t1_store - t0_store:.2f}s\n"
+                            f"--> {t1_snip - t0_snip:.2f}s\n",
+                        )
+                    pbar.update(task, advance=1)
+
+                    if (
+                        self.checkpoint_interval > 0
+                        and (enu + 1) % self.checkpoint_interval == 0
+                        and not self.Spec.terminate
+                    ):
+                        self.checkpoint(enu)
+                    t0_snip = time.time()
+
+                # if enu == iterations - 1:
+                #     break
+        finally:
+            # stops the stage threads when the analysis is interrupted
+            results.close()
+
+        if pipeline is not None:
+            self.stage_stats = {
+                stats.name: stats.as_dict() for stats in pipeline.stats
+            }
+            if self.verbose >= 1:
+                pipeline.log_stats(self.logger)
         return
 
     # def pipeline_CPU(self):
@@ -354,38 +497,80 @@ class AnalysisPipeline:
     #
     def extract_snippet_signals(self):
         """
-        Extracts harmonic groups from a snippet spectrogram. Different features of the extracted signals are sorted in
-        the output arrays of the pipeline, i.e. their fundamental frequencies in "fund_v", the power of these frequencies
-        accross recording electrodes in "sign_v", and their associated time indices in "idx_v".
+        Extracts harmonic groups from the current snippet spectrogram and appends the extracted signals to the output
+        arrays of the pipeline, i.e. their fundamental frequencies in "fund_v", the power of these frequencies accross
+        recording electrodes in "sign_v", and their associated time indices in "idx_v".
+        """
+        self.append_signals(
+            *self.snippet_signals(
+                self.Spec.sum_spec, self.Spec.spec, self.Spec.spec_freqs
+            )
+        )
+        self._threshold_state = self.thresholds.state()
 
-        Different pathways for GPU assisted analysis and standard CPU analysis are available and executed depending on
-        Hardware availability.
+    def snippet_signals(self, sum_spec, spec, spec_freqs):
         """
-        if self.gpu_use:
-            assigned_hg, peaks, log_spec = harmonic_group_pipeline(
-                self.Spec.sum_spec,
-                self.Spec.spec_freqs,
+        Extracts harmonic groups from a snippet spectrogram without changing the state of the pipeline, apart from
+        the peak detection thresholds, which are estimated on the snippets in recording order (see
+        "ThresholdEstimator").
+
+        The "harmonic_groups_engine" of the analysis config selects the CUDA kernels ("cuda"), their numba CPU versions
+        ("numba"), their torch version ("torch"), or the thunderfish implementation ("thunderfish"). By default ("auto")
+        the CUDA kernels are used if a GPU is available and the numba CPU versions otherwise. The torch version runs on
+        the device of a summed spectrogram tensor and only copies the fundamentals to the host.
+
+        Parameters
+        ----------
+            sum_spec : 2d-array, 2d-tensor
+                Spectrogram of the snippet summed up over all channels, possibly a tensor on the compute device.
+            spec : 3d-array, 3d-tensor
+                Spectrograms of the single channels (channels x frequencies x times), possibly a tensor on the
+                compute device.
+            spec_freqs : 1d-array
+                Frequencies of the spectrograms.
+
+        Returns
+        -------
+            fund_v : 1d-array
+                Fundamental frequencies of the extracted signals.
+            idx_v : 1d-array
+                Time indices of the signals relative to the snippet.
+            sign_v : 2d-array
+                Power of the signals at their fundamental frequency in each channel.
+        """
+        if self.hg_engine != "thunderfish":
+            duration = sum_spec.shape[1] * self.Spec.step / self.Spec.samplerate
+            thresholds = self.thresholds(sum_spec, duration)
+        if self.hg_engine == "torch":
+            tmp_fund_v, tmp_idx_v, f_idx = fundamentals(
+                sum_spec,
+                spec_freqs,
                 self.cfg,
                 verbose=self.verbose,
+                thresholds=thresholds,
             )
-            tmp_fundamentals = get_fundamentals(
-                assigned_hg, self.Spec.spec_freqs
+            tmp_sign_v = self.Spec.signatures(spec, f_idx, tmp_idx_v)
+            return tmp_fund_v, tmp_idx_v, tmp_sign_v
+
+        if isinstance(sum_spec, torch.Tensor):
+            sum_spec = sum_spec.cpu().numpy()
+        if self.hg_engine != "thunderfish":
+            assigned_hg, peaks, log_spec = harmonic_group_pipeline(
+                sum_spec,
+                spec_freqs,
+                self.cfg,
+                verbose=self.verbose,
+                engine=self.hg_engine,
+                thresholds=thresholds,
             )
+            tmp_fundamentals = get_fundamentals(assigned_hg, spec_freqs)
         else:
-            partial_harmonic_groups = partial(
-                harmonic_groups,
-                self.Spec.spec_freqs,
-                **self.cfg.harmonic_groups,
-            )
-
-            pool = multiprocessing.Pool(self.core_count - 1)
-            a = pool.map(
-                partial_harmonic_groups, self.Spec.sum_spec.transpose()
+            if self._hg_pool is None:
+                self._hg_pool = HarmonicGroupPool()
+            a = self._hg_pool.harmonic_groups(
+                spec_freqs, sum_spec.transpose(), **self.cfg.harmonic_groups
             )
-
-            groups_per_time = [a[groups][0] for groups in range(len(a))]
-            tmp_fundamentals = pool.map(fundamental_freqs, groups_per_time)
-            pool.terminate()
+            tmp_fundamentals = [fundamental_freqs(groups[0]) for groups in a]
 
         tmp_fund_v = np.hstack(tmp_fundamentals)
         tmp_idx_v = np.array(
@@ -398,19 +583,161 @@ class AnalysisPipeline:
             dtype=int,
         )
         f_idx = [
-            np.argmin(np.abs(self.Spec.spec_freqs - f))
+            np.argmin(np.abs(spec_freqs - f))
             for i in range(len(tmp_fundamentals))
             for f in tmp_fundamentals[i]
         ]
 
-        tmp_sign_v = self.Spec.spec[:, f_idx, tmp_idx_v].transpose()
+        tmp_sign_v = self.Spec.signatures(spec, f_idx, tmp_idx_v)
+        return tmp_fund_v, tmp_idx_v, tmp_sign_v
+
+    def append_signals(self, fund_v, idx_v, sign_v):
+        """
+        Appends the signals extracted from the current snippet spectrogram to the output arrays of the pipeline.
 
+        Parameters
+        ----------
+            fund_v : 1d-array
+                Fundamental frequencies of the extracted signals.
+            idx_v : 1d-array
+                Time indices of the signals relative to the current snippet.
+            sign_v : 2d-array
+                Power of the signals at their fundamental frequency in each channel.
+        """
         idx_0 = len(self.Spec.times) - len(self.Spec.spec_times)
 
-        self._fund_v.extend(tmp_fund_v)
-        self._idx_v.extend(tmp_idx_v + idx_0)
-        self._sign_v.extend(tmp_sign_v)
-        self.ident_v = np.full(len(self._idx_v), np.nan)
+        self._fund_v.extend(fund_v)
+        self._idx_v.extend(idx_v + idx_0)
+        self._sign_v.extend(sign_v)
+
+    def checkpoint(self, snippet):
+        """
+        Stores the state of the analysis after a completed snippet, i.e. the extracted signals, the spectrogram progress
+        and the estimated peak detection thresholds. The signals and times only grow, so only the rows added since the
+        previous checkpoint are appended to their files, and only the changed time bins of the sparse spectrogram are
+        updated. Other files are replaced atomically. The state file, which holds the length of the valid data, is
+        written last, so that an interruption while writing leaves a usable checkpoint.
+
+        Parameters
+        ----------
+            snippet : int
+                Index of the last completed snippet.
+        """
+        os.makedirs(self.checkpoint_path, exist_ok=True)
+
+        arrays = {
+            "fund_v": self._fund_v,
+            "idx_v": self._idx_v,
+            "sign_v": self._sign_v,
+        }
+        spec_state = {}
+        for key, value in self.Spec.checkpoint_state().items():
+            if isinstance(value, np.ndarray):
+                arrays[key] = value
+            else:
+                spec_state[key] = value
+        sparse_columns = spec_state.pop("sparse_columns", None)
+        state = {
+            "snippet": int(snippet),
+            # appended arrays may hold more rows; mark their valid prefix
+            "lengths": {name: len(array) for name, array in arrays.items()},
+            # dtype and row shape of the raw files of the appended arrays
+            "layout": {},
+            "spectrogram": spec_state,
+            "thresholds": self._threshold_state,
+        }
+        for name, array in arrays.items():
+            path = os.path.join(self.checkpoint_path, f"{name}.npy")
+            if name in self.appended_arrays:
+                if isinstance(array, AppendBuffer) and len(array) == 0:
+                    # no signals yet, their row shape is unknown
+                    continue
+                path = os.path.join(self.checkpoint_path, f"{name}.bin")
+                append_rows(path, array, self._checkpoint_rows.get(name, 0))
+                if isinstance(array, AppendBuffer):
+                    row_shape = array.row_shape
+                else:
+                    row_shape = array.shape[1:]
+                state["layout"][name] = [array.dtype.str, list(row_shape)]
+            elif name == "sparse_spectra" and name in self._checkpoint_rows:
+                # keeps its shape; update the changed time bins in place
+                if sparse_columns is not None:
+                    columns = slice(*sparse_columns)
+                    stored = np.lib.format.open_memmap(path, mode="r+")
+                    stored[:, columns] = array[:, columns]
+                    stored.flush()
+                    del stored
+            else:
+                tmp = os.path.join(self.checkpoint_path, f"{name}.tmp.npy")
+                np.save(tmp, array)
+                os.replace(tmp, path)
+
+        tmp = os.path.join(self.checkpoint_path, "state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(self.checkpoint_path, "state.json"))
+        self._checkpoint_rows = state["lengths"]
+        self.logger.debug(f"Checkpoint after snippet {snippet}.")
+
+    def load_checkpoint(self):
+        """
+        Restores the state of an interrupted analysis from its checkpoint and sets the dataset to continue with the
+        snippet following the last completed one.
+
+        Returns
+        -------
+            resumed : bool
+                True if a checkpoint was found and restored.
+        """
+        state_file = os.path.join(self.checkpoint_path, "state.json")
+        if not os.path.exists(state_file):
+            log.info("No checkpoint found; starting from the beginning.")
+            return False
+
+        with open(state_file) as f:
+            state = json.load(f)
+        arrays = {}
+        for name, length in state["lengths"].items():
+            path = os.path.join(self.checkpoint_path, f"{name}.npy")
+            if name in state["layout"]:
+                dtype, row_shape = state["layout"][name]
+                path = os.path.join(self.checkpoint_path, f"{name}.bin")
+                arrays[name] = read_rows(path, dtype, row_shape, length)
+            elif name in self.appended_arrays:
+                arrays[name] = np.array([])
+            else:
+                arrays[name] = np.load(path)[:length]
+        self._checkpoint_rows = state["lengths"]
+
+        self._fund_v.extend(arrays.pop("fund_v"))
+        self._idx_v.extend(arrays.pop("idx_v"))
+        self._sign_v.extend(arrays.pop("sign_v"))
+        self.thresholds.restore(state["thresholds"])
+        self._threshold_state = self.thresholds.state()
+
+        self.Spec.restore_state({**state["spectrogram"], **arrays})
+        self.dataset.start_block = state["snippet"] + 1
+        if self.Spec.stream is not None:
+            # samples of the incomplete windows before the next snippet
+            start = self.dataset.start_block * (
+                self.dataset.block_size - self.dataset.noverlap
+            )
+            self.Spec.prime_stream(
+                lambda a, b: self.dataset.samples(a, b).T, start
+            )
+
+        log.info(
+            f"Resuming analysis at snippet {self.dataset.start_block} "
+            f"of {self.dataset.nblocks + 1}."
+        )
+        return True
+
+    def clear_checkpoint(self):
+        """
+        Removes the checkpoint once the analysis results are saved.
+        """
+        if os.path.exists(self.checkpoint_path):
+            shutil.rmtree(self.checkpoint_path)
 
     def save(self):
         """
@@ -419,11 +746,15 @@ class AnalysisPipeline:
         if not os.path.exists(self.save_path):
             os.makedirs(self.save_path)
 
-        np.save(os.path.join(self.save_path, "fund_v.npy"), self.fund_v)
+        self._fund_v.save(os.path.join(self.save_path, "fund_v.npy"))
         np.save(os.path.join(self.save_path, "ident_v.npy"), self.ident_v)
-        np.save(os.path.join(self.save_path, "idx_v.npy"), self.idx_v)
+        self._idx_v.save(os.path.join(self.save_path, "idx_v.npy"))
         np.save(os.path.join(self.save_path, "times.npy"), self.times)
-        np.save(os.path.join(self.save_path, "sign_v.npy"), self.sign_v)
+        self._sign_v.save(os.path.join(self.save_path, "sign_v.npy"))
+        np.save(
+            os.path.join(self.save_path, "channels.npy"),
+            self.Spec.channel_list,
+        )
 
         self.Spec.save()
 
@@ -434,6 +765,8 @@ def wavetracker(
     verbose=0,
     renew=False,
     nosave=False,
+    channel_check=False,
+    resume=False,
 ):
     # STEP 0: Check if dataset is single file or directory of many .wav files
     file, folder = None, None
@@ -456,18 +789,42 @@ def wavetracker(
     cfg = Configuration(config, verbose=verbose, logger=log)
 
     # STEP 2: Load the raw data
+    session_index = None
+    if isinstance(file, list) and len(file) > 0:
+        session_index = SessionIndex.open(
+            file, os.path.join(save_path, "session_index.json"), logger=log
+        )
     data, samplerate, channels, data_shape = open_raw_data(
         filename=file,
         verbose=verbose,
         logger=log,
+        reader=cfg.raw.get("reader", "thunderlab"),
+        session_index=session_index,
         **cfg.spectrogram,
     )
 
+    channel_list = select_channels(
+        channels,
+        cfg.spectrogram.get("channels"),
+        cfg.spectrogram.get("exclude_channels"),
+    )
+    channel_check_cfg = dict(getattr(cfg, "channel_check", None) or {})
+    if channel_check or channel_check_cfg.pop("enabled", False):
+        channel_list = check_channels(
+            data, samplerate, channel_list, save_path, **channel_check_cfg
+        )
+    if len(channel_list) < channels:
+        log.info(f"Analysing channels: {channel_list.tolist()}")
+
     # STEP 3: Set the snippet size in accordance with the spectrogram parameters
     usable_snippet_length = int(cfg.spectrogram["snippet_size"] * samplerate)
     snippet_overlap = int(
         cfg.spectrogram["snippet_overlap_frac"] * usable_snippet_length
     )
+    stream = cfg.spectrogram.get("stream", False)
+    if stream:
+        # the stream carries the samples needed by the next snippet
+        snippet_overlap = 0
     total_snippet_length = usable_snippet_length + snippet_overlap
 
     step, overlap = get_step_and_overlap(
@@ -479,27 +836,65 @@ def wavetracker(
         total_snippet_length, step, overlap
     )
 
+    # the spectrogram is computed from the decimated data, with nfft and
+    # step scaled down so that its resolution stays the same
+    decimation = 1
+    if cfg.spectrogram.get("decimate", False):
+        max_freq = (
+            cfg.harmonic_groups["max_freq"]
+            * cfg.harmonic_groups["min_group_size"]
+        )
+        band = cfg.spectrogram.get("fine_spec_band")
+        if band is not None:
+            max_freq = max(max_freq, band[1])
+        decimation = decimation_factor(
+            samplerate, max_freq, cfg.spectrogram["nfft"], step
+        )
+        better_snippet_size_samples -= better_snippet_size_samples % decimation
+        snippet_overlap -= snippet_overlap % decimation
+        log.info(f"Decimating the data by {decimation} before the STFT.")
+
     # STEP 4: Generate the torch iterator dataset object
     # Just a better way to iterate through the dataset for spectrogram analysis
     dataset = MultiChannelAudioDataset(
         data_loader=data,
         block_size=better_snippet_size_samples,
         noverlap=snippet_overlap,  # This is NOT the noverlap of the spectrogram!
+        prefetch=cfg.raw.get("prefetch_blocks", 0),
+        max_prefetch_memory=cfg.raw.get("prefetch_memory", 0) * 1024**3,
+        channels=channel_list,
     )
 
     # STEP 5: Generate the Spectrogram object
     spec = Spectrogram(
-        samplerate=samplerate,
-        snippet_size=better_snippet_size_samples,
-        snippet_overlap=snippet_overlap,
-        data_shape=data_shape,
-        nfft=cfg.spectrogram["nfft"],
-        step=step,
-        noverlap=overlap,
+        samplerate=samplerate / decimation,
+        snippet_size=better_snippet_size_samples // decimation,
+        snippet_overlap=snippet_overlap // decimation,
+        data_shape=(data_shape[0] // decimation, *data_shape[1:]),
+        nfft=cfg.spectrogram["nfft"] // decimation,
+        step=step // decimation,
+        noverlap=overlap // decimation,
         channels=channels,
+        channel_list=channel_list,
         verbose=verbose,
         folder=save_path,
         overlap_frac=cfg.spectrogram["overlap_frac"],
+        fine_spec_dtype=cfg.spectrogram.get("fine_spec_dtype", "float32"),
+        fine_spec_scale=cfg.spectrogram.get("fine_spec_scale", 1.0),
+        fine_spec_band=cfg.spectrogram.get("fine_spec_band"),
+        pyramid_levels=cfg.spectrogram.get("pyramid_levels", 0),
+        sparse_spec_dtype=cfg.spectrogram.get("sparse_spec_dtype"),
+        db_range=cfg.spectrogram.get("db_range"),
+        device_spec=cfg.spectrogram.get("device_spec", False),
+        stft_memory=cfg.spectrogram.get("stft_memory", 0) * 1e9,
+        stft_backend=cfg.spectrogram.get("stft_backend", "torch"),
+        signature_band=(
+            cfg.harmonic_groups["min_freq"],
+            cfg.harmonic_groups["max_freq"],
+        ),
+        stream=stream,
+        decimation=decimation,
+        recording_length=data_shape[0],
     )
 
     # STEP 6: Initialize analysis pipeline class
@@ -516,6 +911,8 @@ def wavetracker(
         logger=log,
         gpu_use=True,
         spec=spec,
+        checkpoint_interval=cfg.analysis.get("checkpoint_interval", 0),
+        resume=resume and not renew,
     )
 
     if renew:
@@ -562,6 +959,16 @@ def main(
         "--nosave",
         help="Dont save data.",
     ),
+    channel_check: bool = typer.Option(
+        False,
+        "--check-channels",
+        help="Pre-scan the recording and exclude dead or clipped channels.",
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help="Continue an interrupted analysis from its last checkpoint.",
+    ),
 ) -> None:
     """Run wavetracker on a single recording."""
     configure_logging(verbosity, log_to_file)
@@ -571,6 +978,8 @@ def main(
         verbose=verbosity,
         renew=renew,
         nosave=no_save,
+        channel_check=channel_check,
+        resume=resume,
     )
 
 